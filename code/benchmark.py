@@ -0,0 +1,172 @@
+import glob
+import time
+import random
+import argparse
+
+from tests.reference import (
+    legacy_align_tokens, legacy_annotation_mapper, make_line, segment_normalized, make_annotations
+)
+
+def timeit(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_align(args):
+    from tokenization.offset_utils import align_tokens
+
+    for num_tokens in args.sizes:
+        line, tokens = make_line(num_tokens)
+        legacy_time, _ = timeit(legacy_align_tokens, line, tokens)
+        new_time, _ = timeit(align_tokens, line, tokens)
+        print(f"chars:{len(line)} tokens:{num_tokens} legacy:{legacy_time:.4f}秒 new:{new_time:.4f}秒")
+
+def load_lines(args):
+    if args.plain_dir is None:
+        line, _ = make_line(max(args.sizes))
+        return [line[:size] for size in args.sizes]
+
+    lines = []
+    for file_path in sorted(glob.glob(f"{args.plain_dir}/**/*.txt", recursive=True)):
+        with open(file_path, "r") as f:
+            lines += [line for line in f.read().split("\n") if len(line.strip()) != 0]
+    return lines
+
+def bench_nfkc(args):
+    # tohoku_bertのオフセット計算を以前の方法と比較(結果の一致はtests/test_offset_utils.pyで確認)
+    from tokenization.offset_utils import align_nfkc_tokens, _align_nfkc_tokens_by_span
+
+    def run(func, line, tokens):
+        try:
+            return func(line, tokens, len(tokens))
+        except Exception:
+            return None
+
+    rand = random.Random(0)
+    inputs = [(line, segment_normalized(line, rand)) for line in load_lines(args)]
+
+    legacy_time, _ = timeit(lambda: [run(_align_nfkc_tokens_by_span, *x) for x in inputs], repeat=1)
+    new_time, _ = timeit(lambda: [run(align_nfkc_tokens, *x) for x in inputs], repeat=1)
+    print(f"lines:{len(inputs)} legacy:{legacy_time:.4f}秒 new:{new_time:.4f}秒")
+
+def bench_mapper(args):
+    import copy
+    from tokenization.annotation_utils import annotation_mapper
+    from tokenization.offset_utils import align_tokens
+
+    for num_tokens in args.sizes:
+        line, tokens = make_line(num_tokens)
+        offsets, _ = align_tokens(line, tokens)
+        tokenized_sentences = [[(token, s, e) for token, (s, e) in zip(tokens, offsets)]]
+        annotation = make_annotations(line, tokenized_sentences[0], num_tokens // 10)
+
+        legacy_time, _ = timeit(lambda: legacy_annotation_mapper(copy.deepcopy(annotation), tokenized_sentences))
+        new_time, _ = timeit(lambda: annotation_mapper(copy.deepcopy(annotation), tokenized_sentences))
+        print(f"tokens:{num_tokens} annotations:{len(annotation)} legacy:{legacy_time:.4f}秒 new:{new_time:.4f}秒")
+
+def bench_jumanpp(args):
+    # jumanppのスタブを使い、1行ずつの解析とまとめての解析の時間を比較(結果の一致はtests/test_juman.pyで確認)
+    import os
+    from collections import Counter
+    from tokenization.juman import JumanppProcessTokenizer
+
+    command = os.environ.get(
+        "JUMANPP_COMMAND",
+        f"python3 {os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenization', 'jumanpp_stub.py')}"
+    )
+    for num_lines in args.sizes:
+        rand = random.Random(0)
+        text = "\n".join(make_line(rand.randint(1, 50), seed=i)[0] for i in range(num_lines))
+
+        for batch_size in [1, JumanppProcessTokenizer.batch_size]:
+            tokenizer = JumanppProcessTokenizer(command)
+            tokenizer.batch_size = batch_size
+            tokenizer.tokenize_text("warmup", Counter())
+            elapsed, _ = timeit(tokenizer.tokenize_text, text, Counter(), repeat=1)
+            tokenizer.process.close()
+            print(f"lines:{num_lines} batch_size:{batch_size} {elapsed:.4f}秒")
+
+def load_documents(args):
+    if args.plain_dir is None:
+        return ["\n".join(load_lines(args))]
+
+    documents = []
+    for file_path in sorted(glob.glob(f"{args.plain_dir}/**/*.txt", recursive=True)):
+        with open(file_path, "r") as f:
+            documents.append(f.read())
+    return documents
+
+def bench_tohoku(args):
+    # tohoku_bertのtransformers版とtokenizers版の時間を比較(結果の一致はtests/test_tohoku_bert.pyで確認)
+    from collections import Counter
+    from tokenization.tohoku_bert import TohokuBertTokenizer, TohokuBertFastTokenizer, get_mecab_dic_dir, get_vocab_dir
+
+    vocab_dir = get_vocab_dir(args.vocab_dir)
+    assert vocab_dir is not None, "--vocab_dirにvocab.txtのフォルダを指定してください。"
+    mecab_dic_dir = get_mecab_dic_dir()
+    documents = load_documents(args)
+
+    for name, tokenizer in [
+        ("transformers", TohokuBertTokenizer(mecab_dic_dir, vocab_dir)),
+        ("tokenizers", TohokuBertFastTokenizer(mecab_dic_dir, vocab_dir)),
+    ]:
+        def run():
+            errors = Counter()
+            return [tokenizer.tokenize_text(text, errors) for text in documents], errors
+        elapsed, (_, errors) = timeit(run, repeat=1)
+        print(f"documents:{len(documents)} backend:{name} {elapsed:.4f}秒 errors:{dict(errors)}")
+
+def report_init_time(_):
+    from tokenization import tokenize_utils
+    return tokenize_utils._init_time
+
+def bench_tohoku_init(args):
+    # tohoku_bertのワーカーの起動時間を、親プロセスで語彙を読み込む場合と読み込まない場合で比較
+    import multiprocessing
+    from tokenization import tohoku_bert
+    from tokenization.tokenize_utils import init_worker
+
+    parallel = args.parallel or multiprocessing.cpu_count()
+    for backend in ["transformers", "tokenizers"]:
+        spec = tohoku_bert.get_tokenizer_spec(backend, args.vocab_dir)
+        for preload in [False, True]:
+            tohoku_bert._assets.clear()
+            start = time.perf_counter()
+            if preload:
+                spec[1].preload(**spec[2])
+            preload_time = time.perf_counter() - start
+
+            # 全てのワーカーが初期化を終えるまでの時間
+            with multiprocessing.Pool(parallel, initializer=init_worker, initargs=([spec],)) as p:
+                init_times = p.map(report_init_time, range(parallel), chunksize=1)
+            elapsed = time.perf_counter() - start
+            print(
+                f"backend:{backend} preload:{preload} workers:{parallel} "
+                f"parent:{preload_time:.4f}秒 worker(max):{max(init_times):.4f}秒 total:{elapsed:.4f}秒"
+            )
+
+BENCHMARKS = {
+    "align": bench_align,
+    "nfkc": bench_nfkc,
+    "mapper": bench_mapper,
+    "jumanpp": bench_jumanpp,
+    "tohoku": bench_tohoku,
+    "tohoku_init": bench_tohoku_init,
+}
+
+def load_arg():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=[*BENCHMARKS])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 50000], help="トークン数")
+    parser.add_argument("--plain_dir", default=None, help="比較に使うプレーンテキストのフォルダ(指定がない場合は合成データ)")
+    parser.add_argument("--parallel", type=int, default=None, help="起動するワーカー数(tohoku_init、指定がない場合はコア数)")
+    parser.add_argument("--vocab_dir", default=None, help="tohoku_bertのvocab.txtがあるフォルダ(tohoku)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = load_arg()
+    BENCHMARKS[args.benchmark](args)
@@ -2,16 +2,47 @@ import os
 import re
 import json
 import glob
+import mmap
+import heapq
+import pickle
 import tqdm
 
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import multiprocessing as multi
 
-from html.parser import HTMLParser
+# シャードを構成する配列
+SHARD_ARRAYS = ("ids", "starts", "ends", "lines")
+# <script>の範囲の検出用(コメント内の<script>は無視する)
+SCRIPT_START_PATTERN = re.compile(rb"<!--|<script\b[^>]*>", re.IGNORECASE)
+COMMENT_END_PATTERN = re.compile(rb"-->")
+SCRIPT_END_PATTERN = re.compile(rb"</script\s*>", re.IGNORECASE)
+# <script>から</script>までがこれより多くの行にわたる場合は、閉じられていない<script>とみなして無視する
+MAX_SCRIPT_LINES = 200
+# アノテーションの行からJSONとして読み込まずにpage_idを取り出す
+PAGE_ID_PATTERN = re.compile(rb'"page_id":\s*"?([^",}\s]*)')
 
 class DataUtils(object):
+    @staticmethod
+    @contextmanager
+    def atomic_open(file_path, mode="w"):
+        """
+        一時ファイルに書き込み、書き終えてから置き換えます。
+        途中でプロセスが落ちても書きかけのファイルが残りません。
+        """
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, mode) as f:
+                yield f
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
     @staticmethod
     def load_oneliner_json(file_path, parallel=multi.cpu_count()):
         with open(file_path, "r") as f:
@@ -20,14 +51,6 @@ class DataUtils(object):
             with Pool(parallel) as p:
                 return p.map(json.loads, f)
 
-    @staticmethod
-    def load_annotation(category, file_path):
-        data = defaultdict(list)
-        with open(file_path, "r") as f:
-            for d in map(json.loads, f):
-                data[str(d["page_id"])].append(d)
-        return category, data
-
     @staticmethod
     def json_dumps(d):
         return json.dumps(d, ensure_ascii=False)
@@ -39,86 +62,509 @@ class DataUtils(object):
         else:
             with Pool(parallel) as p:
                 dumps = p.map(cls.json_dumps, data)
-        with open(file_path, "w") as f:
+        with cls.atomic_open(file_path, "w") as f:
             f.write("\n".join(dumps))
 
-    @classmethod
-    def wrp_load_annotation(cls, inputs):
-        return cls.load_annotation(*inputs)
+    @staticmethod
+    def save_html_alignment(file_path, alignment):
+        """
+        `offset_utils.align_html`の結果をint32の配列として書き出します。
+        [行数, 各行の先頭の位置(行数+1), 開始オフセット..., 終了オフセット...]の順です。
+        """
+        line_offsets, starts, ends = array("i", [0]), array("i"), array("i")
+        for char_starts, char_ends in alignment:
+            starts.extend(char_starts)
+            ends.extend(char_ends)
+            line_offsets.append(len(starts))
+
+        with DataUtils.atomic_open(file_path, "wb") as f:
+            array("i", [len(alignment)]).tofile(f)
+            line_offsets.tofile(f)
+            starts.tofile(f)
+            ends.tofile(f)
+
+    @staticmethod
+    def find_script_lines(file_path):
+        """
+        HTMLの<script>から</script>までを含む行の番号(0始まり)のリストを返します。
+        HTMLとして解析せず、バイト列のまま開始・終了タグのみを探します。
+        `<script ... />`は空の範囲とみなし、閉じられていない<script>と
+        MAX_SCRIPT_LINESより多くの行にわたる範囲は本文を含む恐れがあるため無視します。
+        """
+        with open(file_path, "rb") as f:
+            html = f.read()
+
+        lines = []
+        pos, line_id = 0, 0
+        while True:
+            m = SCRIPT_START_PATTERN.search(html, pos)
+            if m is None:
+                break
+
+            # 行番号は前回の位置からの改行数で求める
+            line_id += html.count(b"\n", pos, m.start())
+            pos = m.start()
+
+            is_comment = m.group(0) == b"<!--"
+            if is_comment:
+                end = COMMENT_END_PATTERN.search(html, m.end())
+                if end is None: # 閉じられていない場合は以降を無視
+                    break
+            elif m.group(0).endswith(b"/>"): # 空の<script>
+                end = m
+            else:
+                end = SCRIPT_END_PATTERN.search(html, m.end())
+
+            end_line_id = None if end is None else line_id + html.count(b"\n", m.start(), end.end())
+            if not is_comment and (end_line_id is None or end_line_id - line_id >= MAX_SCRIPT_LINES):
+                # 閉じられていない・長すぎる<script>は開始タグのみ読み飛ばす
+                line_id += html.count(b"\n", m.start(), m.end())
+                pos = m.end()
+                continue
+
+            if not is_comment and end is not m:
+                lines.extend(range(line_id, end_line_id + 1))
+
+            pos, line_id = end.end(), end_line_id
+        return lines
+
+    @staticmethod
+    def index_annotation(inputs):
+        category, file_path = inputs
+        return category, AnnotationIndex(file_path)
 
     @staticmethod
     def load_file(file_path):
         with open(file_path, "r") as f:
             return f.read()
 
-    @staticmethod
-    def save_file(file_path, data):
-        with open(file_path, "w") as f:
+    @classmethod
+    def save_file(cls, file_path, data):
+        with cls.atomic_open(file_path, "w") as f:
             f.write(data)
 
-    @classmethod
-    def save_tokenized_file(cls, inputs):
+    @staticmethod
+    def save_tokenized_file(inputs):
         temp_path, vocab, output_dir = inputs
 
-        tokenized_documents = cls.load_oneliner_json(temp_path, parallel=1)
-        for d in tokenized_documents:
+        tokenized_documents = TokenizedDocuments.load(temp_path)
+        # ワーカー内の語彙idから全体の語彙idへの変換表
+        id_table = tokenized_documents.id_table(vocab)
+        for page_id, token_ids, starts, ends, line_offsets in tokenized_documents:
             sentence_token_ids = []
-            for tokens in d["tokens"]:
-                if len(tokens) == 0:
-                    sentence_token_ids.append("")
-                    continue
-
-                token_ids = [",".join(map(str, [vocab.index(token), s, e])) for (token, s, e) in tokens]
-                sentence_token_ids.append(" ".join(token_ids))
+            for l in range(len(line_offsets) - 1):
+                sentence_token_ids.append(" ".join([
+                    f"{id_table[token_ids[i]]},{starts[i]},{ends[i]}"
+                    for i in range(line_offsets[l], line_offsets[l + 1])
+                ]))
 
             DataUtils.save_file(
-                os.path.join(output_dir, "tokens", f"{d['page_id']}.txt"),
+                os.path.join(output_dir, "tokens", f"{page_id}.txt"),
                 "\n".join(sentence_token_ids)
             )
+        return len(tokenized_documents)
+
+    @staticmethod
+    def load_tokenized_file(file_path):
+        """
+        `save_tokenized_file`で書き出したページを、行ごとの(語彙id, 開始, 終了)のリストとして読み込みます。
+        """
+        tokenized_sentences = []
+        for line in DataUtils.load_file(file_path).split("\n"):
+            tokenized_sentences.append([
+                tuple(map(int, token.split(","))) for token in line.split(" ") if len(token) != 0
+            ])
+        return tokenized_sentences
+
+    @staticmethod
+    def mmap_int32(file_path):
+        # 空のファイルはmmapできない
+        if os.path.getsize(file_path) == 0:
+            return memoryview(b"").cast("i")
+        with open(file_path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("i")
+
+    @staticmethod
+    def save_tokenized_shard(inputs):
+        """
+        1ジョブ分のページを1つのシャードとして書き出します。
+        シャードは語彙id・開始オフセット・終了オフセット・行の境界(トークン位置)の
+        int32の連続した配列からなります。
+        """
+        temp_path, vocab, output_dir, shard_id = inputs
+
+        tokenized_documents = TokenizedDocuments.load(temp_path)
+        # ワーカー内の語彙idから全体の語彙idへの変換表
+        id_table = tokenized_documents.id_table(vocab)
+
+        shard = {name:array("i") for name in SHARD_ARRAYS}
+        page_index = {}
+        for page_id, token_ids, starts, ends, line_offsets in tokenized_documents:
+            # (シャード番号, linesでの位置, 行数)
+            page_index[page_id] = (shard_id, len(shard["lines"]), len(line_offsets) - 1)
+            base = len(shard["ids"])
+            shard["lines"].extend([base + offset for offset in line_offsets])
+            shard["ids"].extend([id_table[idx] for idx in token_ids])
+            shard["starts"].extend(starts)
+            shard["ends"].extend(ends)
+
+        DataUtils.save_shard(os.path.join(output_dir, "shards"), shard_id, shard)
+        return len(tokenized_documents), page_index
+
+    @staticmethod
+    def save_shard(shard_dir, shard_id, shard):
+        for name, data in shard.items():
+            with DataUtils.atomic_open(os.path.join(shard_dir, f"{shard_id}.{name}.bin"), "wb") as f:
+                data.tofile(f)
+
+    @staticmethod
+    def compact_tokenized_shard(inputs):
+        """
+        既存のシャード上のページ(ページid, [シャード番号, linesでの位置, 行数])を、
+        1つの新しいシャードに詰めてコピーします。
+        """
+        shard_dir, shard_id, pages = inputs
+
+        arrays = {}
+        shard = {name:array("i") for name in SHARD_ARRAYS}
+        page_index = {}
+        for page_id, (old_shard_id, line_offset, num_lines) in pages:
+            if old_shard_id not in arrays:
+                arrays[old_shard_id] = {
+                    name:DataUtils.mmap_int32(os.path.join(shard_dir, f"{old_shard_id}.{name}.bin"))
+                    for name in SHARD_ARRAYS
+                }
+            old_shard = arrays[old_shard_id]
+            line_offsets = old_shard["lines"][line_offset:line_offset + num_lines + 1]
+            s, e = line_offsets[0], line_offsets[-1]
+
+            page_index[page_id] = (shard_id, len(shard["lines"]), num_lines)
+            base = len(shard["ids"])
+            shard["lines"].extend([base + offset - s for offset in line_offsets])
+            for name in ("ids", "starts", "ends"):
+                shard[name].frombytes(old_shard[name][s:e].tobytes())
+
+        DataUtils.save_shard(shard_dir, shard_id, shard)
+        return page_index
+
+class Vocab(object):
+    """
+    語彙とidを相互に変換します。
+    list互換のインターフェース(index, [], len, iter)を持ちつつ、
+    token->idの変換を辞書でO(1)に行います。
+    """
+    def __init__(self, tokens=()):
+        self.__id2token = []
+        self.__token2id = {}
+        for token in tokens:
+            self.add(token)
+
+    def __len__(self):
+        return len(self.__id2token)
+
+    def __iter__(self):
+        return iter(self.__id2token)
+
+    def __contains__(self, token):
+        return token in self.__token2id
+
+    def __getitem__(self, idx):
+        return self.__id2token[idx]
+
+    def add(self, token):
+        idx = self.__token2id.get(token)
+        if idx is None:
+            idx = len(self.__id2token)
+            self.__token2id[token] = idx
+            self.__id2token.append(token)
+        return idx
+
+    def index(self, token):
+        return self.__token2id[token]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.__token2id[token] for token in tokens]
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.__id2token[idx] for idx in ids]
+
+    @classmethod
+    def load(cls, file_path):
+        vocab = DataUtils.load_file(file_path)
+        if len(vocab) == 0:
+            return cls()
+        return cls(vocab.split("\n"))
+
+    def save(self, file_path):
+        DataUtils.save_file(file_path, "\n".join(self.__id2token))
+
+class AnnotationIndex(object):
+    """
+    JSON lines形式のアノテーションファイル上の、各ページの行のバイト範囲を保持します。
+    アノテーション自体はメモリに保持せず、必要になった時点でページごとに読み込みます。
+    dict互換のインターフェース(get, [], in, len, iter, values)を持ちます。
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.__spans = {}
+
+        offset = 0
+        with open(file_path, "rb") as f:
+            for line in f:
+                start, offset = offset, offset + len(line)
+                if len(line.strip()) == 0:
+                    continue
+
+                m = PAGE_ID_PATTERN.search(line)
+                page_id = m.group(1).decode("utf-8") if m else str(json.loads(line)["page_id"])
+
+                # 同じページの連続した行は1つの範囲にまとめる
+                spans = self.__spans.setdefault(page_id, [])
+                if len(spans) != 0 and spans[-1][1] == start:
+                    spans[-1][1] = offset
+                else:
+                    spans.append([start, offset])
+
+    def __len__(self):
+        return len(self.__spans)
+
+    def __iter__(self):
+        return iter(self.__spans)
+
+    def __contains__(self, page_id):
+        return page_id in self.__spans
+
+    def __getitem__(self, page_id):
+        return self.load(self.locate(page_id))
+
+    def get(self, page_id, default=None):
+        if page_id not in self.__spans:
+            return default
+        return self[page_id]
+
+    def values(self):
+        # 各ページのアノテーションを順に読み込む(全体は保持しない)
+        for page_id in self.__spans:
+            yield self[page_id]
+
+    def locate(self, page_id):
+        """
+        ページのアノテーションの(ファイルパス, バイト範囲)を返します。
+        ワーカーに渡し、ワーカー側で`load`して読み込みます。
+        """
+        if page_id not in self.__spans:
+            return None
+        return self.file_path, self.__spans[page_id]
+
+    @staticmethod
+    def load_lines(location):
+        file_path, spans = location
+        lines = []
+        with open(file_path, "rb") as f:
+            for s, e in spans:
+                f.seek(s)
+                lines += [line.rstrip() for line in f.read(e - s).splitlines() if len(line.strip()) != 0]
+        return lines
+
+    @classmethod
+    def load(cls, location):
+        return [json.loads(line) for line in cls.load_lines(location)]
+
+class HtmlAlignment(object):
+    """
+    プレーンテキストの文字オフセットから、HTMLの同じ行でのオフセットへの対応表です。
+    `DataUtils.save_html_alignment`で書き出したファイルを読み込みます。
+    """
+    def __init__(self, line_offsets, starts, ends):
+        self.__line_offsets = line_offsets
+        self.__starts = starts
+        self.__ends = ends
+
+    def __len__(self):
+        return len(self.__line_offsets) - 1
+
+    @classmethod
+    def load(cls, file_path):
+        data = array("i")
+        with open(file_path, "rb") as f:
+            data.frombytes(f.read())
+        num_lines = data[0]
+        line_offsets = data[1:num_lines + 2]
+        num_chars = line_offsets[-1]
+        base = num_lines + 2
+        return cls(line_offsets, data[base:base + num_chars], data[base + num_chars:base + num_chars * 2])
+
+    def to_html(self, line_id, start, end):
+        """
+        プレーンテキストの行内の空でない範囲[start, end)を、HTMLの行内の範囲に変換します。
+        対応しない場合は-1を返します。
+        """
+        base = self.__line_offsets[line_id]
+        return self.__starts[base + start], self.__ends[base + end - 1]
+
+    def convert(self, spans):
+        """
+        (行番号, 開始, 終了)のリストをまとめてHTML上の(行番号, 開始, 終了)に変換します。
+        """
+        return [(line_id, *self.to_html(line_id, start, end)) for line_id, start, end in spans]
+
+    def convert_token_spans(self, tokenized_sentences, token_spans):
+        """
+        トークン単位の範囲((開始行, 開始トークン), (終了行, 終了トークン))のリストを、
+        HTML上の((開始行, 開始オフセット), (終了行, 終了オフセット))のリストに変換します。
+        終了トークンは範囲に含まれない次のトークンの位置です。
+        tokenized_sentencesは行ごとの(トークン, 開始, 終了)のリストです。
+        """
+        html_spans = []
+        for (start_line, start_token), (end_line, end_token) in token_spans:
+            start = tokenized_sentences[start_line][start_token][1]
+            end = tokenized_sentences[end_line][end_token - 1][2]
+            html_spans.append((
+                (start_line, self.__starts[self.__line_offsets[start_line] + start]),
+                (end_line, self.__ends[self.__line_offsets[end_line] + end - 1])
+            ))
+        return html_spans
+
+class TokenizedDocuments(object):
+    """
+    トークナイズ結果をワーカー内の局所的な語彙idで保持します。
+    語彙数のカウントも同時に行うため、中間ファイルを読み直す必要がありません。
+    """
+    def __init__(self, tokens=(), documents=()):
+        self.__vocab = Vocab(tokens)
+        self.__counts = [0] * len(self.__vocab)
+        self.__documents = list(documents)
+
+    def __len__(self):
+        return len(self.__documents)
+
+    def __iter__(self):
+        return iter(self.__documents)
+
+    def append(self, page_id, tokenized_sentences):
+        token_ids, starts, ends = array("i"), array("i"), array("i")
+        line_offsets = array("i", [0])
+        for tokens in tokenized_sentences:
+            for token, s, e in tokens:
+                idx = self.__vocab.add(token)
+                if idx == len(self.__counts):
+                    self.__counts.append(0)
+                self.__counts[idx] += 1
+                token_ids.append(idx)
+                starts.append(s)
+                ends.append(e)
+            line_offsets.append(len(token_ids))
+        self.__documents.append((page_id, token_ids, starts, ends, line_offsets))
+
+    def count(self):
+        return Counter(dict(zip(self.__vocab, self.__counts)))
+
+    def id_table(self, vocab):
+        return array("i", [vocab.index(token) for token in self.__vocab])
+
+    def save(self, file_path):
+        with DataUtils.atomic_open(file_path, "wb") as f:
+            pickle.dump((list(self.__vocab), self.__documents), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, "rb") as f:
+            tokens, documents = pickle.load(f)
+        return cls(tokens, documents)
 
 class DataTools(object):
     @staticmethod
     # リストをn分割
-    def split_array(array, n):
+    def split_array(values, n):
         for i in range(n):
-            yield array[i * len(array) // n:(i + 1) * len(array) // n]
+            yield values[i * len(values) // n:(i + 1) * len(values) // n]
+
+    @staticmethod
+    def split_array_by_size(values, sizes, n):
+        """
+        合計サイズが均等になる様にリストをn分割します。
+        大きい要素から順に、その時点で最も小さいチャンクへ割り当てます。
+        チャンクは合計サイズの大きい順に返されます。
+        """
+        n = max(1, min(n, len(values)))
+        chunks = [[] for _ in range(n)]
+        heap = [(0, i) for i in range(n)]
+        for idx in sorted(range(len(values)), key=lambda i: sizes[i], reverse=True):
+            total, i = heapq.heappop(heap)
+            chunks[i].append(values[idx])
+            heapq.heappush(heap, (total + sizes[idx], i))
+        totals = dict((i, total) for total, i in heap)
+        return [chunks[i] for i in sorted(range(n), key=lambda i: totals[i], reverse=True)]
 
     @staticmethod
     def flatten(arrays):
         new_array = []
-        for array in arrays:
-            new_array += array
+        for values in arrays:
+            new_array += values
         return new_array
 
-class IgnoreSentenceParser(HTMLParser):
-    def __init__(self):
-        self.start_line = None
-        self.ignore_lines = set()
-        super().__init__()
-
-    def reset(self):
-        self.start_line = None
-        self.ignore_lines = set()
-        super().reset()
+class PageIndex(object):
+    """
+    フォルダごとに、各ページの(page_id -> [パス, サイズ, 更新時刻])を保持する索引です。
+    file_pathを指定した場合は索引を保存しておき、次回はフォルダの更新時刻が変わったものだけ走査し直します。
+    (ファイルの追加・削除・置き換えでフォルダの更新時刻が変わります)
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.__dirs = {}
+        if file_path is not None and os.path.exists(file_path):
+            self.__dirs = json.loads(DataUtils.load_file(file_path))
 
-    def handle_starttag(self, tag, attrs):
-        if tag == "script":
-            start_line, _ = self.getpos()
-            self.start_line = start_line - 1
-
-    def handle_endtag(self, tag):
-        if tag == "script" and self.start_line is not None:
-            end_line, _ = self.getpos()
-            self.ignore_lines |= set(range(self.start_line, end_line))
-            self.start_line = None
+    @staticmethod
+    def scan_dir(dir_path, suffix, cached=None):
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            return {"mtime":None, "pages":{}}
+
+        if cached is not None and cached["mtime"] == dir_mtime:
+            return cached
+
+        pages = {}
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(suffix) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                pages[entry.name[:-len(suffix)]] = [entry.path, stat.st_size, stat.st_mtime_ns]
+        return {"mtime":dir_mtime, "pages":pages}
+
+    def scan(self, dir_paths, suffix, parallel=1):
+        """
+        各フォルダの(page_id -> [パス, サイズ, 更新時刻])を返します。
+        フォルダの走査はI/O待ちが主なため、スレッドで並列に行います。
+        """
+        def scan_dir(dir_path):
+            return self.scan_dir(dir_path, suffix, self.__dirs.get(dir_path))
+
+        with ThreadPool(max(1, min(parallel, len(dir_paths)))) as p:
+            for dir_path, entry in zip(dir_paths, p.map(scan_dir, dir_paths)):
+                self.__dirs[dir_path] = entry
+        return [self.__dirs[dir_path]["pages"] for dir_path in dir_paths]
+
+    def save(self):
+        if self.file_path is not None and len(self.__dirs) != 0:
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+            DataUtils.save_file(self.file_path, json.dumps(self.__dirs))
 
 class ShinraDataset(object):
     def __init__(self, args, dataset_dir):
+        # 前回の走査結果(出力先に保存)
+        self.__page_index = PageIndex(os.path.join(args.output_dir, "_page_index.json"))
+        self.__parallel = args.parallel
+
         self._load_annotations(args, dataset_dir)
-        #self._load_html_path(dataset_dir)
-        #self._mark_ignore_sentece(args)
+        if args.ignore_script or args.html_alignment: # <script>の行の検出とオフセットの対応表にのみ使用
+            self._load_html_path(dataset_dir)
         self._load_plain_path(dataset_dir)
 
+        self.__page_index.save()
+
     @property
     def categories(self):
         return self.__categories
@@ -131,6 +577,10 @@ class ShinraDataset(object):
     def plain_paths(self):
         return self.__plain_paths
 
+    @property
+    def plain_sizes(self):
+        return self.__plain_sizes
+
     @property
     def annotations(self):
         return self.__annotations
@@ -162,51 +612,48 @@ class ShinraDataset(object):
 
                 jobs.append((category, file_path))
 
-        with Pool(args.parallel) as p, tqdm.tqdm(total=len(jobs), desc="Loading annotations") as t:
-            for category, annotation in p.imap_unordered(DataUtils.wrp_load_annotation, jobs):
-                self.__annotations[category] = annotation
+        # ページごとのバイト範囲の索引のみ作成し、アノテーションは必要な時に読み込む
+        with Pool(args.parallel) as p, tqdm.tqdm(total=len(jobs), desc="Indexing annotations") as t:
+            for category, annotation_index in p.imap_unordered(DataUtils.index_annotation, jobs):
+                self.__annotations[category] = annotation_index
                 t.update()
 
+    def _scan_pages(self, dataset_dir, dir_name, suffix):
+        # カテゴリーごとのフォルダを並列に走査
+        dir_paths = [
+            os.path.join(dataset_dir[self.__category2c_cls[category]], dir_name, category)
+            for category in self.__categories
+        ]
+        return dict(zip(self.__categories, self.__page_index.scan(dir_paths, suffix, self.__parallel)))
+
     def _load_html_path(self, dataset_dir):
         self.__html_paths = defaultdict(dict)
-        for category in tqdm.tqdm(self.__categories, desc="Loading html path"):
-            c_cls = self.__category2c_cls[category]
-            html_dir = os.path.join(dataset_dir[c_cls], "html", category)
-            for file_path in glob.glob(os.path.join(html_dir, "*.html")):
-                page_id = re.match(".*/(\d*?).html", file_path).group(1)
+        for category, pages in self._scan_pages(dataset_dir, "html", ".html").items():
+            for page_id, (file_path, _, _) in pages.items():
                 self.__html_paths[category][page_id] = file_path
 
     def _load_plain_path(self, dataset_dir):
         self.__plain_paths = defaultdict(dict)
-        for category in tqdm.tqdm(self.__categories, desc="Loading plain path"):
-            c_cls = self.__category2c_cls[category]
-            plain_dir = os.path.join(dataset_dir[c_cls], "plain", category)
-            for file_path in glob.glob(os.path.join(plain_dir, "*.txt")):
-                page_id = re.match(".*/(\d*?).txt", file_path).group(1)
+        self.__plain_sizes = defaultdict(dict)
+        for category, pages in self._scan_pages(dataset_dir, "plain", ".txt").items():
+            for page_id, (file_path, size, _) in pages.items():
                 self.__plain_paths[category][page_id] = file_path
-
-    @staticmethod
-    def _mark_ignore_sentece_func(inputs):
-        # 並列処理用の関数
-        parser = IgnoreSentenceParser()
-
-        for page_id, file_path in inputs:
-            text = DataUtils.load_file(file_path)
-            parser.feed(text)
-            parser.reset()
-
-    def _mark_ignore_sentece(self, args):
-        for category in tqdm.tqdm(self.__categories, desc="Marking ignore sentence"):
-            chunks = [*DataTools.split_array([*self.__html_paths[category].items()], args.parallel)]
-            with Pool(args.parallel) as p:
-                p.map(self._mark_ignore_sentece_func, chunks)
+                self.__plain_sizes[category][page_id] = size
 
 class TokenizedDataset(object):
     def __init__(self, args, file_dir):
+        # 前回のtokens/の走査結果(出力先に保存)
+        self.__page_index = PageIndex(os.path.join(file_dir, "_page_index.json"))
+        self.__parallel = args.parallel
         self._load_annotations(args, file_dir)
         self._load_vocab(file_dir)
         self._load_tokens_path(file_dir)
 
+        try:
+            self.__page_index.save()
+        except OSError: # 読み込み専用の出力の場合は毎回走査する
+            pass
+
     @property
     def categories(self):
         return self.__categories
@@ -223,6 +670,10 @@ class TokenizedDataset(object):
     def vocab(self):
         return self.__vocab
 
+    @property
+    def category_dirs(self):
+        return self.__category_dirs
+
     def _load_annotations(self, args, file_dir):
         self.__categories = []
         self.__annotations = {}
@@ -238,23 +689,124 @@ class TokenizedDataset(object):
 
             jobs.append((category, file_path))
 
-        with Pool(args.parallel) as p, tqdm.tqdm(total=len(jobs), desc="Loading annotations") as t:
-            for category, annotation in p.imap_unordered(DataUtils.wrp_load_annotation, jobs):
-                self.__annotations[category] = annotation
+        # ShinraDatasetと同じく索引のみ作成し、アノテーションはページごとに読み込む
+        with Pool(args.parallel) as p, tqdm.tqdm(total=len(jobs), desc="Indexing annotations") as t:
+            for category, annotation_index in p.imap_unordered(DataUtils.index_annotation, jobs):
+                self.__annotations[category] = annotation_index
                 t.update()
 
     def _load_vocab(self, file_dir):
         self.__vocab = {}
+        self.__category_dirs = {}
 
         for category in self.__categories:
             for file_path in glob.glob(os.path.join(file_dir, f"*/{category}/vocab.txt")):
-                vocab = DataUtils.load_file(file_path)
-                self.__vocab[category] = vocab.splitlines()
+                self.__vocab[category] = Vocab.load(file_path)
+                self.__category_dirs[category] = os.path.dirname(file_path)
+
+    def is_sharded(self, category):
+        return False
+
+    def get_html_alignment(self, category, page_id):
+        """
+        `--html_alignment`で書き出したページの対応表を返します。
+        """
+        return HtmlAlignment.load(os.path.join(self.__category_dirs[category], "html_offsets", f"{page_id}.bin"))
 
     def _load_tokens_path(self, file_dir):
         self.__tokens_paths = defaultdict(dict)
 
+        categories, dir_paths = [], []
         for category in self.__categories:
-            for file_path in glob.glob(os.path.join(file_dir, f"*/{category}/tokens/*.txt")):
-                page_id = re.match(".*/(\d*?).txt", file_path).group(1)
+            for dir_path in glob.glob(os.path.join(file_dir, f"*/{category}/tokens")):
+                categories.append(category)
+                dir_paths.append(dir_path)
+
+        for category, pages in zip(categories, self.__page_index.scan(dir_paths, ".txt", self.__parallel)):
+            for page_id, (file_path, _, _) in pages.items():
                 self.__tokens_paths[category][page_id] = file_path
+
+class ShardedPage(object):
+    """
+    シャード上の1ページ分のトークンです。
+    各行の(語彙id, 開始オフセット, 終了オフセット)をコピー無しのmemoryviewで返します。
+    """
+    def __init__(self, token_ids, starts, ends, line_offsets):
+        self.__token_ids = token_ids
+        self.__starts = starts
+        self.__ends = ends
+        self.__line_offsets = line_offsets
+
+    def __len__(self):
+        return len(self.__line_offsets) - 1
+
+    def __getitem__(self, line_id):
+        s, e = self.__line_offsets[line_id], self.__line_offsets[line_id + 1]
+        return self.__token_ids[s:e], self.__starts[s:e], self.__ends[s:e]
+
+    def __iter__(self):
+        for line_id in range(len(self)):
+            yield self[line_id]
+
+    @classmethod
+    def open(cls, shard_dir, shard_id, line_offset, num_lines):
+        arrays = {
+            name:DataUtils.mmap_int32(os.path.join(shard_dir, f"{shard_id}.{name}.bin"))
+            for name in SHARD_ARRAYS
+        }
+        return cls(
+            arrays["ids"],
+            arrays["starts"],
+            arrays["ends"],
+            arrays["lines"][line_offset:line_offset + num_lines + 1]
+        )
+
+class ShardedTokenizedDataset(TokenizedDataset):
+    """
+    `--output_format shard`で書き出されたデータセットを読み込みます。
+    シャードはメモリマップで開き、ページのトークンはコピーせずに返します。
+    形式はカテゴリーごとに判定し、`shards/`の無いカテゴリーは`tokens/`から読み込みます。
+    """
+    def __init__(self, args, file_dir):
+        self.__mmaps = {}
+        super().__init__(args, file_dir)
+
+    @property
+    def page_index(self):
+        return self.__page_index
+
+    @property
+    def shard_dirs(self):
+        return self.__shard_dirs
+
+    def is_sharded(self, category):
+        return category in self.__shard_dirs
+
+    def _load_tokens_path(self, file_dir):
+        super()._load_tokens_path(file_dir)
+        self.__shard_dirs = {}
+        self.__page_index = {}
+
+        for category in self.categories:
+            for shard_dir in glob.glob(os.path.join(file_dir, f"*/{category}/shards")):
+                if not os.path.exists(os.path.join(shard_dir, "page_index.json")):
+                    continue
+                self.__shard_dirs[category] = shard_dir
+                page_index = json.loads(DataUtils.load_file(os.path.join(shard_dir, "page_index.json")))
+                self.__page_index[category] = page_index
+
+    def _get_array(self, category, shard_id, name):
+        key = (category, shard_id, name)
+        if key not in self.__mmaps:
+            file_path = os.path.join(self.__shard_dirs[category], f"{shard_id}.{name}.bin")
+            self.__mmaps[key] = DataUtils.mmap_int32(file_path)
+        return self.__mmaps[key]
+
+    def get_tokens(self, category, page_id):
+        shard_id, line_offset, num_lines = self.__page_index[category][page_id]
+        return ShardedPage(
+            self._get_array(category, shard_id, "ids"),
+            self._get_array(category, shard_id, "starts"),
+            self._get_array(category, shard_id, "ends"),
+            self._get_array(category, shard_id, "lines")[line_offset:line_offset + num_lines + 1],
+        )
@@ -0,0 +1,34 @@
+import argparse
+import multiprocessing as multi
+
+from tokenization.vocab_utils import build_global_vocab
+
+
+def load_arg():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_dirs", nargs="+", help="トークナイザーの出力フォルダ(例:./outputs/mecab_ipadic)")
+    parser.add_argument(
+        "--categories",
+        nargs="*",
+        default=None,
+        help="対象カテゴリーを制限できます。指定がない場合は全てのカテゴリーが処理されます。",
+    )
+    parser.add_argument(
+        "--parallel",
+        default=1,
+        type=int,
+        choices=[*range(1, multi.cpu_count() + 1)] + [-1],
+        help="1(default)~コア数で並列数を指定できます。-1の場合は最大コア数が使用されます。",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = load_arg()
+
+    if args.parallel == -1:
+        args.parallel = multi.cpu_count()
+
+    for input_dir in args.input_dirs:
+        global_vocab = build_global_vocab(args, input_dir)
+        print(f"{input_dir}:{len(global_vocab)}語")
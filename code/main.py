@@ -2,8 +2,8 @@ import argparse
 import multiprocessing as multi
 import os
 
-from data_utils import ShinraDataset, TokenizedDataset
-from tokenization.annotation_utils import annotation_checker
+from data_utils import ShinraDataset
+from tokenization.factory import TOKENIZER_NAMES, get_tokenizer_spec
 
 # データセット用の環境変数リスト
 DATASET_ENV = {
@@ -20,9 +20,6 @@ DATASET_DIR = {
     for c_cls, env in DATASET_ENV.items()
     if os.environ.get(env) is not None
 }
-assert (
-    len(DATASET_DIR) != 0
-), f"次の環境変数の1つ以上にデータセットのパスを格納する必要があります。\n{list(DATASET_ENV.values())}"
 
 
 def load_arg():
@@ -30,12 +27,7 @@ def load_arg():
     parser.add_argument(
         "--tokenizers",
         nargs="+",
-        choices=[
-            "mecab_ipadic",
-            "mecab_jumandic",
-            "jumanpp",
-            "tohoku_bert_mecab_ipadic_bpe",
-        ],
+        choices=TOKENIZER_NAMES,
     )
     parser.add_argument(
         "--categories",
@@ -51,10 +43,86 @@ def load_arg():
         help="1(default)~コア数で並列数を指定できます。-1の場合は最大コア数が使用されます。",
     )
     parser.add_argument("--output_dir", default="./outputs", help="出力先フォルダ")
+    parser.add_argument(
+        "--output_format",
+        default="text",
+        choices=["text", "shard"],
+        help="text(default):ページごとのテキストファイル、shard:カテゴリーごとに数個のint32配列のシャード",
+    )
+    parser.add_argument(
+        "--jumanpp_backend",
+        default="pyknp",
+        choices=["pyknp", "process"],
+        help="pyknp(default):1行ずつpyknpで解析、process:jumanppのプロセスを起動したままにしてまとめて解析",
+    )
+    parser.add_argument(
+        "--tohoku_bert_backend",
+        default="transformers",
+        choices=["transformers", "tokenizers"],
+        help="transformers(default):BertJapaneseTokenizerで処理、tokenizers:Rust実装のWordPieceで行をまとめて処理",
+    )
+    parser.add_argument(
+        "--tohoku_bert_vocab_dir",
+        default=None,
+        help="東北大BERTのvocab.txtがあるフォルダ(--tohoku_bert_backend tokenizersの場合に必要)",
+    )
+    parser.add_argument(
+        "--line_cache_size",
+        default=0,
+        type=int,
+        help="ワーカーごとにトークナイズ結果を保持する行数(default:0でキャッシュしない)。1行あたり数KB〜十数KBのメモリを使います。",
+    )
+    parser.add_argument(
+        "--line_cache_dir",
+        default=None,
+        help="指定した場合、トークナイズ結果をsqliteでディスク上にもキャッシュし、実行をまたいで使い回します。",
+    )
+    parser.add_argument(
+        "--ignore_script",
+        action="store_true",
+        help="HTMLの<script>から</script>までの行をトークナイズしません(アノテーションがある行は除く)。",
+    )
+    parser.add_argument(
+        "--html_alignment",
+        action="store_true",
+        help="プレーンテキストからHTMLへのオフセットの対応表をhtml_offsets/に書き出します。",
+    )
+    parser.add_argument(
+        "--global_vocab",
+        action="store_true",
+        help="トークナイズ後に全カテゴリーで共通の語彙(global_vocab.txt)と、各カテゴリーの語彙idからの変換表(global_ids.bin)を書き出します。",
+    )
+    parser.add_argument(
+        "--export",
+        default=None,
+        choices=["arrow", "parquet"],
+        help="トークナイズ後に各カテゴリーを(カテゴリー名).arrow(または.parquet)のテーブルとしても書き出します。",
+    )
+    parser.add_argument(
+        "--window_length",
+        default=None,
+        type=int,
+        help="指定した場合、トークナイズ後に各ページをこのトークン数以内のウィンドウにしてwindows/に書き出します。",
+    )
+    parser.add_argument(
+        "--window_stride",
+        default=None,
+        type=int,
+        help="ウィンドウをずらすトークン数(指定がない場合は--window_lengthと同じで重なり無し)",
+    )
+    parser.add_argument(
+        "--single_read",
+        action="store_true",
+        help="各ページを一度だけ読み込み、指定した全てのトークナイザーを同じワーカー内で実行します。",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
+    assert (
+        len(DATASET_DIR) != 0
+    ), f"次の環境変数の1つ以上にデータセットのパスを格納する必要があります。\n{list(DATASET_ENV.values())}"
+
     args = load_arg()
 
     if args.parallel == -1:
@@ -62,22 +130,40 @@ if __name__ == "__main__":
 
     shinra = ShinraDataset(args, DATASET_DIR)
 
-    if "mecab_ipadic" in args.tokenizers:
-        from tokenization import mecab
+    tokenizer_specs = [
+        get_tokenizer_spec(
+            name,
+            jumanpp_backend=args.jumanpp_backend,
+            tohoku_bert_backend=args.tohoku_bert_backend,
+            tohoku_bert_vocab_dir=args.tohoku_bert_vocab_dir,
+        )
+        for name in TOKENIZER_NAMES
+        if name in args.tokenizers
+    ]
+
+    from tokenization import tokenize_utils
 
-        mecab_ipadic_output_dir = mecab.run_tokenize(args, shinra, "ipadic")
+    output_dirs = []
+    if args.single_read:
+        output_dirs += tokenize_utils.run_tokenize(args, shinra, tokenizer_specs)
+    else:
+        for tokenizer_spec in tokenizer_specs:
+            output_dirs += tokenize_utils.run_tokenize(args, shinra, [tokenizer_spec])
 
-    if "mecab_jumandic" in args.tokenizers:
-        from tokenization import mecab
+    if args.global_vocab:
+        from tokenization.vocab_utils import build_global_vocab
 
-        mecab_juman_output_dir = mecab.run_tokenize(args, shinra, "jumandic")
+        for output_dir in output_dirs:
+            build_global_vocab(args, output_dir)
 
-    if "jumanpp" in args.tokenizers:
-        from tokenization import juman
+    if args.export is not None:
+        from tokenization.export_utils import export_dataset
 
-        jumanpp_output_dir = juman.run_tokenize(args, shinra, command="jumanpp")
+        for output_dir in output_dirs:
+            export_dataset(args, output_dir, args.export)
 
-    if "tohoku_bert_mecab_ipadic_bpe" in args.tokenizers:
-        from tokenization import tohoku_bert
+    if args.window_length is not None:
+        from tokenization.window_utils import pack_dataset
 
-        tohoku_bert.run_tokenize(args, shinra)
+        for output_dir in output_dirs:
+            pack_dataset(args, output_dir, args.window_length, args.window_stride)
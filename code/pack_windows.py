@@ -0,0 +1,40 @@
+import argparse
+import multiprocessing as multi
+
+from tokenization.window_utils import pack_dataset
+
+
+def load_arg():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_dirs", nargs="+", help="トークナイザーの出力フォルダ(例:./outputs/mecab_ipadic)")
+    parser.add_argument("--max_length", default=512, type=int, help="ウィンドウのトークン数(default:512)")
+    parser.add_argument(
+        "--stride",
+        default=None,
+        type=int,
+        help="ウィンドウをずらすトークン数(指定がない場合は--max_lengthと同じで重なり無し)",
+    )
+    parser.add_argument(
+        "--categories",
+        nargs="*",
+        default=None,
+        help="対象カテゴリーを制限できます。指定がない場合は全てのカテゴリーが処理されます。",
+    )
+    parser.add_argument(
+        "--parallel",
+        default=1,
+        type=int,
+        choices=[*range(1, multi.cpu_count() + 1)] + [-1],
+        help="1(default)~コア数で並列数を指定できます。-1の場合は最大コア数が使用されます。",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = load_arg()
+
+    if args.parallel == -1:
+        args.parallel = multi.cpu_count()
+
+    for input_dir in args.input_dirs:
+        pack_dataset(args, input_dir, args.max_length, args.stride)
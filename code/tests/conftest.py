@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.pyと同じくcode/を基準にimportする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import os
+import re
+import json
+import argparse
+
+from data_utils import DataUtils, ShinraDataset
+from tokenization.tokenize_utils import Tokenizer, run_tokenize
+from tokenization.export_utils import load_tokenized_dataset, load_page_tokens, get_page_ids
+from tokenization.decode_utils import get_page_location
+
+# run_tokenizeを小さなデータセットで実行するテスト用の部品
+
+C_CLS = "JP-5"
+
+class SpaceTokenizer(Tokenizer):
+    # 空白区切りの単語をトークンにする(辞書の要らないトークナイザー)
+    name = "Space"
+    error_key = "space"
+
+    def tokenize_line(self, line, errors):
+        spans = [m.span() for m in re.finditer(r"\S+", line)]
+        return [line[s:e] for s, e in spans], spans
+
+TOKENIZER_SPECS = [("space", SpaceTokenizer, {})]
+
+def make_annotation(page_id, attribute, plain_lines, line_id, start, end):
+    return {
+        "page_id":page_id,
+        "title":f"title{page_id}",
+        "attribute":attribute,
+        "html_offset":{},
+        "text_offset":{
+            "start":{"line_id":line_id, "offset":start},
+            "end":{"line_id":line_id, "offset":end},
+            "text":plain_lines[line_id][start:end],
+        },
+        "ENE":"1.6.5.3",
+    }
+
+def write_dataset(dataset_dir, category, pages, annotations):
+    """
+    pagesは{ページid:(HTMLの行のリスト, プレーンテキストの行のリスト)}です。
+    データセットのフォルダ(ShinraDatasetに渡すdict)を返します。
+    """
+    root = os.path.join(dataset_dir, C_CLS)
+    for name in ("annotation", os.path.join("html", category), os.path.join("plain", category)):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    for page_id, (html_lines, plain_lines) in pages.items():
+        DataUtils.save_file(os.path.join(root, "html", category, f"{page_id}.html"), "\n".join(html_lines))
+        DataUtils.save_file(os.path.join(root, "plain", category, f"{page_id}.txt"), "\n".join(plain_lines))
+    DataUtils.save_file(
+        os.path.join(root, "annotation", f"{category}_dist.json"),
+        "".join(json.dumps(ann, ensure_ascii=False) + "\n" for ann in annotations)
+    )
+    return {C_CLS:root}
+
+def make_args(output_dir, **kwargs):
+    args = {
+        "output_dir":str(output_dir),
+        "categories":None,
+        "parallel":1,
+        "output_format":"text",
+        "ignore_script":False,
+        "html_alignment":False,
+        "line_cache_size":0,
+        "line_cache_dir":None,
+    }
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+def tokenize(args, dataset_dir):
+    return run_tokenize(args, ShinraDataset(args, dataset_dir), TOKENIZER_SPECS)
+
+def load_output(args, category):
+    """
+    出力の各ページの行ごとの(トークン, 開始, 終了)と、アノテーションを返します。
+    語彙idは差分実行で変わるため、トークンの文字列に戻して比較します。
+    """
+    file_dir = os.path.join(args.output_dir, TOKENIZER_SPECS[0][0])
+    tokenized_dataset = load_tokenized_dataset(args, file_dir)
+    vocab = tokenized_dataset.vocab[category]
+    pages = {}
+    for page_id in get_page_ids(tokenized_dataset, category):
+        location = get_page_location(tokenized_dataset, category, page_id)
+        pages[page_id] = [
+            [(vocab[idx], s, e) for idx, s, e in zip(ids, starts, ends)]
+            for ids, starts, ends in load_page_tokens(location)
+        ]
+    dist_path = os.path.join(tokenized_dataset.category_dirs[category], f"{category}_dist.json")
+    annotations = sorted(
+        DataUtils.load_oneliner_json(dist_path, parallel=1),
+        key=lambda ann: json.dumps(ann, sort_keys=True)
+    )
+    return pages, annotations
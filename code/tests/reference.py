@@ -0,0 +1,123 @@
+import re
+import random
+import unicodedata
+
+# テストで比較に使う、高速化する前の処理とテスト用のデータの作成
+# (code/benchmark.pyもここから読み込んで時間を比較する)
+
+def legacy_align_tokens(line, tokens):
+    # 以前のmecab.tokenize/juman.tokenizeのオフセット計算
+    offsets = []
+    if line != "".join(tokens):
+        branks = {}
+        for m in re.finditer(r"[\xa0]|\s", line):
+            s, e = m.span(0)
+            branks[s] = m.group(0)
+
+        temp = ""
+        while len(temp) in branks:
+            temp += branks[len(temp)]
+        for token in tokens:
+            offsets.append((
+                len(temp), len(temp)+len(token)
+            ))
+            temp += token
+            while len(temp) in branks:
+                temp += branks[len(temp)]
+
+        return offsets, temp == line
+    else:
+        temp = ""
+        for token in tokens:
+            offsets.append((
+                len(temp), len(temp)+len(token)
+            ))
+            temp += token
+        return offsets, True
+
+def legacy_annotation_mapper(annotation, tokenized_sentences, ann_key="token", patch={}):
+    # 以前のannotation_mapper(行内のトークンを線形探索)
+    match_errors = 0
+    for ann in annotation:
+        if ann.get("text_offset") is None: # 総称フラグ関連
+            continue
+
+        start, end = ann["text_offset"]["start"], ann["text_offset"]["end"]
+
+        ann["token_offset"] = {
+            "start":{"line_id":start["line_id"]},
+            "end":{"line_id":end["line_id"]},
+            "text":ann["text_offset"]["text"]
+        }
+
+        match_error = False
+
+        tokens = tokenized_sentences[start["line_id"]]
+        for i, (token, s, e) in enumerate(tokens):
+            if start["offset"] >= s and start["offset"] < e:
+                ann["token_offset"]["start"]["offset"] = i
+                if s != start["offset"]:
+                    match_error = True
+                break
+
+        assert ann["token_offset"]["start"].get("offset") is not None, \
+            f"Startオフセットマッチエラー\ntokens:{tokens}\nann:{ann['text_offset']}"
+
+        tokens = tokenized_sentences[end["line_id"]]
+        for i, (token, s, e) in enumerate(tokens):
+            if end["offset"] > s and end["offset"] <= e:
+                ann["token_offset"]["end"]["offset"] = i + 1
+                if e != end["offset"]:
+                    match_error = True
+                break
+
+        if ann["token_offset"]["end"].get("offset") is None:
+            key=(int(ann["page_id"]), ann["attribute"], ann["text_offset"]["end"]["line_id"], ann["text_offset"]["end"]["offset"])
+            ann["token_offset"]["end"]["offset"] = patch.get(key)
+
+        assert ann["token_offset"]["end"].get("offset") is not None, f"Endオフセットマッチエラー\n{ann}\ntokens:{tokens}\nann:{ann['text_offset']}"
+
+        #del ann["text_offset"]
+        #del ann["html_offset"]
+
+        match_errors += match_error
+
+    return annotation, match_errors
+
+def make_line(num_tokens, seed=0):
+    # 空白区切りの表の様な長い行とそのトークン列を作成
+    rand = random.Random(seed)
+    chars = "空港東京ＡＢＣ１２３あいうえおカタカナ|!="
+    tokens, pieces = [], []
+    for _ in range(num_tokens):
+        token = "".join(rand.choice(chars) for _ in range(rand.randint(1, 4)))
+        tokens.append(token)
+        pieces.append(token + rand.choice(["", "", " ", "\xa0", "　"]))
+    return "".join(pieces), tokens
+
+def segment_normalized(line, rand):
+    # NFKC後の行をランダムな長さのトークンに分割(subword prefix無しのトークン列の代わり)
+    normalized = re.sub(r"\s", "", unicodedata.normalize("NFKC", line))
+    tokens, idx = [], 0
+    while idx < len(normalized):
+        size = rand.randint(1, 4)
+        tokens.append(normalized[idx:idx + size])
+        idx += size
+    return tokens
+
+def make_annotations(line, tokens, num_annotations, seed=0):
+    rand = random.Random(seed)
+    annotations = []
+    for _ in range(num_annotations):
+        s = rand.randrange(len(tokens))
+        e = rand.randrange(s, min(s + 5, len(tokens)))
+        annotations.append({
+            "page_id":"0",
+            "attribute":"",
+            "text_offset":{
+                "start":{"line_id":0, "offset":tokens[s][1]},
+                "end":{"line_id":0, "offset":tokens[e][2]},
+                "text":line[tokens[s][1]:tokens[e][2]],
+            }
+        })
+    return annotations
@@ -0,0 +1,35 @@
+import copy
+
+import pytest
+
+from tests.reference import make_line, make_annotations, legacy_annotation_mapper
+from tokenization.annotation_utils import annotation_mapper
+from tokenization.offset_utils import align_tokens
+
+def run(mapper, annotation, tokenized_sentences):
+    # マッチしない場合はどちらもAssertionErrorになる
+    try:
+        return mapper(copy.deepcopy(annotation), tokenized_sentences)
+    except AssertionError:
+        return None
+
+@pytest.mark.parametrize("num_tokens", [1, 10, 100, 1000])
+def test_annotation_mapper_matches_legacy(num_tokens):
+    # bisectによるマッピングが以前の線形探索と一致するか
+    for seed in range(10):
+        line, tokens = make_line(num_tokens, seed=seed)
+        offsets, _ = align_tokens(line, tokens)
+        tokenized_sentences = [[(token, s, e) for token, (s, e) in zip(tokens, offsets)]]
+        annotation = make_annotations(line, tokenized_sentences[0], max(1, num_tokens // 10), seed=seed)
+        # トークンの途中や空白から始まる・終わるアノテーション
+        for ann in annotation[::2]:
+            start, end = ann["text_offset"]["start"], ann["text_offset"]["end"]
+            if end["offset"] - start["offset"] > 2:
+                start["offset"] += 1
+                end["offset"] -= 1
+
+        for ann in annotation:
+            assert run(annotation_mapper, [ann], tokenized_sentences) \
+                == run(legacy_annotation_mapper, [ann], tokenized_sentences)
+        assert annotation_mapper(copy.deepcopy(annotation[1::2]), tokenized_sentences) \
+            == legacy_annotation_mapper(copy.deepcopy(annotation[1::2]), tokenized_sentences)
@@ -0,0 +1,52 @@
+import pytest
+
+from data_utils import DataUtils, HtmlAlignment, MAX_SCRIPT_LINES
+from tokenization.offset_utils import align_html
+
+def script_lines(tmp_path, html_lines):
+    file_path = tmp_path / "page.html"
+    file_path.write_text("\n".join(html_lines))
+    return DataUtils.find_script_lines(str(file_path))
+
+@pytest.mark.parametrize("html_lines, expected", [
+    # 複数行の<script>
+    (["<p>a</p>", "<script type='text/javascript'>", "var x = 1;", "</script>", "<p>b</p>"], [1, 2, 3]),
+    # 1行の<script>が複数ある場合
+    (["<script>a()</script><p>b</p>", "<p>c</p>", "<SCRIPT>d()</SCRIPT >"], [0, 2]),
+    # コメント内の<script>
+    (["<!--", "<script>", "-->", "<p>a</p>", "</script>"], []),
+    # 空の<script>
+    (["<script src='a.js'/>", "<p>a</p>", "<script>b()</script>"], [2]),
+    # 閉じられていない<script>
+    (["<p>a</p>", "<script>", "<p>b</p>"], []),
+    # <scripts>などの別のタグ
+    (["<scripts>", "<p>a</p>", "</script>"], []),
+])
+def test_find_script_lines(tmp_path, html_lines, expected):
+    assert script_lines(tmp_path, html_lines) == expected
+
+def test_find_script_lines_too_long(tmp_path):
+    # MAX_SCRIPT_LINES行以上にわたる<script>は開始タグのみ読み飛ばし、以降の<script>は検出する
+    html_lines = ["<script>"] + ["<p>a</p>"] * MAX_SCRIPT_LINES + ["</script>", "<script>b()", "</script>"]
+    assert script_lines(tmp_path, html_lines) == [MAX_SCRIPT_LINES + 2, MAX_SCRIPT_LINES + 3]
+
+def test_html_alignment_round_trip(tmp_path):
+    # 書き出した対応表を読み込み、文字・トークン単位の範囲をHTML上の範囲に変換できるか
+    html = "<h1>羽田&amp;成田</h1>\n<p>東京<b>国際</b>空港</p>"
+    plain = "羽田&成田\n東京国際空港"
+    file_path = str(tmp_path / "page.bin")
+    DataUtils.save_html_alignment(file_path, align_html(html, plain))
+    alignment = HtmlAlignment.load(file_path)
+    html_lines = html.split("\n")
+
+    assert len(alignment) == 2
+    assert alignment.to_html(0, 2, 3) == (6, 11)
+    assert [html_lines[line_id][s:e] for line_id, s, e in alignment.convert([(0, 0, 5), (1, 2, 6)])] \
+        == ["羽田&amp;成田", "国際</b>空港"]
+
+    tokenized_sentences = [
+        [("羽田", 0, 2), ("&", 2, 3), ("成田", 3, 5)],
+        [("東京", 0, 2), ("国際", 2, 4), ("空港", 4, 6)],
+    ]
+    assert alignment.convert_token_spans(tokenized_sentences, [((0, 1), (0, 3)), ((1, 0), (1, 2))]) \
+        == [((0, 6), (0, 13)), ((1, 3), (1, 10))]
@@ -0,0 +1,78 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from tests.pipeline import C_CLS, TOKENIZER_SPECS, write_dataset, make_annotation, make_args, tokenize, load_output
+from tokenization.export_utils import load_tokenized_dataset
+from tokenization.decode_utils import decode
+
+CATEGORY = "Airport"
+
+PLAIN_PAGES = {
+    "10":["東京 国際 空港 は 東京都 大田区 に ある", "", "通称 は 羽田 空港 。"],
+    "11":["成田 国際 空港", "千葉県 成田市 に ある 国際 空港 で ある"],
+    "12":["ページ 12 には アノテーション が 無い"],
+}
+# (ページid, 属性名, 行, 開始の単語, 終了の単語)
+ANNOTATIONS = [
+    ("10", "名前", 0, 0, 3),
+    ("10", "所在地", 0, 4, 6),
+    ("10", "別名", 2, 2, 4),
+    ("11", "名前", 0, 0, 3),
+    ("11", "所在地", 1, 0, 2),
+    ("11", "種類", 1, 4, 6),
+]
+
+def make_dataset(dataset_dir):
+    annotations = []
+    for page_id, attribute, line_id, start, end in ANNOTATIONS:
+        lines = PLAIN_PAGES[page_id]
+        words = lines[line_id].split(" ")
+        s = len(" ".join(words[:start])) + (start != 0)
+        e = len(" ".join(words[:end]))
+        annotations.append(make_annotation(page_id, attribute, lines, line_id, s, e))
+    pages = {page_id:([f"<p>{line}</p>" for line in lines], lines) for page_id, lines in PLAIN_PAGES.items()}
+    return write_dataset(dataset_dir, CATEGORY, pages, annotations)
+
+@pytest.mark.parametrize("output_format", ["text", "shard"])
+@pytest.mark.parametrize("parallel", [1, 2])
+def test_decode_round_trip(tmp_path, output_format, parallel):
+    # トークナイズしてマップしたtoken_offsetをdecodeで戻すと、元のtext_offsetになるか
+    dataset_dir = make_dataset(tmp_path / "dataset")
+    args = make_args(tmp_path / "output", output_format=output_format, parallel=parallel)
+    tokenize(args, dataset_dir)
+    _, annotations = load_output(args, CATEGORY)
+
+    predictions = [[], [], [], [], []]
+    for ann in annotations:
+        start, end = ann["token_offset"]["start"], ann["token_offset"]["end"]
+        assert start["line_id"] == end["line_id"]
+        for column, value in zip(predictions, (ann["page_id"], start["line_id"], start["offset"], end["offset"], ann["attribute"])):
+            column.append(value)
+    # 範囲外の予測と、出力に無いページの予測
+    for column, value in zip(predictions, ("11", 1, 5, 9, "種類")):
+        column.append(value)
+    for column, value in zip(predictions, ("99", 0, 0, 1, "名前")):
+        column.append(value)
+
+    tokenized_dataset = load_tokenized_dataset(args, os.path.join(args.output_dir, TOKENIZER_SPECS[0][0]))
+    output_path = str(tmp_path / "decoded.json")
+    plain_dir = os.path.join(dataset_dir[C_CLS], "plain", CATEGORY)
+    num_records, errors = decode(tokenized_dataset, CATEGORY, plain_dir, predictions, output_path, parallel)
+
+    assert num_records == len(annotations)
+    assert errors == {"invalid_span":1, "missing_page":1}
+    with open(output_path) as f:
+        decoded = [json.loads(line) for line in f]
+
+    def key(ann):
+        return ann["page_id"], ann["attribute"], json.dumps(ann["text_offset"], ensure_ascii=False)
+    assert sorted(map(key, decoded)) == sorted(map(key, annotations))
+    for record in decoded:
+        assert record["title"] == f"title{record['page_id']}" and record["ENE"] == "1.6.5.3"
+        line = PLAIN_PAGES[record["page_id"]][record["text_offset"]["start"]["line_id"]]
+        assert line[record["text_offset"]["start"]["offset"]:record["text_offset"]["end"]["offset"]] \
+            == record["text_offset"]["text"]
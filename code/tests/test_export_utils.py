@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from tests.pipeline import TOKENIZER_SPECS, write_dataset, make_annotation, make_args, tokenize, load_output
+from tokenization.export_utils import load_tokenized_dataset, export_dataset
+
+PAGES = {
+    "Airport":{"1":["東京 国際 空港", "羽田 空港"], "2":["成田 空港"]},
+    "City":{"3":["東京 都 大田 区"], "4":["千葉 県 成田 市", "", "成田 空港 が ある"]},
+}
+
+def make_dataset(dataset_dir):
+    for category, pages in PAGES.items():
+        annotations = [
+            make_annotation(page_id, "名前", lines, 0, 0, len(lines[0].split(" ")[0]))
+            for page_id, lines in pages.items()
+        ]
+        dataset = write_dataset(
+            dataset_dir, category,
+            {page_id:([f"<p>{line}</p>" for line in lines], lines) for page_id, lines in pages.items()},
+            annotations
+        )
+    return dataset
+
+def test_mixed_output_formats(tmp_path):
+    # カテゴリーごとに書き出し形式(text・shard)が異なる出力も、それぞれの形式で読み込めるか
+    dataset_dir = make_dataset(tmp_path / "dataset")
+    formats = {"Airport":"text", "City":"shard"}
+    for category, output_format in formats.items():
+        tokenize(make_args(tmp_path / "mixed", categories=[category], output_format=output_format), dataset_dir)
+
+    args = make_args(tmp_path / "mixed")
+    tokenized_dataset = load_tokenized_dataset(args, os.path.join(args.output_dir, TOKENIZER_SPECS[0][0]))
+    assert {category:tokenized_dataset.is_sharded(category) for category in formats} == {"Airport":False, "City":True}
+
+    for category, output_format in formats.items():
+        fresh_args = make_args(tmp_path / f"fresh_{category}", categories=[category], output_format=output_format)
+        tokenize(fresh_args, dataset_dir)
+        pages, annotations = load_output(args, category)
+        assert set(pages) == set(PAGES[category])
+        assert (pages, annotations) == load_output(fresh_args, category)
+
+def test_export_mixed_output_formats(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    dataset_dir = make_dataset(tmp_path / "dataset")
+    for category, output_format in {"Airport":"text", "City":"shard"}.items():
+        tokenize(make_args(tmp_path / "mixed", categories=[category], output_format=output_format), dataset_dir)
+
+    args = make_args(tmp_path / "mixed")
+    file_dir = os.path.join(args.output_dir, TOKENIZER_SPECS[0][0])
+    export_dataset(args, file_dir)
+    for category, pages in PAGES.items():
+        table = pa.ipc.open_file(pa.memory_map(os.path.join(file_dir, "JP-5", category, f"{category}.arrow"))).read_all()
+        rows = {row["page_id"]:row for row in table.to_pylist()}
+        assert set(rows) == set(pages)
+        for page_id, lines in pages.items():
+            assert [len(ids) for ids in rows[page_id]["token_ids"]] == [len(line.split()) for line in lines]
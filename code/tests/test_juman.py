@@ -0,0 +1,48 @@
+import os
+import sys
+import random
+
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("mojimoji")
+
+from tests.reference import make_line
+from tokenization.tokenize_utils import Tokenizer
+from tokenization.juman import JumanppProcessTokenizer
+
+STUB_COMMAND = f"{sys.executable} {os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tokenization', 'jumanpp_stub.py')}"
+
+def make_text(num_lines, seed=0):
+    # 空行と、分割が必要な長い行を含むテキスト
+    rand = random.Random(seed)
+    lines = []
+    for i in range(num_lines):
+        if rand.random() < 0.1:
+            lines.append(rand.choice(["", " ", "　"]))
+            continue
+        line, _ = make_line(rand.randint(1, 50), seed=seed * 1000 + i)
+        if rand.random() < 0.05:
+            line = "。".join([line] * 30)
+        lines.append(line)
+    return "\n".join(lines)
+
+@pytest.fixture
+def tokenizer():
+    tokenizer = JumanppProcessTokenizer(STUB_COMMAND)
+    yield tokenizer
+    tokenizer.process.close()
+
+@pytest.mark.parametrize("batch_size", [1, 7, JumanppProcessTokenizer.batch_size])
+def test_batched_matches_line_by_line(tokenizer, batch_size):
+    # まとめて流した結果が、1行ずつ解析した結果(Tokenizer.tokenize_text)と一致するか
+    text = tokenizer.normalize(make_text(300))
+
+    line_errors = Counter()
+    expected = Tokenizer.tokenize_text(tokenizer, text, line_errors, ignore_lines={3, 4})
+
+    tokenizer.batch_size = batch_size
+    errors = Counter()
+    assert tokenizer.tokenize_text(text, errors, ignore_lines={3, 4}) == expected
+    assert errors == line_errors
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from tests.reference import make_line, segment_normalized, legacy_align_tokens
+from tokenization.offset_utils import (
+    align_tokens, align_nfkc_tokens, _align_nfkc_tokens_by_span, align_html, HTML_ALIGN_WINDOW
+)
+
+# NFKCで文字数が変わる文字・合成文字・空白を含む行
+NFKC_LINES = [
+    "東京国際空港(ﾄｳｷｮｳｺｸｻｲｸｳｺｳ)は㍻4年に開港",
+    "①②③ ＡＢＣ\xa0ｶﾞｷﾞｸﾞ　ﬁﬂ",
+    "㌔㍍㎏ ｱ゙ が が ﾊﾟ",
+    "　 先頭と末尾の空白 　",
+    "###|##:#!= 記号だけの行",
+    "ℌℍ™℡ ½¼ ²³",
+]
+
+def run(func, line, tokens):
+    try:
+        return func(line, tokens, len(tokens))
+    except Exception:
+        return None
+
+@pytest.mark.parametrize("seed", range(20))
+def test_align_nfkc_tokens_matches_legacy(seed):
+    # tohoku_bertのオフセット計算が以前の方法(_align_nfkc_tokens_by_span)と一致するか
+    rand = random.Random(seed)
+    lines = NFKC_LINES + [make_line(rand.randint(1, 200), seed=seed * 100 + i)[0] for i in range(20)]
+    for line in lines:
+        tokens = segment_normalized(line, rand)
+        assert run(align_nfkc_tokens, line, tokens) == run(_align_nfkc_tokens_by_span, line, tokens), line
+
+@pytest.mark.parametrize("num_tokens", [1, 10, 100, 1000])
+def test_align_tokens_matches_legacy(num_tokens):
+    # MeCab・Jumanのオフセット計算が以前の方法と一致するか
+    for seed in range(10):
+        line, tokens = make_line(num_tokens, seed=seed)
+        assert align_tokens(line, tokens) == legacy_align_tokens(line, tokens)
+        # トークンを連結しても行と一致しない場合
+        assert align_tokens(line + "?", tokens) == legacy_align_tokens(line + "?", tokens)
+
+def html_spans(html, plain):
+    # 各行の文字ごとの(HTML上の開始, 終了)
+    return [list(zip(starts, ends)) for starts, ends in align_html(html, plain)]
+
+def test_align_html_entities():
+    # 文字参照は参照全体に対応付ける
+    html = "<p>A&amp;B &lt;x&gt; &#x3042;</p>"
+    spans = html_spans(html, "A&B <x> あ")[0]
+    assert [html[s:e] for s, e in spans] == ["A", "&amp;", "B", " ", "&lt;", "x", "&gt;", " ", "&#x3042;"]
+
+def test_align_html_tags():
+    # 行内のタグと、複数行にまたがるタグを読み飛ばす
+    html = "<p>東京<b>国際</b>空港</p>"
+    assert ["".join(html[s:e] for s, e in html_spans(html, "東京国際空港")[0])] == ["東京国際空港"]
+    assert html_spans(html, "東京国際空港")[0][2] == (html.index("国"), html.index("国") + 1)
+
+    html = "<p\nclass=x>ab</p>\ncd"
+    assert html_spans(html, "\nab\ncd") == [[], [(8, 9), (9, 10)], [(0, 1), (1, 2)]]
+
+def test_align_html_extra_html_chars():
+    # HTMLにのみある文字(脚注の記号など)は読み飛ばす
+    html = "<p>空港<sup>[1]</sup>は</p>"
+    assert html_spans(html, "空港は")[0][2] == (html.index("は"), html.index("は") + 1)
+
+def test_align_html_missing_char():
+    # HTMLに無い文字は-1とし、以降の文字はずらさずに対応付ける
+    html = "<p>abc</p>"
+    assert html_spans(html, "aXbc")[0] == [(3, 4), (-1, -1), (4, 5), (5, 6)]
+
+    # 離れた位置にある同じ文字には対応付けない
+    html = "<p>abcdef" + "-" * HTML_ALIGN_WINDOW + "X</p>"
+    assert html_spans(html, "aXbcdef")[0] == [(3, 4), (-1, -1), (4, 5), (5, 6), (6, 7), (7, 8), (8, 9)]
+
+    # HTMLに無い行
+    assert html_spans("<p>a</p>", "a\nb") == [[(3, 4)], [(-1, -1)]]
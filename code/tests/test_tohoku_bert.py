@@ -0,0 +1,89 @@
+import os
+import random
+import unicodedata
+
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("transformers")
+pytest.importorskip("tokenizers")
+pytest.importorskip("fugashi")
+MeCab = pytest.importorskip("MeCab")
+
+from tokenization import tohoku_bert
+from tokenization.tohoku_bert import (
+    TohokuBertTokenizer, TohokuBertFastTokenizer, DEFAULT_MECAB_IPADIC_DIR, SPECIAL_TOKENS
+)
+
+MECAB_DIC_DIR = os.environ.get("MECAB_IPADIC_DIR", DEFAULT_MECAB_IPADIC_DIR)
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(MECAB_DIC_DIR), reason="MeCab用ipadic辞書がありません。")
+
+DOCUMENTS = [
+    "東京国際空港(とうきょうこくさいくうこう)は、東京都大田区にある日本最大の空港である。\n"
+    "通称は羽田空港(はねだくうこう)。\n\n"
+    "滑走路は4本あり、ＡＢＣ滑走路とＤ滑走路からなる。",
+    "ｶﾀｶﾅの半角と①②③、㍻4年、ﬁﬂなどNFKCで変わる文字。\n"
+    "　全角空白 と\xa0ノーブレークスペース。",
+    # "#"や特殊トークンを含む行は従来の方法で戻す
+    "C#とF#、###見出し###、##:、#1位\n"
+    "[CLS]文頭と文中の[SEP]や[UNK]、単語中のA[MASK]B\n"
+    "[PAD]",
+    "辞書に無い文字: 𠮷野家、鷗外、髙島屋、🍣🍺\n"
+    "とても長い行" + "、同じ内容を繰り返す" * 200,
+]
+
+def build_vocab(vocab_dir, documents, seed=0):
+    # 文書に出現する単語の一部と文字から語彙を作る(一部の単語はsubwordに、一部の文字は[UNK]になる)
+    rand = random.Random(seed)
+    mecab = MeCab.Tagger(f"-d {MECAB_DIC_DIR}")
+    words, chars = Counter(), set()
+    for text in documents:
+        text = unicodedata.normalize("NFKC", text)
+        chars.update(c for c in text if not c.isspace())
+        node = mecab.parseToNode(text)
+        while node:
+            if node.surface:
+                words[node.surface] += 1
+            node = node.next
+
+    vocab = SPECIAL_TOKENS + ["#", "##", "###", "####"]
+    vocab += [word for word, _ in words.most_common() if rand.random() < 0.6]
+    chars = sorted(chars)
+    rand.shuffle(chars)
+    chars = chars[:int(len(chars) * 0.95)]
+    vocab += chars + ["##" + c for c in chars]
+    vocab += ["##" + word[1:3] for word in words if len(word) > 2 and rand.random() < 0.3]
+
+    os.makedirs(vocab_dir, exist_ok=True)
+    with open(os.path.join(vocab_dir, "vocab.txt"), "w") as f:
+        f.write("\n".join(dict.fromkeys(vocab)) + "\n")
+    return vocab_dir
+
+@pytest.fixture(scope="module")
+def vocab_dir(tmp_path_factory):
+    return build_vocab(str(tmp_path_factory.mktemp("tohoku_bert")), DOCUMENTS)
+
+def tokenize(tokenizer, documents):
+    errors = Counter()
+    return [tokenizer.tokenize_text(text, errors) for text in documents], errors
+
+def test_tokenizers_backend_matches_transformers(vocab_dir):
+    # tokenizers版の結果(subwordとオフセット、エラー数)がtransformers版と一致するか
+    legacy, legacy_errors = tokenize(TohokuBertTokenizer(MECAB_DIC_DIR, vocab_dir), DOCUMENTS)
+    new, new_errors = tokenize(TohokuBertFastTokenizer(MECAB_DIC_DIR, vocab_dir), DOCUMENTS)
+    assert new == legacy
+    assert new_errors == legacy_errors
+
+def test_instances_do_not_share_mecab(vocab_dir):
+    # 読み込み済みの語彙を共有しても、MeCabは各インスタンスのものを使うか
+    first = TohokuBertTokenizer(MECAB_DIC_DIR, vocab_dir)
+    shared = tohoku_bert.load_assets("transformers", vocab_dir, MECAB_DIC_DIR)[0]
+    mecab = first.basic_tokenizer.word_tokenizer.mecab
+    second = TohokuBertTokenizer(MECAB_DIC_DIR, vocab_dir)
+    assert first.basic_tokenizer.word_tokenizer.mecab is mecab
+    assert second.basic_tokenizer.word_tokenizer.mecab is not mecab
+    assert shared.word_tokenizer.mecab is not mecab
+    assert first.basic_tokenizer.vocab is second.basic_tokenizer.vocab
+    assert tokenize(first, DOCUMENTS) == tokenize(second, DOCUMENTS)
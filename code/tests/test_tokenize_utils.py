@@ -0,0 +1,59 @@
+import os
+import json
+
+import pytest
+
+from tests.pipeline import write_dataset, make_annotation, make_args, tokenize, load_output
+from tokenization.manifest_utils import MANIFEST_FILE
+
+CATEGORY = "Airport"
+
+# 2行目が<script>の行
+HTML_LINES = [
+    "<p>東京 国際 空港 は 日本 の 空港</p>",
+    "<script>var x = 1 ;</script>",
+    "<p>羽田 空港 とも 呼ぶ</p>",
+]
+PLAIN_LINES = [
+    "東京 国際 空港 は 日本 の 空港",
+    "var x = 1 ;",
+    "羽田 空港 とも 呼ぶ",
+]
+PAGES = {"1":(HTML_LINES, PLAIN_LINES), "2":(["<p>成田 空港</p>"], ["成田 空港"])}
+
+def annotations(script_annotation):
+    anns = [
+        make_annotation("1", "名前", PLAIN_LINES, 0, 0, 8),
+        make_annotation("2", "名前", ["成田 空港"], 0, 0, 5),
+    ]
+    if script_annotation:
+        anns.append(make_annotation("1", "別名", PLAIN_LINES, 1, 4, 5))
+    return anns
+
+@pytest.mark.parametrize("output_format", ["text", "shard"])
+@pytest.mark.parametrize("legacy_manifest", [False, True])
+def test_annotation_on_ignored_script_line(tmp_path, output_format, legacy_manifest):
+    # アノテーションのみ変わったページでも、除外した<script>の行に新しいアノテーションがある場合は
+    # マップし直すのではなくトークナイズし直し、新規に実行した場合と同じ出力になるか
+    args = make_args(tmp_path / "incremental", ignore_script=True, output_format=output_format)
+    tokenize(args, write_dataset(tmp_path / "v1", CATEGORY, PAGES, annotations(False)))
+    pages, _ = load_output(args, CATEGORY)
+    assert pages["1"][1] == []
+
+    if legacy_manifest: # <script>の行を記録していない以前のマニフェスト
+        manifest_path = os.path.join(args.output_dir, "space", "JP-5", CATEGORY, MANIFEST_FILE)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        del manifest["ignore_lines"]
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    dataset_dir = write_dataset(tmp_path / "v2", CATEGORY, PAGES, annotations(True))
+    tokenize(args, dataset_dir)
+    fresh_args = make_args(tmp_path / "fresh", ignore_script=True, output_format=output_format)
+    tokenize(fresh_args, dataset_dir)
+
+    pages, anns = load_output(args, CATEGORY)
+    assert (pages, anns) == load_output(fresh_args, CATEGORY)
+    assert [token for token, _, _ in pages["1"][1]] == ["var", "x", "=", "1", ";"]
+    assert pages["1"][1] != [] and len(anns) == 3
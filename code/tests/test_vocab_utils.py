@@ -0,0 +1,78 @@
+import os
+import json
+import argparse
+
+from array import array
+
+import pytest
+
+from data_utils import DataUtils, SHARD_ARRAYS
+from tokenization.vocab_utils import build_global_vocab, GLOBAL_VOCAB_FILE, GLOBAL_IDS_FILE
+
+VOCAB = ["東京", "空港", "の", "削除", "羽田"]
+
+def write_category(category_dir, shards, tokens=None):
+    # shardsは{シャード番号:[(ページid, 行ごとの語彙idのリスト), ...]}
+    # ページidがNoneのページはpage_indexに無い(差分実行で置き換え・削除された)ページ
+    os.makedirs(category_dir)
+    DataUtils.save_file(os.path.join(category_dir, "vocab.txt"), "\n".join(VOCAB))
+    if tokens is not None:
+        os.makedirs(os.path.join(category_dir, "tokens"))
+        for page_id, lines in tokens.items():
+            DataUtils.save_file(
+                os.path.join(category_dir, "tokens", f"{page_id}.txt"),
+                "\n".join(" ".join(f"{idx},0,1" for idx in line) for line in lines)
+            )
+        return
+
+    shard_dir = os.path.join(category_dir, "shards")
+    os.makedirs(shard_dir)
+    page_index = {}
+    for shard_id, pages in shards.items():
+        shard = {name:array("i") for name in SHARD_ARRAYS}
+        for page_id, lines in pages:
+            if page_id is not None:
+                page_index[page_id] = (shard_id, len(shard["lines"]), len(lines))
+            for line in lines:
+                shard["lines"].append(len(shard["ids"]))
+                shard["ids"].extend(line)
+                shard["starts"].extend([0] * len(line))
+                shard["ends"].extend([1] * len(line))
+            # 次のページの先頭(=このページの末尾)
+            shard["lines"].append(len(shard["ids"]))
+        DataUtils.save_shard(shard_dir, shard_id, shard)
+    DataUtils.save_file(os.path.join(shard_dir, "page_index.json"), json.dumps(page_index))
+
+def build(file_dir, parallel):
+    args = argparse.Namespace(parallel=parallel, categories=None)
+    build_global_vocab(args, str(file_dir))
+    outputs = {GLOBAL_VOCAB_FILE:DataUtils.load_file(os.path.join(file_dir, GLOBAL_VOCAB_FILE))}
+    for category in ("Airport", "City"):
+        with open(os.path.join(file_dir, "JP-5", category, GLOBAL_IDS_FILE), "rb") as f:
+            outputs[category] = array("i", f.read()).tolist()
+    return outputs
+
+@pytest.mark.parametrize("parallel", [1, 2, 5])
+def test_incremental_shards_match_fresh(tmp_path, parallel):
+    # 差分実行で残ったシャード上の古いページは数えず、新規の実行と同じ共通語彙になるか
+    page1 = [[0, 1, 2], [4]]
+    page2 = [[0, 1], [2, 0]]
+    city = {"10":[[0, 2, 0]], "11":[[4, 4]]}
+
+    incremental = tmp_path / "incremental"
+    write_category(incremental / "JP-5" / "Airport", {
+        0:[("1", page1), (None, [[3, 3, 3, 4, 4]])],
+        1:[(None, [[3], [1, 1]]), ("2", page2)],
+        2:[(None, [[3, 3]])],
+    })
+    write_category(incremental / "JP-5" / "City", None, tokens=city)
+
+    fresh = tmp_path / "fresh"
+    write_category(fresh / "JP-5" / "Airport", {0:[("1", page1), ("2", page2)]})
+    write_category(fresh / "JP-5" / "City", None, tokens=city)
+
+    expected = build(fresh, parallel)
+    assert build(incremental, parallel) == expected
+    # 削除されたページにのみ出現する語彙は-1
+    assert expected["Airport"][VOCAB.index("削除")] == -1
+    assert expected[GLOBAL_VOCAB_FILE].split("\n")[:2] == ["東京", "の"]
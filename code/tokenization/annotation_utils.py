@@ -1,11 +1,69 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from multiprocessing import Pool
 
 from data_utils import DataTools, DataUtils
 
+class TokenOffsetIndex(object):
+    """
+    ドキュメントの行ごとにトークンの開始・終了オフセットの配列を保持し、
+    二分探索でオフセットに対応するトークンの位置を求めます。
+    配列は最初に参照された行についてのみ作成します。
+    """
+    def __init__(self, tokenized_sentences):
+        self.__tokenized_sentences = tokenized_sentences
+        self.__lines = {}
+
+    def _get_line(self, line_id):
+        line = self.__lines.get(line_id)
+        if line is None:
+            tokens = self.__tokenized_sentences[line_id]
+            starts = array("i", [s for _, s, _ in tokens])
+            ends = array("i", [e for _, _, e in tokens])
+            # 開始・終了オフセットが単調増加でない場合は二分探索できない
+            is_sorted = all(starts[i] <= starts[i + 1] and ends[i] <= ends[i + 1] for i in range(len(tokens) - 1))
+            line = self.__lines[line_id] = (starts, ends, is_sorted)
+        return line
+
+    def find_start(self, line_id, offset):
+        """
+        offsetを含む最初のトークンの位置を返します。
+        """
+        starts, ends, is_sorted = self._get_line(line_id)
+        if not is_sorted:
+            for i, (s, e) in enumerate(zip(starts, ends)):
+                if offset >= s and offset < e:
+                    return i, s
+            return None, None
+
+        i = bisect_right(ends, offset)
+        if i < len(starts) and starts[i] <= offset:
+            return i, starts[i]
+        return None, None
+
+    def find_end(self, line_id, offset):
+        """
+        offsetで終わる範囲を含む最初のトークンの次の位置を返します。
+        """
+        starts, ends, is_sorted = self._get_line(line_id)
+        if not is_sorted:
+            for i, (s, e) in enumerate(zip(starts, ends)):
+                if offset > s and offset <= e:
+                    return i + 1, e
+            return None, None
+
+        i = bisect_left(ends, offset)
+        if i < len(starts) and starts[i] < offset:
+            return i + 1, ends[i]
+        return None, None
+
 def annotation_mapper(annotation, tokenized_sentences, ann_key="token", patch={}):
     """
     オフセットを各トークンにマップします。
+    ページ内の全アノテーションで行ごとのオフセットの索引を共有し、二分探索で対応付けます。
     """
+    index = TokenOffsetIndex(tokenized_sentences)
+
     match_errors = 0
     for ann in annotation:
         if ann.get("text_offset") is None: # 総称フラグ関連
@@ -21,30 +79,26 @@ def annotation_mapper(annotation, tokenized_sentences, ann_key="token", patch={}
 
         match_error = False
 
-        tokens = tokenized_sentences[start["line_id"]]
-        for i, (token, s, e) in enumerate(tokens):
-            if start["offset"] >= s and start["offset"] < e:
-                ann["token_offset"]["start"]["offset"] = i
-                if s != start["offset"]:
-                    match_error = True
-                break
+        i, s = index.find_start(start["line_id"], start["offset"])
+        if i is not None:
+            ann["token_offset"]["start"]["offset"] = i
+            if s != start["offset"]:
+                match_error = True
 
         assert ann["token_offset"]["start"].get("offset") is not None, \
-            f"Startオフセットマッチエラー\ntokens:{tokens}\nann:{ann['text_offset']}"
+            f"Startオフセットマッチエラー\ntokens:{tokenized_sentences[start['line_id']]}\nann:{ann['text_offset']}"
 
-        tokens = tokenized_sentences[end["line_id"]]
-        for i, (token, s, e) in enumerate(tokens):
-            if end["offset"] > s and end["offset"] <= e:
-                ann["token_offset"]["end"]["offset"] = i + 1
-                if e != end["offset"]:
-                    match_error = True
-                break
+        i, e = index.find_end(end["line_id"], end["offset"])
+        if i is not None:
+            ann["token_offset"]["end"]["offset"] = i
+            if e != end["offset"]:
+                match_error = True
 
         if ann["token_offset"]["end"].get("offset") is None:
             key=(int(ann["page_id"]), ann["attribute"], ann["text_offset"]["end"]["line_id"], ann["text_offset"]["end"]["offset"])
             ann["token_offset"]["end"]["offset"] = patch.get(key)
 
-        assert ann["token_offset"]["end"].get("offset") is not None, f"Endオフセットマッチエラー\n{ann}\ntokens:{tokens}\nann:{ann['text_offset']}"
+        assert ann["token_offset"]["end"].get("offset") is not None, f"Endオフセットマッチエラー\n{ann}\ntokens:{tokenized_sentences[end['line_id']]}\nann:{ann['text_offset']}"
 
         #del ann["text_offset"]
         #del ann["html_offset"]
@@ -0,0 +1,78 @@
+import os
+import pickle
+import sqlite3
+import hashlib
+
+from collections import Counter, OrderedDict
+
+class LineCache(object):
+    """
+    行の内容をキーに、トークナイズ結果(トークン, オフセット, エラー数)を保持するLRUキャッシュです。
+    cache_dirを指定した場合は、sqliteによるディスク上のキャッシュも併用します。
+    ディスク上のキャッシュはトークナイザーと辞書などの設定(namespace)ごとに分けられます。
+    max_sizeが0の場合はメモリ上には保持せず、ディスク上のキャッシュのみ使います。
+    """
+    def __init__(self, namespace, max_size=65536, cache_dir=None, commit_interval=1000):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.commit_interval = commit_interval
+        self.stats = Counter()
+
+        self.__items = OrderedDict()
+        self.__pending = []
+
+        self.__db = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            name = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:16]
+            self.__db = sqlite3.connect(os.path.join(cache_dir, f"{name}.sqlite"), timeout=600)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB)")
+            self.__db.commit()
+
+    @staticmethod
+    def _key(line):
+        return hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, line):
+        value = self.__items.get(line)
+        if value is not None:
+            self.__items.move_to_end(line)
+            self.stats["cache_hit"] += 1
+            return value
+
+        if self.__db is not None:
+            row = self.__db.execute("SELECT value FROM cache WHERE key = ?", (self._key(line),)).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self._put_memory(line, value)
+                self.stats["cache_hit"] += 1
+                self.stats["cache_disk_hit"] += 1
+                return value
+
+        self.stats["cache_miss"] += 1
+        return None
+
+    def _put_memory(self, line, value):
+        if self.max_size <= 0:
+            return
+        self.__items[line] = value
+        if len(self.__items) > self.max_size:
+            self.__items.popitem(last=False)
+
+    def put(self, line, value):
+        self._put_memory(line, value)
+        if self.__db is not None:
+            self.__pending.append((self._key(line), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+            if len(self.__pending) >= self.commit_interval:
+                self.flush()
+
+    def flush(self):
+        if self.__db is not None and len(self.__pending) != 0:
+            self.__db.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?)", self.__pending)
+            self.__db.commit()
+            self.__pending = []
+
+    def pop_stats(self):
+        stats, self.stats = self.stats, Counter()
+        return stats
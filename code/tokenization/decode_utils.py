@@ -0,0 +1,166 @@
+import os
+
+from collections import Counter
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None # decodeを使わない場合は不要
+
+from data_utils import DataUtils, DataTools
+from tokenization.tokenize_utils import JOBS_PER_WORKER
+
+def load_page_offsets(location):
+    """
+    ページの(各行の先頭のトークン位置, 開始オフセット, 終了オフセット)の配列を返します。
+    トークン位置は開始・終了オフセットの配列での位置です。
+    シャードの場合はメモリマップした配列をコピーせずに参照します。
+    """
+    if location[0] == "shard":
+        shard_dir, shard_id, line_offset, num_lines = location[1:]
+        shard = {
+            name:np.frombuffer(DataUtils.mmap_int32(os.path.join(shard_dir, f"{shard_id}.{name}.bin")), dtype=np.int32)
+            for name in ("starts", "ends", "lines")
+        }
+        return shard["lines"][line_offset:line_offset + num_lines + 1], shard["starts"], shard["ends"]
+
+    tokenized_sentences = DataUtils.load_tokenized_file(location[1])
+    line_offsets = np.zeros(len(tokenized_sentences) + 1, dtype=np.int64)
+    np.cumsum([len(tokens) for tokens in tokenized_sentences], out=line_offsets[1:])
+    tokens = np.array([token for tokens in tokenized_sentences for token in tokens], dtype=np.int32).reshape(-1, 3)
+    return line_offsets, tokens[:, 1], tokens[:, 2]
+
+def decode_pages(chunks):
+    """
+    (ページid, プレーンテキストのパス, トークンの位置, ページの情報, 予測の配列の組)のリストを受け取り、
+    各予測を`*_dist.json`形式の1行のJSONにして返します。
+    予測の検証とトークン位置からオフセットへの変換は、ページごとに配列でまとめて行います。
+    """
+    lines, errors = [], Counter()
+    for page_id, plain_path, location, page_info, (line_ids, token_starts, token_ends, attributes) in chunks:
+        if location is None:
+            errors["missing_page"] += len(line_ids)
+            continue
+
+        line_offsets, starts, ends = load_page_offsets(location)
+        num_lines = len(line_offsets) - 1
+
+        # ページの範囲外の行は長さ0の行として扱い、範囲外の予測を除く
+        line_lengths = np.append(np.diff(line_offsets), 0)
+        in_page = (0 <= line_ids) & (line_ids < num_lines)
+        valid = (0 <= token_starts) & (token_starts < token_ends) \
+            & (token_ends <= line_lengths[np.where(in_page, line_ids, num_lines)]) & in_page
+        num_invalid = len(valid) - int(np.count_nonzero(valid))
+        if num_invalid != 0:
+            errors["invalid_span"] += num_invalid
+
+        line_ids, token_starts, token_ends = line_ids[valid], token_starts[valid], token_ends[valid]
+        bases = line_offsets[line_ids]
+        char_starts = starts[bases + token_starts]
+        char_ends = ends[bases + token_ends - 1]
+
+        text_lines = DataUtils.load_file(plain_path).split("\n")
+        for line_id, token_start, token_end, attribute, start, end in zip(
+            line_ids.tolist(), token_starts.tolist(), token_ends.tolist(),
+            attributes[valid].tolist(), char_starts.tolist(), char_ends.tolist()
+        ):
+            text = text_lines[line_id][start:end]
+
+            record = {"page_id":page_id}
+            if "title" in page_info:
+                record["title"] = page_info["title"]
+            record["attribute"] = attribute
+            record["text_offset"] = {
+                "start":{"line_id":line_id, "offset":start},
+                "end":{"line_id":line_id, "offset":end},
+                "text":text
+            }
+            if "ENE" in page_info:
+                record["ENE"] = page_info["ENE"]
+            record["token_offset"] = {
+                "start":{"line_id":line_id, "offset":token_start},
+                "end":{"line_id":line_id, "offset":token_end},
+                "text":text
+            }
+            lines.append(DataUtils.json_dumps(record))
+    return lines, errors
+
+def get_page_location(tokenized_dataset, category, page_id):
+    if tokenized_dataset.is_sharded(category):
+        location = tokenized_dataset.page_index[category].get(page_id)
+        if location is None:
+            return None
+        return ("shard", tokenized_dataset.shard_dirs[category], *location)
+
+    tokens_path = tokenized_dataset.tokens_paths[category].get(page_id)
+    if tokens_path is None:
+        return None
+    return ("text", tokens_path)
+
+def annotation_info(annotation):
+    # 同じページのアノテーションがあれば、タイトルとENEを引き継ぐ
+    if not annotation:
+        return {}
+    return {key:annotation[0][key] for key in ("title", "ENE") if key in annotation[0]}
+
+def get_page_info(tokenized_dataset, category, page_id):
+    return annotation_info(tokenized_dataset.annotations.get(category, {}).get(page_id))
+
+def decode(tokenized_dataset, category, plain_dir, predictions, output_path, parallel=1):
+    """
+    トークン単位の予測を、配布データと同じ`*_dist.json`形式(text_offsetと表層文字列付き)で書き出します。
+    predictionsは同じ長さの(page_id, line_id, 開始トークン, 終了トークン, 属性名)の配列の組です。
+    終了トークンは範囲に含まれない次のトークンの位置です。
+    予測はページごとにまとめて並列に処理し、処理が終わったジョブから順に書き出します。
+    書き出した件数と、書き出せなかった予測の数を返します。
+    """
+    if np is None:
+        raise ModuleNotFoundError("予測の書き出しにはnumpyが必要です。\n$ pip install numpy")
+
+    page_ids, line_ids, token_starts, token_ends, attributes = predictions
+    page_ids = np.asarray(page_ids).astype(str)
+    columns = (
+        np.asarray(line_ids, dtype=np.int64),
+        np.asarray(token_starts, dtype=np.int64),
+        np.asarray(token_ends, dtype=np.int64),
+        np.asarray(attributes, dtype=object),
+    )
+
+    # ページごとにまとめる(ページは最初に出現した順、ページ内は元の順)
+    unique_ids, first_indices, inverse = np.unique(page_ids, return_index=True, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(unique_ids)))])
+
+    targets = []
+    for idx in np.argsort(first_indices, kind="stable"):
+        page_id = str(unique_ids[idx])
+        rows = order[bounds[idx]:bounds[idx + 1]]
+        targets.append((
+            page_id,
+            os.path.join(plain_dir, f"{page_id}.txt"),
+            get_page_location(tokenized_dataset, category, page_id),
+            get_page_info(tokenized_dataset, category, page_id),
+            tuple(column[rows] for column in columns)
+        ))
+
+    num_jobs = max(1, min(len(targets), parallel * JOBS_PER_WORKER))
+    jobs = DataTools.split_array(targets, num_jobs)
+
+    num_records, total_errors = 0, Counter()
+    with DataUtils.atomic_open(output_path, "w") as f:
+        def write(results):
+            nonlocal num_records, total_errors
+            for lines, errors in results:
+                for line in lines:
+                    f.write(line + "\n")
+                num_records += len(lines)
+                total_errors += errors
+
+        if parallel == 1:
+            write(map(decode_pages, jobs))
+        else:
+            with Pool(parallel) as p:
+                write(p.imap(decode_pages, jobs))
+
+    return num_records, total_errors
@@ -0,0 +1,170 @@
+import os
+import glob
+
+from array import array
+from multiprocessing import Pool
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    pa = None # --exportを指定しない場合は不要
+
+from data_utils import DataUtils, ShardedPage, AnnotationIndex, TokenizedDataset, ShardedTokenizedDataset
+from tokenization.decode_utils import get_page_location, annotation_info
+
+EXPORT_FORMATS = {"arrow":".arrow", "parquet":".parquet"}
+# 1つのレコードバッチ(Parquetの場合は行グループ)にまとめるページ数
+PAGES_PER_BATCH = 1000
+# 各アノテーションのうち列として書き出すオフセット
+ANNOTATION_OFFSETS = ("html_offset", "text_offset", "token_offset")
+
+def get_schema():
+    """
+    1ページ1行のテーブルのスキーマです。
+    トークンは行ごとのlist<int32>をページごとにまとめたlist<list<int32>>として格納します。
+    """
+    if pa is None:
+        raise ModuleNotFoundError("Arrow/Parquetでの書き出しにはpyarrowが必要です。\n$ pip install pyarrow")
+
+    position = pa.struct([("line_id", pa.int32()), ("offset", pa.int32())])
+    span = pa.struct([("start", position), ("end", position), ("text", pa.string())])
+    annotation = pa.struct([("attribute", pa.string())] + [(name, span) for name in ANNOTATION_OFFSETS])
+    tokens = pa.list_(pa.list_(pa.int32()))
+    return pa.schema([
+        ("page_id", pa.string()),
+        ("title", pa.string()),
+        ("ENE", pa.string()),
+        ("token_ids", tokens),
+        ("token_starts", tokens),
+        ("token_ends", tokens),
+        ("annotations", pa.list_(annotation)),
+    ])
+
+def load_page_tokens(location):
+    """
+    ページの各行の(語彙idの配列, 開始オフセットの配列, 終了オフセットの配列)を返します。
+    """
+    if location[0] == "shard":
+        return ShardedPage.open(*location[1:])
+    return [
+        ([idx for idx, _, _ in tokens], [s for _, s, _ in tokens], [e for _, _, e in tokens])
+        for tokens in DataUtils.load_tokenized_file(location[1])
+    ]
+
+def int32_array(values):
+    return pa.Array.from_buffers(pa.int32(), len(values), [None, pa.py_buffer(values)])
+
+def export_pages(chunks):
+    """
+    (ページid, トークンの位置, アノテーションの位置)のリストを受け取り、
+    1つのRecordBatchにして返します。
+    アノテーションはワーカー側で`AnnotationIndex`の位置からページごとに読み込みます。
+    トークンは連続したint32の配列に詰めてから、行とページの境界でリストにします。
+    """
+    schema = get_schema()
+    values = {name:array("i") for name in ("ids", "starts", "ends")}
+    line_offsets, page_offsets = array("i", [0]), array("i", [0])
+    columns = {"page_id":[], "title":[], "ENE":[], "annotations":[]}
+    for page_id, location, annotation_location in chunks:
+        annotation = [] if annotation_location is None else AnnotationIndex.load(annotation_location)
+        page_info = annotation_info(annotation)
+        for ids, starts, ends in load_page_tokens(location):
+            values["ids"].extend(ids)
+            values["starts"].extend(starts)
+            values["ends"].extend(ends)
+            line_offsets.append(len(values["ids"]))
+        page_offsets.append(len(line_offsets) - 1)
+
+        columns["page_id"].append(page_id)
+        columns["title"].append(page_info.get("title"))
+        columns["ENE"].append(page_info.get("ENE"))
+        columns["annotations"].append([
+            {"attribute":ann.get("attribute"), **{name:ann.get(name) for name in ANNOTATION_OFFSETS}}
+            for ann in annotation
+        ])
+
+    arrays = []
+    for field in schema:
+        if field.name in ("token_ids", "token_starts", "token_ends"):
+            lines = pa.ListArray.from_arrays(int32_array(line_offsets), int32_array(values[field.name[6:]]))
+            arrays.append(pa.ListArray.from_arrays(int32_array(page_offsets), lines))
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def get_page_ids(tokenized_dataset, category):
+    if tokenized_dataset.is_sharded(category):
+        return sorted(tokenized_dataset.page_index[category])
+    return sorted(tokenized_dataset.tokens_paths[category])
+
+class ArrowWriter(object):
+    """
+    Arrow IPCファイル(メモリマップで読み込めます)かParquetに、RecordBatchを順に書き出します。
+    Parquetの場合は各RecordBatchが1つの行グループになります。
+    """
+    def __init__(self, f, schema, export_format):
+        self.export_format = export_format
+        if export_format == "parquet":
+            self.writer = pq.ParquetWriter(f, schema)
+        else:
+            self.writer = pa.ipc.new_file(f, schema)
+
+    def write(self, batch):
+        if self.export_format == "parquet":
+            self.writer.write_batch(batch, row_group_size=batch.num_rows or None)
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+def export_category(tokenized_dataset, category, output_path, export_format="arrow", parallel=1, pages_per_batch=PAGES_PER_BATCH):
+    """
+    カテゴリーのトークンとアノテーションを1つのテーブルとして書き出し、書き出したページ数を返します。
+    ページはpages_per_batchごとに並列に変換し、変換が終わったものから順に書き出すため、
+    カテゴリー全体をメモリに載せる必要はありません。
+    """
+    schema = get_schema()
+    annotation_index = tokenized_dataset.annotations[category]
+    targets = [(
+        page_id,
+        get_page_location(tokenized_dataset, category, page_id),
+        annotation_index.locate(page_id)
+    ) for page_id in get_page_ids(tokenized_dataset, category)]
+    jobs = [targets[idx:idx + pages_per_batch] for idx in range(0, len(targets), pages_per_batch)]
+
+    with DataUtils.atomic_open(output_path, "wb") as f:
+        writer = ArrowWriter(f, schema, export_format)
+        if parallel == 1 or len(jobs) <= 1:
+            for batch in map(export_pages, jobs):
+                writer.write(batch)
+        else:
+            with Pool(parallel) as p:
+                for batch in p.imap(export_pages, jobs):
+                    writer.write(batch)
+        writer.close()
+    return len(targets)
+
+def load_tokenized_dataset(args, file_dir):
+    """
+    トークナイザーの出力フォルダを、書き出し形式(text・shard)に応じて読み込みます。
+    形式はカテゴリーごとに異なっていても構いません。
+    """
+    if len(glob.glob(os.path.join(file_dir, "*/*/shards/page_index.json"))) != 0:
+        return ShardedTokenizedDataset(args, file_dir)
+    return TokenizedDataset(args, file_dir)
+
+def export_dataset(args, file_dir, export_format="arrow"):
+    """
+    トークナイザーの出力フォルダの各カテゴリーを`(カテゴリー名).arrow`(または`.parquet`)として
+    カテゴリーのフォルダに書き出します。
+    """
+    get_schema() # pyarrowが無い場合はデータセットを読み込む前に止める
+    tokenized_dataset = load_tokenized_dataset(args, file_dir)
+    for category in tokenized_dataset.categories:
+        output_path = os.path.join(
+            tokenized_dataset.category_dirs[category], f"{category}{EXPORT_FORMATS[export_format]}"
+        )
+        num_pages = export_category(tokenized_dataset, category, output_path, export_format, args.parallel)
+        print(f"{output_path}:{num_pages}ページ")
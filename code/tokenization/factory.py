@@ -0,0 +1,51 @@
+from tokenization.cache_utils import LineCache
+from tokenization.tokenize_utils import get_cache_namespace
+
+# 対応しているトークナイザー(main.pyの--tokenizersと共通)
+TOKENIZER_NAMES = [
+    "mecab_ipadic",
+    "mecab_jumandic",
+    "jumanpp",
+    "tohoku_bert_mecab_ipadic_bpe",
+]
+
+def get_tokenizer_spec(name, jumanpp_backend="pyknp", tohoku_bert_backend="transformers", tohoku_bert_vocab_dir=None):
+    """
+    トークナイザー名から(出力名, トークナイザーのクラス, 初期化引数)を返します。
+    各トークナイザーのモジュールは必要になった時点で読み込みます。
+    """
+    if name == "mecab_ipadic":
+        from tokenization import mecab
+        return mecab.get_tokenizer_spec("ipadic")
+
+    if name == "mecab_jumandic":
+        from tokenization import mecab
+        return mecab.get_tokenizer_spec("jumandic")
+
+    if name == "jumanpp":
+        from tokenization import juman
+        return juman.get_tokenizer_spec("jumanpp", jumanpp_backend)
+
+    if name == "tohoku_bert_mecab_ipadic_bpe":
+        from tokenization import tohoku_bert
+        return tohoku_bert.get_tokenizer_spec(tohoku_bert_backend, tohoku_bert_vocab_dir)
+
+    raise ValueError(f"未対応のトークナイザーです:{name}\n{TOKENIZER_NAMES}")
+
+def get_tokenizer(name, jumanpp_backend="pyknp", line_cache_size=0,
+                  tohoku_bert_backend="transformers", tohoku_bert_vocab_dir=None):
+    """
+    トークナイザーを初期化して返します。
+    一度初期化すれば、`tokenize_document`/`tokenize_documents`で何度でもトークナイズできます。
+    line_cache_sizeを指定した場合は、同じ内容の行の結果を使い回します。
+    """
+    output_name, tokenizer_cls, tokenizer_kwargs = get_tokenizer_spec(
+        name, jumanpp_backend, tohoku_bert_backend, tohoku_bert_vocab_dir
+    )
+    tokenizer = tokenizer_cls(**tokenizer_kwargs)
+    if line_cache_size > 0:
+        tokenizer.line_cache = LineCache(
+            get_cache_namespace(output_name, tokenizer_cls, tokenizer_kwargs),
+            max_size=line_cache_size
+        )
+    return tokenizer
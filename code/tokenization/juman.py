@@ -1,190 +1,248 @@
 import os
 import re
-import tqdm
-
-from multiprocessing import Pool
-
-from collections import Counter
+import shlex
+import threading
+import subprocess
 
 try:
     from pyknp import Juman
 except ModuleNotFoundError:
-    raise ModuleNotFoundError("指定したトーカナイザーにはpyknpが必要です。\n$ pip install pyknp")
+    Juman = None # --jumanpp_backend processの場合は不要
 
 try:
     import mojimoji
 except ModuleNotFoundError:
     raise ModuleNotFoundError("指定したトーカナイザーにはmojimojiが必要です。\n$ pip install mojimoji")
 
-from data_utils import DataUtils, DataTools
-from tokenization.vocab_utils import count_vocab
-from tokenization.annotation_utils import annotation_mapper
-
-def tokenize(inputs):
-    temp_path, command, chunks = inputs
-
-    if command == "jumanpp":
-        parser = Juman()
-    else:
-        parser = Juman(jumanpp=False)
-
-    errors = Counter()
-    mapped_annotation = {}
-    tokenized_documents = []
-    for page_id, file_path, annotation in chunks:
-        text = DataUtils.load_file(file_path)
-
-        text = mojimoji.han_to_zen(text) # 全角に正規化
+from tokenization import tokenize_utils
+from tokenization.tokenize_utils import Tokenizer
+from tokenization.offset_utils import align_tokens
+
+class JumanTokenizer(Tokenizer):
+    name = "Juman"
+    error_key = "juman"
+    normalization = "han_to_zen"
+
+    def __init__(self, command):
+        if Juman is None:
+            raise ModuleNotFoundError("指定したトーカナイザーにはpyknpが必要です。\n$ pip install pyknp")
+
+        if command == "jumanpp":
+            self.parser = Juman()
+        else:
+            self.parser = Juman(jumanpp=False)
+
+    def normalize(self, text):
+        return mojimoji.han_to_zen(text) # 全角に正規化
+
+    def tokenize_line(self, line, errors):
+        try:
+            parsed = self.parser.analysis(line)
+            tokens = [mrph.midasi for mrph in parsed.mrph_list()]
+        except: # 主に入力長の問題
+            tokens = []
+
+        if len(tokens) == 0: # 入力が長文すぎた場合のpyknpのエラーに対応
+            if "。" not in line: # 文ではない余計な文字列
+                for idx in range(0, len(line), 100): # 無理やり分割
+                    parsed = self.parser.analysis(line[idx:idx + 100])
+                    tokens += [mrph.midasi for mrph in parsed.mrph_list()]
+            else: # 分単位に区切って処理
+                for sentence in re.findall(".*?。", line):
+                    parsed = self.parser.analysis(sentence)
+                    tokens += [mrph.midasi for mrph in parsed.mrph_list()]
+
+        offsets, consistent = align_tokens(line, tokens)
+        if not consistent:
+            errors["consistency"] += 1
+
+        return tokens, offsets
+
+class JumanppProcess(object):
+    """
+    jumanppのプロセスを起動したままにし、複数行をまとめて標準入出力に流して解析します。
+    書き込みは別スレッドで行い、パイプが詰まってデッドロックしない様にします。
+    """
+    def __init__(self, command):
+        self.command = shlex.split(command)
+        self.process = None
+
+    def start(self):
+        self.close()
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
 
-        tokenized_sentences = []
-        for line in text.split("\n"):
-            if len(line.strip()) == 0:
-                tokenized_sentences.append([])
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def _write(self, lines):
+        try:
+            self.process.stdin.write("".join(line + "\n" for line in lines).encode("utf-8"))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError): # 読み込み側でエラーになる
+            pass
+
+    def _read_sentence(self):
+        tokens = []
+        while True:
+            output = self.process.stdout.readline()
+            if len(output) == 0:
+                raise RuntimeError("jumanppが終了しました。")
+
+            output = output.decode("utf-8", "ignore").rstrip("\n")
+            if output == "EOS":
+                return tokens
+            if output.startswith("@ ") or output.startswith("# "): # 曖昧性のある形態素・コメント
                 continue
-
+            if output.startswith("\\ ") or output.startswith("\\␣"): # 半角空白
+                tokens.append(" ")
+                continue
+            tokens.append(output.split(" ", 1)[0])
+
+    def analyze(self, lines):
+        """
+        各行の形態素の見出しのリストを返します。
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        writer = threading.Thread(target=self._write, args=(lines,))
+        writer.start()
+        try:
+            results = [self._read_sentence() for _ in lines]
+        except:
+            # 入出力の対応が崩れるため、次回は起動し直す
+            self.close()
+            raise
+        finally:
+            writer.join()
+        return results
+
+class JumanppProcessTokenizer(Tokenizer):
+    """
+    jumanppのプロセスをワーカーごとに1つ起動したままにし、
+    ドキュメントの行をまとめて解析します。
+    長すぎる行は解析前に文単位(文が無い場合は一定の長さ)に分割します。
+    """
+    name = "Juman"
+    error_key = "juman"
+    normalization = "han_to_zen"
+
+    max_line_length = 1000 # これより長い行は分割
+    split_length = 100 # 文に分割できない場合の長さ
+    batch_size = 256 # 一度にjumanppに流す行数
+
+    def __init__(self, command):
+        self.process = JumanppProcess(command)
+
+    def normalize(self, text):
+        return mojimoji.han_to_zen(text) # 全角に正規化
+
+    def split_line(self, line):
+        if len(line) <= self.max_line_length:
+            return [line]
+
+        pieces = []
+        for sentence in re.findall("[^。]*。|[^。]+", line):
+            if len(sentence) <= self.max_line_length:
+                pieces.append(sentence)
+                continue
+            for idx in range(0, len(sentence), self.split_length): # 無理やり分割
+                pieces.append(sentence[idx:idx + self.split_length])
+        return pieces
+
+    def analyze(self, pieces):
+        results = []
+        for idx in range(0, len(pieces), self.batch_size):
+            batch = pieces[idx:idx + self.batch_size]
             try:
-                parsed = parser.analysis(line)
-                tokens = [mrph.midasi for mrph in parsed.mrph_list()]
-            except: # 主に入力長の問題
-                tokens = []
-
-            if len(tokens) == 0: # 入力が長文すぎた場合のpyknpのエラーに対応
-                try:
-                    if "。" not in line: # 文ではない余計な文字列
-                        for idx in range(0, len(line), 100): # 無理やり分割
-                            parsed = parser.analysis(line[idx:idx + 100])
-                            tokens += [mrph.midasi for mrph in parsed.mrph_list()]
-                    else: # 分単位に区切って処理
-                        for sentence in re.findall(".*?。", line):
-                            parsed = parser.analysis(sentence)
-                            tokens += [mrph.midasi for mrph in parsed.mrph_list()]
-                except:
-                    tokenized_sentences.append([])
-                    errors["juman"] += 1
+                results += self.process.analyze(batch)
+            except:
+                # エラーの原因となった行を特定するため1行ずつ解析し直す
+                for piece in batch:
+                    try:
+                        results += self.process.analyze([piece])
+                    except:
+                        results.append(None)
+        return results
+
+    def tokenize_line(self, line, errors):
+        tokens = []
+        for piece_tokens in self.analyze(self.split_line(line)):
+            if piece_tokens is None:
+                raise RuntimeError("jumanppの解析に失敗しました。")
+            tokens += piece_tokens
+
+        offsets, consistent = align_tokens(line, tokens)
+        if not consistent:
+            errors["consistency"] += 1
+
+        return tokens, offsets
+
+    def tokenize_text(self, text, errors, ignore_lines=()):
+        lines = text.split("\n")
+
+        # キャッシュに無い行を分割してからまとめて流す
+        line_results, line_tokens = {}, {}
+        pieces, piece_line_ids = [], []
+        for line_id, line in enumerate(lines):
+            if len(line.strip()) == 0 or line_id in ignore_lines:
+                continue
+            if self.line_cache is not None:
+                cached = self.line_cache.get(line)
+                if cached is not None:
+                    line_results[line_id] = cached
                     continue
+            line_tokens[line_id] = []
+            for piece in self.split_line(line):
+                pieces.append(piece)
+                piece_line_ids.append(line_id)
+
+        for line_id, piece_tokens in zip(piece_line_ids, self.analyze(pieces)):
+            tokens = line_tokens[line_id]
+            if piece_tokens is None or tokens is None:
+                line_tokens[line_id] = None
+                continue
+            tokens += piece_tokens
 
-            offsets = []
-            if line != "".join(tokens): # 復元された文章が異なる場合(=>オフセットがずれている場合)
-                branks = {}
-                for m in re.finditer(r"[\xa0]|\s", line): # 消えた空白を把握
-                    s, e = m.span(0)
-                    branks[s] = m.group(0)
-
-                # 消えた空白を補完しながらオフセットを計算
-                temp = ""
-                while len(temp) in branks: # 消えた空白の補完
-                    temp += branks[len(temp)]
-                for token in tokens:
-                    offsets.append((
-                        len(temp), len(temp)+len(token)
-                    ))  #トークンの開始位置を保存
-                    temp += token
-                    while len(temp) in branks: # 消えた空白の補完
-                        temp += branks[len(temp)]
-
-                if temp != line:
-                    errors["consistency"] += 1
-            else: #　特に問題なく復元できる場合(=>オフセットがずれていない場合)
-                #　オフセットを計算
-                temp = ""
-                for token in tokens:
-                    offsets.append((
-                        len(temp), len(temp)+len(token)
-                    ))  #トークンの開始位置を保存
-                    temp += token
-
-            starts, ends = zip(*offsets)
-            tokenized_sentences.append([*zip(tokens, starts, ends)])
-
-        if annotation is not None:
-            # アノテーションを各トークンにマップ
-            mapped_annotation[page_id], match_errors = annotation_mapper(
-                annotation,
-                tokenized_sentences
-            )
-            errors["total_annotation"] += len(annotation)
-            errors["match"] += match_errors
-
-        tokenized_documents.append({"page_id":page_id, "tokens":tokenized_sentences})
-
-    DataUtils.save_oneliner_json(temp_path, tokenized_documents, parallel=1)
-
-    return errors, mapped_annotation, temp_path
-
-def run_tokenize(args, shinra, command, num_jobs=100):
-    temp_dir = os.path.join(args.output_dir, command, "_temp_files")
-    os.makedirs(temp_dir, exist_ok=True)
-
-    total_errors = Counter()
-    t = tqdm.tqdm(total=len(shinra.categories)*num_jobs*3)
-    for category in shinra.categories:
-        # 書き出し先フォルダ
-        output_dir = os.path.join(
-            args.output_dir,
-            command,
-            shinra.to_c_cls(category),
-            category
-        )
-
-        if os.path.exists(os.path.join(output_dir, "vocab.txt")):
-            t.update(num_jobs*3)
-            continue
-
-        # 並列処理のためにジョブ分割
-        targets = []
-        for page_id, plain_path in shinra.plain_paths[category].items():
-            targets.append((
-                page_id,
-                plain_path,
-                shinra.annotations[category].get(page_id),
-            ))
-        jobs = DataTools.split_array(targets, num_jobs)
-        jobs = [(os.path.join(temp_dir, f"{job_id}.json"), command, job) for job_id, job in enumerate(jobs)]
-
-        # トークナイズ
-        total_mapped_annotation, temp_paths = {}, []
-        with Pool(args.parallel) as p:
-            for errors, mapped_annotation, temp_path in p.imap_unordered(tokenize, jobs):
-                total_errors += errors
-                total_mapped_annotation.update(mapped_annotation)
-                temp_paths.append(temp_path)
-                t.update()
-        assert len(total_mapped_annotation) == len(shinra.annotations[category]), \
-            f"アノテーション数エラー\ntokenizer:mecab\nmecab_dic:{mecab_dic}\ncategory:{category}"
-
-        #　語彙数カウント
-        vocab = count_vocab(temp_paths, p_bar=t, parallel=args.parallel)
-
-        # 書き出し先dir作成
-        os.makedirs(os.path.join(output_dir, "tokens"), exist_ok=True)
-
-        # 並列処理のためのジョブ作成
-        jobs = []
-        for temp_path in temp_paths:
-            jobs.append((
-                temp_path, vocab, output_dir
-            ))
-
-        # 書き出し
-        with Pool(args.parallel) as p:
-            for _ in p.imap_unordered(DataUtils.save_tokenized_file, jobs):
-                t.update()
-
-        DataUtils.save_oneliner_json(
-            os.path.join(output_dir, f"{category}_dist.json"),
-            DataTools.flatten(total_mapped_annotation.values()),
-            parallel=args.parallel
-        )
-        DataUtils.save_file(
-            os.path.join(output_dir, "vocab.txt"),
-            "\n".join(vocab)
-        )
-
-    t.close()
-
-    if total_errors["total_annotation"] != 0:
-        print(f"Juman自体のエラー:{total_errors['juman']} \n"+
-            f"トークンから復元された文章が異なる例:{total_errors['consistency']} \n"+
-            f"トークンへのマッピングにより左右のいずれかがずれたアノテーション:{total_errors['match']/total_errors['total_annotation']}")
+        for line_id, tokens in line_tokens.items():
+            if tokens is None:
+                continue
+            offsets, consistent = align_tokens(lines[line_id], tokens)
+            line_results[line_id] = (tokens, offsets, {} if consistent else {"consistency":1})
+            if self.line_cache is not None:
+                self.line_cache.put(lines[line_id], line_results[line_id])
 
-    return os.path.join(args.output_dir, command)
+        tokenized_sentences = []
+        for line_id, line in enumerate(lines):
+            if line_id in line_results:
+                tokens, offsets, line_errors = line_results[line_id]
+                errors.update(line_errors)
+                tokenized_sentences.append([(token, s, e) for token, (s, e) in zip(tokens, offsets)])
+            elif line_id in line_tokens: # 解析に失敗した行
+                tokenized_sentences.append([])
+                errors[self.error_key] += 1
+            elif line_id in ignore_lines and len(line.strip()) != 0: # <script>などの行
+                tokenized_sentences.append([])
+                errors["ignored_line"] += 1
+            else:
+                tokenized_sentences.append([])
+        return tokenized_sentences
+
+def get_tokenizer_spec(command, backend="pyknp"):
+    if backend == "process":
+        # 環境変数JUMANPP_COMMANDで実行するコマンドを差し替えられる(スタブなど)
+        process_command = os.environ.get("JUMANPP_COMMAND", command)
+        return (command, JumanppProcessTokenizer, {"command":process_command})
+    return (command, JumanTokenizer, {"command":command})
+
+def run_tokenize(args, shinra, command, backend="pyknp"):
+    output_dir, = tokenize_utils.run_tokenize(args, shinra, [get_tokenizer_spec(command, backend)])
+    return output_dir
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+jumanppの入出力形式だけを真似たスタブです。
+Juman++が無い環境でJumanppProcessのバッチ処理や入出力の区切りを試験・計測するために使います。
+文字種が変わる位置で区切った文字列を形態素として出力します。
+
+$ export JUMANPP_COMMAND="python3 code/tokenization/jumanpp_stub.py"
+"""
+import re
+import sys
+
+MORPHEME_PATTERN = re.compile(r"[ 　]|[ぁ-ゟ]+|[゠-ヿ]+|[一-鿿]+|[Ａ-Ｚａ-ｚ]+|[０-９]+|.")
+
+def main():
+    for line in sys.stdin.buffer:
+        line = line.decode("utf-8", "ignore").rstrip("\n")
+        outputs = []
+        for m in MORPHEME_PATTERN.finditer(line):
+            midasi = m.group(0)
+            if midasi == " ":
+                outputs.append("\\␣ \\␣ \\␣ 特殊 1 空白 6 * 0 * 0")
+                continue
+            outputs.append(f"{midasi} {midasi} {midasi} 未定義語 15 その他 1 * 0 * 0")
+        outputs.append("EOS")
+        sys.stdout.write("\n".join(outputs) + "\n")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
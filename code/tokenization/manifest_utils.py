@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+
+from data_utils import DataUtils, AnnotationIndex
+
+MANIFEST_FILE = "manifest.json"
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def hash_annotation(annotation_location):
+    if annotation_location is None:
+        return ""
+    return hash_bytes(b"\n".join(AnnotationIndex.load_lines(annotation_location)))
+
+def hash_pages(targets):
+    """
+    (ページid, プレーンテキストのパス, アノテーションの位置)のリストを受け取り、
+    各ページの[テキストのハッシュ, アノテーションのハッシュ]を返します。
+    """
+    hashes = {}
+    for page_id, file_path, annotation_location in targets:
+        with open(file_path, "rb") as f:
+            hashes[page_id] = [hash_bytes(f.read()), hash_annotation(annotation_location)]
+    return hashes
+
+def hash_config(*config):
+    return hash_bytes(repr(config).encode("utf-8"))
+
+def load_manifest(output_dir):
+    file_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(file_path):
+        return None
+    return json.loads(DataUtils.load_file(file_path))
+
+def save_manifest(output_dir, config, page_hashes, ignore_lines=None):
+    # ignore_linesは--ignore_scriptで検出した各ページの<script>の行
+    manifest = {"config":config, "pages":page_hashes}
+    if ignore_lines is not None:
+        manifest["ignore_lines"] = ignore_lines
+    DataUtils.save_file(os.path.join(output_dir, MANIFEST_FILE), json.dumps(manifest))
+
+def diff_manifest(manifest, page_hashes):
+    """
+    前回のマニフェストと現在の各ページのハッシュ([テキスト, アノテーション])を比較し、
+    (再トークナイズが必要なページ, アノテーションのみ変わったページ, 削除されたページ)を返します。
+    """
+    previous = manifest["pages"]
+    changed, annotation_changed = set(), set()
+    for page_id, (text_hash, annotation_hash) in page_hashes.items():
+        if page_id not in previous or previous[page_id][0] != text_hash:
+            changed.add(page_id)
+        elif previous[page_id][1] != annotation_hash:
+            annotation_changed.add(page_id)
+    removed = set(previous) - set(page_hashes)
+    return changed, annotation_changed, removed
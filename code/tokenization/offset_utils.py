@@ -0,0 +1,250 @@
+import re
+import html as html_lib
+import unicodedata
+
+from functools import lru_cache
+
+BLANK_PATTERN = re.compile(r"[\xa0]|\s")
+SPACE_PATTERN = re.compile(r"\s")
+# HTMLのタグと文字参照
+HTML_MARKUP_PATTERN = re.compile(r"<[^>]*>|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);")
+# プレーンテキストの1文字を、HTMLの表示される文字のこの文字数以内から探す
+# (HTMLに無い文字があっても、以降の文字が離れた同じ文字に対応付けられてずれ続けない様にする)
+HTML_ALIGN_WINDOW = 32
+
+def align_tokens(line, tokens):
+    """
+    トークンを元の行に対応付け、各トークンの(開始, 終了)オフセットを返します。
+    トークナイザーが落とした空白はカーソルを進めることで補完します。
+    2つ目の戻り値は、トークンと空白から元の行が復元できたかどうかです。
+    """
+    offsets = []
+    cursor = 0
+    if line == "".join(tokens): #　特に問題なく復元できる場合(=>オフセットがずれていない場合)
+        for token in tokens:
+            offsets.append((cursor, cursor + len(token)))
+            cursor += len(token)
+        return offsets, True
+
+    # 消えた空白を把握
+    blanks = bytearray(len(line) + 1)
+    for m in BLANK_PATTERN.finditer(line):
+        blanks[m.start()] = 1
+
+    # 消えた空白を補完しながらオフセットを計算
+    consistent = True
+    while blanks[cursor]:
+        cursor += 1
+    for token in tokens:
+        end = cursor + len(token)
+        offsets.append((cursor, end))
+        if consistent and not line.startswith(token, cursor):
+            consistent = False
+        cursor = end
+        while cursor < len(line) and blanks[cursor]:
+            cursor += 1
+
+    return offsets, consistent and cursor == len(line)
+
+@lru_cache(maxsize=1 << 16)
+def normalize_char(char):
+    """
+    1文字分のNFKCと、その空白を除いたものを返します。
+    3つ目の戻り値は、前後の文字と独立に正規化できる文字かどうかです。
+    """
+    normalized = unicodedata.normalize("NFKC", char)
+    stripped = SPACE_PATTERN.sub("", normalized)
+    is_local = (
+        len(normalized) > 0
+        and stripped in ("", normalized) # 空白と空白以外が混在しない
+        and not any(unicodedata.combining(c) for c in normalized) # 結合文字を含まない
+    )
+    return normalized, stripped, is_local
+
+def _align_nfkc_tokens_by_span(line, normalized_tokens, num_tokens):
+    # 範囲を伸ばすたびにNFKCをかけ直して対応付ける(文字単位で正規化できない行用)
+    offsets = []
+    token_offset = 0
+    text_offset = 0
+    intoken_offset = 0
+
+    token_len = 1
+    normalized_text = unicodedata.normalize("NFKC", line[text_offset])
+    while text_offset + token_len <= len(line) and token_offset < len(
+        normalized_tokens
+    ):
+        # 空白用。たまにNFKCで先頭に空白が入ったりする
+        # 先頭以外にも入ったりするのでreを使う
+        # normalized_text = re.sub(r'^\s', '', normalized_text)
+        normalized_text = re.sub("\s", "", normalized_text)
+        # 空白だけのとき用
+        if normalized_text == "":
+            token_len = 1
+            text_offset += 1
+            intoken_offset = 0
+            normalized_text = unicodedata.normalize(
+                "NFKC", line[text_offset + token_len - 1]
+            )
+            continue
+
+        # tokenの方が長い場合. i.e. 分解された合成文字の途中でtokenが途切れている場合
+        if (
+            normalized_text.startswith(normalized_tokens[token_offset])
+            and normalized_text != normalized_tokens[token_offset]
+        ):
+            offsets.append((text_offset, text_offset + token_len))
+            normalized_text = normalized_text[len(normalized_tokens[token_offset]) :]
+            token_offset += 1
+            text_offset += token_len - 1
+            token_len = 1
+            original_normalized_text = unicodedata.normalize(
+                "NFKC", line[text_offset : text_offset + token_len]
+            )
+            intoken_offset = len(original_normalized_text) - len(normalized_text)
+            continue
+
+        # マッチ
+        if normalized_text == normalized_tokens[token_offset]:
+            offsets.append((text_offset, text_offset + token_len))
+            text_offset += token_len
+            token_offset += 1
+            token_len = 1
+            intoken_offset = 0
+            # 最後の文字用
+            if text_offset + token_len - 1 < len(line):
+                normalized_text = unicodedata.normalize(
+                    "NFKC", line[text_offset + token_len - 1]
+                )
+                # normalized_text = re.sub(r'^\s', '', normalized_text)
+        else:
+            # tokenの方が長い場合
+            token_len += 1
+            # 非基幹文字のみの場合、文字順が変わる場合があるので、normalized_textを増やす場合ももう一度全てnormalizeする
+            normalized_text = unicodedata.normalize(
+                "NFKC", line[text_offset : text_offset + token_len]
+            )[intoken_offset:]
+
+    if text_offset < len(line):
+        assert (
+            unicodedata.normalize("NFKC", line[text_offset:]).strip() == ""
+        ), "空白文字以外の文字が残っています"
+        text_offset = len(line)
+
+    assert text_offset == len(line) and token_offset == num_tokens, "テキストかトークンが残っています"
+
+    return offsets
+
+def align_nfkc_tokens(line, normalized_tokens, num_tokens):
+    """
+    NFKCで正規化されたトークン(subword prefix無し)を元の行に対応付け、
+    各トークンの(開始, 終了)オフセットを返します。
+    行全体のNFKCが1文字ずつのNFKCの連結と一致する場合は、
+    各文字の正規化結果を一度だけ計算し、行の先頭から一度走査するだけで対応付けます。
+    そうでない場合(結合文字など)は範囲ごとに正規化し直す方法で対応付けます。
+    """
+    normalized_chars = [normalize_char(c) for c in line]
+    if not all(is_local for _, _, is_local in normalized_chars) \
+            or unicodedata.normalize("NFKC", line) != "".join(n for n, _, _ in normalized_chars):
+        return _align_nfkc_tokens_by_span(line, normalized_tokens, num_tokens)
+
+    # 以下は_align_nfkc_tokens_by_spanと同じ状態遷移を、
+    # 範囲のNFKCを文字ごとの正規化結果の連結で置き換えて行う
+    offsets = []
+    token_offset = 0
+    text_offset = 0
+
+    token_len = 1
+    normalized_text = normalized_chars[text_offset][1]
+    while text_offset + token_len <= len(line) and token_offset < len(normalized_tokens):
+        token = normalized_tokens[token_offset]
+
+        # 空白だけのとき用
+        if normalized_text == "":
+            text_offset += 1
+            normalized_text = normalized_chars[text_offset][1]
+            continue
+
+        # tokenの方が長い場合. i.e. 分解された合成文字の途中でtokenが途切れている場合
+        if normalized_text.startswith(token) and normalized_text != token:
+            offsets.append((text_offset, text_offset + token_len))
+            normalized_text = normalized_text[len(token):]
+            token_offset += 1
+            text_offset += token_len - 1
+            token_len = 1
+            continue
+
+        # マッチ
+        if normalized_text == token:
+            offsets.append((text_offset, text_offset + token_len))
+            text_offset += token_len
+            token_offset += 1
+            token_len = 1
+            if text_offset < len(line):
+                normalized_text = normalized_chars[text_offset][1]
+            continue
+
+        # 範囲を伸ばしても一致しないことが確定した場合
+        assert token.startswith(normalized_text), "テキストかトークンが残っています"
+
+        token_len += 1
+        if text_offset + token_len <= len(line):
+            normalized_text += normalized_chars[text_offset + token_len - 1][1]
+
+    if text_offset < len(line):
+        assert (
+            unicodedata.normalize("NFKC", line[text_offset:]).strip() == ""
+        ), "空白文字以外の文字が残っています"
+        text_offset = len(line)
+
+    assert text_offset == len(line) and token_offset == num_tokens, "テキストかトークンが残っています"
+
+    return offsets
+
+def align_html(html, plain):
+    """
+    プレーンテキストの各文字を、HTMLの同じ行でのオフセットに対応付けます。
+    行ごとに(各文字のHTML上の開始オフセットの配列, 終了オフセットの配列)を返します。
+    文字参照は参照全体に対応付け、対応する文字が見つからない場合は-1とします。
+    各文字は直前に対応付けた位置からHTML_ALIGN_WINDOW文字以内でのみ探し、
+    見つからない文字は位置を進めずに次の文字を同じ位置から探します。
+    """
+    line_starts = [0] + [m.end() for m in re.finditer("\n", html)]
+
+    # HTMLの行ごとの表示される文字と、その行での(開始, 終了)オフセット
+    # (タグは複数行にまたがることがあるため、ドキュメント全体で走査する)
+    chars = [[] for _ in line_starts]
+    spans = [[] for _ in line_starts]
+
+    line_id = 0
+    def add_char(char, s, e):
+        nonlocal line_id
+        while line_id + 1 < len(line_starts) and line_starts[line_id + 1] <= s:
+            line_id += 1
+        chars[line_id].append(char)
+        spans[line_id].append((s - line_starts[line_id], e - line_starts[line_id]))
+
+    cursor = 0
+    for m in HTML_MARKUP_PATTERN.finditer(html + "<>"): # 末尾のテキストも処理するための番兵
+        for i in range(cursor, min(m.start(), len(html))):
+            if html[i] != "\n":
+                add_char(html[i], i, i + 1)
+        if m.group(0).startswith("&"):
+            for char in html_lib.unescape(m.group(0)):
+                add_char(char, m.start(), m.end())
+        cursor = m.end()
+
+    # プレーンテキストの各行の文字を、HTMLの同じ行の表示される文字に前から順に対応付ける
+    alignment = []
+    for line_id, line in enumerate(plain.split("\n")):
+        char_starts, char_ends = [-1] * len(line), [-1] * len(line)
+        if line_id < len(chars):
+            visible = "".join(chars[line_id])
+            cursor = 0
+            for i, char in enumerate(line):
+                idx = visible.find(char, cursor, cursor + HTML_ALIGN_WINDOW)
+                if idx < 0: # 対応する文字が無い
+                    continue
+                char_starts[i], char_ends[i] = spans[line_id][idx]
+                cursor = idx + 1
+        alignment.append((char_starts, char_ends))
+    return alignment
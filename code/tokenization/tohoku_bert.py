@@ -1,23 +1,96 @@
 import os
 import re
+import copy
+import logging
 import unicodedata
-from collections import Counter
-from multiprocessing import Pool
 
 import MeCab
-import tqdm
 
 try:
     from transformers import BertJapaneseTokenizer
 except ModuleNotFoundError:
-    raise ModuleNotFoundError("指定したトーカナイザーにはtorchが必要です.")
+    BertJapaneseTokenizer = None # --tohoku_bert_backend tokenizersの場合は不要
 
-from data_utils import DataTools, DataUtils
-from tokenization.annotation_utils import annotation_mapper
-from tokenization.vocab_utils import count_vocab
+try:
+    from tokenizers import Tokenizer as FastTokenizer
+    from tokenizers.models import WordPiece
+except ModuleNotFoundError:
+    FastTokenizer = None # --tohoku_bert_backend transformersの場合は不要
+
+from tokenization import tokenize_utils
+from tokenization.tokenize_utils import Tokenizer
+from tokenization.offset_utils import align_nfkc_tokens
 
 JUMANDIC_PATCH = {(871146, "メンバー", 84, 17): 8}
 
+# 環境変数MECAB_IPADIC_DIRが無い場合の辞書のパス
+DEFAULT_MECAB_IPADIC_DIR = "/opt/mecab/lib/mecab/dic/ipadic"
+# 語彙のフォルダが無い場合にtransformersで読み込むモデル(HuggingFace Hubかキャッシュが必要)
+PRETRAINED_MODEL = "cl-tohoku/bert-base-japanese"
+
+# BertJapaneseTokenizerが単語分割の前に切り出す特殊トークン
+SPECIAL_TOKENS = ["[UNK]", "[SEP]", "[PAD]", "[CLS]", "[MASK]"]
+SPECIAL_TOKEN_PATTERN = re.compile(
+    "(" + "|".join(map(re.escape, sorted(SPECIAL_TOKENS, key=len, reverse=True))) + ")"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_mecab_dic_dir():
+    mecab_dic_dir = os.environ.get("MECAB_IPADIC_DIR", DEFAULT_MECAB_IPADIC_DIR)
+    assert os.path.isdir(mecab_dic_dir), "環境変数MECAB_IPADIC_DIRにMeCab用ipadic辞書のパスを格納する必要があります。"
+    return mecab_dic_dir
+
+
+def get_vocab_dir(vocab_dir=None):
+    if vocab_dir is None:
+        vocab_dir = os.environ.get("TOHOKU_BERT_VOCAB_DIR")
+    if vocab_dir is not None:
+        assert os.path.isfile(os.path.join(vocab_dir, "vocab.txt")), f"{vocab_dir}にvocab.txtがありません。"
+    return vocab_dir
+
+
+# 読み込み済みの語彙など(親プロセスで読み込めばforkしたワーカーに引き継がれる)
+_assets = {}
+
+
+def load_assets(backend, vocab_dir, mecab_dic_dir):
+    """
+    トークナイザーの語彙などを読み込みます。同じ引数では一度だけ読み込みます。
+    """
+    key = (backend, vocab_dir, mecab_dic_dir)
+    if key in _assets:
+        return _assets[key]
+
+    if backend == "tokenizers":
+        if FastTokenizer is None:
+            raise ModuleNotFoundError("指定したトーカナイザーにはtokenizersが必要です。\n$ pip install tokenizers")
+        _assets[key] = FastTokenizer(WordPiece.from_file(
+            os.path.join(vocab_dir, "vocab.txt"),
+            unk_token="[UNK]",
+            max_input_chars_per_word=100,
+        ))
+        return _assets[key]
+
+    if BertJapaneseTokenizer is None:
+        raise ModuleNotFoundError("指定したトーカナイザーにはtransformersが必要です。\n$ pip install transformers fugashi")
+
+    word_kwargs = {
+        "do_subword_tokenize": False,
+        "word_tokenizer_type": "mecab",
+        "mecab_kwargs": {"mecab_dic": None, "mecab_option": f"-d {mecab_dic_dir}"},
+    }
+    if vocab_dir is None:
+        basic_tokenizer = BertJapaneseTokenizer.from_pretrained(PRETRAINED_MODEL, **word_kwargs)
+        wordpiece_tokenizer = BertJapaneseTokenizer.from_pretrained(PRETRAINED_MODEL, do_word_tokenize=False)
+    else: # HuggingFace Hubを参照せずに直接読み込む
+        vocab_file = os.path.join(vocab_dir, "vocab.txt")
+        basic_tokenizer = BertJapaneseTokenizer(vocab_file, **word_kwargs)
+        wordpiece_tokenizer = BertJapaneseTokenizer(vocab_file, do_word_tokenize=False)
+    _assets[key] = (basic_tokenizer, wordpiece_tokenizer)
+    return _assets[key]
+
 
 class MyMeCab(object):
     def __init__(self, mecab, text=""):
@@ -46,6 +119,51 @@ def replace_unk(tokens, subwords):
     return unk_subwords
 
 
+# 組み合わせの探索で状態数がこれを超えた行はログに残す
+PATHOLOGICAL_STATES = 100000
+
+
+def select_subwords(candidates, original_sent):
+    """
+    各位置の候補から、連結するとoriginal_sentに一致する組み合わせを選びます。
+    候補が複数の位置では、後ろの位置ほど優先順位の高い候補を優先します。
+    (各位置の候補をビットとみなして全探索した際に最初に見つかる組み合わせと同じです。)
+    前から一致し得る位置の集合を計算し、後ろから選ぶため、ほぼ線形時間で動作します。
+    """
+    # reachable[i]: 先頭i個の連結が一致し得るoriginal_sent上の位置
+    reachable = [{0}]
+    num_states = 1
+    for options in candidates:
+        positions = set()
+        for position in reachable[-1]:
+            for option in options:
+                if original_sent.startswith(option, position):
+                    positions.add(position + len(option))
+        if len(positions) == 0:
+            return None
+        reachable.append(positions)
+        num_states += len(positions)
+
+    if num_states > PATHOLOGICAL_STATES:
+        logger.warning(
+            f"subword prefixの探索に時間がかかりました(状態数:{num_states}):{original_sent[:100]}"
+        )
+
+    if len(original_sent) not in reachable[-1]:
+        return None
+
+    selected = []
+    position = len(original_sent)
+    for i in range(len(candidates) - 1, -1, -1):
+        for option in candidates[i]:
+            start = position - len(option)
+            if start in reachable[i] and original_sent.startswith(option, start):
+                selected.append(option)
+                position = start
+                break
+    return selected[::-1]
+
+
 # "##:"など、"##"がsubwordのprefixじゃないとき用
 def replace_subword_prefix_for_ambiguous(token_list, word_tokens):
     original_sent = "".join(word_tokens)
@@ -60,30 +178,47 @@ def replace_subword_prefix_for_ambiguous(token_list, word_tokens):
     assert len(amb_indexes) > 0
 
     # たいていambiguousな「##」は一つなので、まず一個ずつ確認
-    for idx in amb_indexes:
-        tmp = results[:idx] + ["##" + results[idx]] + results[idx + 1 :]
-        if "".join(tmp) == original_sent:
-            return tmp
-
-    # それでも無理なら全探索
-    # 再帰だと「##」が多すぎると深くなりすぎてエラー吐く
-    # のでforで実装
-    for j in range(1 << len(amb_indexes)):
-        tmp = []
+    # 一個だけ「##」を戻した場合は長さが2増えるので、前後が一致するかで判定できる
+    if sum(map(len, results)) + 2 == len(original_sent):
+        # prefix_match[i]: results[:i]の連結がoriginal_sentの先頭と一致するか
+        prefix_match = [True]
+        position = 0
+        for result in results:
+            prefix_match.append(
+                prefix_match[-1] and original_sent.startswith(result, position)
+            )
+            position += len(result)
+        # suffix_match[i]: results[i:]の連結がoriginal_sentの末尾と一致するか
+        suffix_match = [True]
+        position = len(original_sent)
+        for result in reversed(results):
+            position -= len(result)
+            suffix_match.append(
+                suffix_match[-1] and original_sent.startswith(result, position)
+            )
+        suffix_match = suffix_match[::-1]
+
+        position = 0
         prev_index = 0
-        for idx in range(len(amb_indexes)):
-            amb_index = amb_indexes[idx]
-            tmp.extend(results[prev_index:amb_index])
-            mask = 1 << idx
-            if j & mask:
-                tmp.append("##" + results[amb_index])
-            else:
-                tmp.append(results[amb_index])
-            prev_index = amb_index + 1
-        tmp.extend(results[amb_index + 1 :])
-
-        if "".join(tmp) == original_sent:
-            return tmp
+        for idx in amb_indexes:
+            position += sum(map(len, results[prev_index:idx]))
+            prev_index = idx
+            if (
+                prefix_match[idx]
+                and suffix_match[idx + 1]
+                and original_sent.startswith("##" + results[idx], position)
+            ):
+                return results[:idx] + ["##" + results[idx]] + results[idx + 1 :]
+
+    # それでも無理なら全パターンから探索
+    amb_indexes = set(amb_indexes)
+    candidates = [
+        (result, "##" + result) if i in amb_indexes else (result,)
+        for i, result in enumerate(results)
+    ]
+    selected = select_subwords(candidates, original_sent)
+    if selected is not None:
+        return selected
 
     assert False, "ambiguous ### token"
 
@@ -119,246 +254,213 @@ def replace_subword_prefix(token_list, word_tokens):
 
     original_sent = "".join(word_tokens)
     if is_ambiguous:
-        # 曖昧な"###"を、全パターン試す
-        for j in range(1 << len(amb_indexes)):
-            tmp = []
-            prev_index = 0
-            for idx in range(len(amb_indexes)):
-                amb_index = amb_indexes[idx]
-                tmp.extend(results[prev_index:amb_index])
-                mask = 1 << idx
-                if j & mask:
-                    tmp.append("##" + results[amb_index])
-                else:
-                    tmp.append(results[amb_index])
-                prev_index = amb_index + 1
-            tmp.extend(results[amb_index + 1 :])
-
-            if "".join(tmp) == original_sent:
-                # 元の文と一致したら終了
-                return tmp
+        # 曖昧な"###"を、全パターンから探索
+        amb_indexes = set(amb_indexes)
+        candidates = [
+            (result, "##" + result) if i in amb_indexes else (result,)
+            for i, result in enumerate(results)
+        ]
+        selected = select_subwords(candidates, original_sent)
+        if selected is not None:
+            # 元の文と一致したら終了
+            return selected
     else:
         if "".join(results) == original_sent:
             return results
 
     # "##:"など、"##""から始まってもsubwordじゃ無い場合があるので、
-    # そういう場合は"##"をつけるパターンとつけないパターンを全探索する
+    # そういう場合は"##"をつけるパターンとつけないパターンを探索する
     return replace_subword_prefix_for_ambiguous(token_list, word_tokens)
 
 
-def tokenize_sent(line, basic_tokenizer, wordpiece_tokenizer):
-    tokens = basic_tokenizer.tokenize(line)
-    assert len(tokens) > 0
-
-    tokens = [re.sub("\s", "", t) for t in tokens]
-    subwords = [wordpiece_tokenizer.tokenize(t) for t in tokens]
+def align_subwords(line, tokens, subwords):
+    """
+    単語ごとのsubwordから"[UNK]"とsubword prefixを元に戻し、各subwordのオフセットを求めます。
+    """
     flatten_subwords = [s for sub in subwords for s in sub]
     unk_subwords = replace_unk(tokens, subwords)
 
     normalized_tokens = replace_subword_prefix(unk_subwords, tokens)
-    offsets = []
-    token_offset = 0
-    text_offset = 0
-    intoken_offset = 0
-
-    token_len = 1
-    normalized_text = unicodedata.normalize("NFKC", line[text_offset])
-    while text_offset + token_len <= len(line) and token_offset < len(
-        normalized_tokens
-    ):
-        # 空白用。たまにNFKCで先頭に空白が入ったりする
-        # 先頭以外にも入ったりするのでreを使う
-        # normalized_text = re.sub(r'^\s', '', normalized_text)
-        normalized_text = re.sub("\s", "", normalized_text)
-        # 空白だけのとき用
-        if normalized_text == "":
-            token_len = 1
-            text_offset += 1
-            intoken_offset = 0
-            normalized_text = unicodedata.normalize(
-                "NFKC", line[text_offset + token_len - 1]
-            )
-            continue
-
-        # tokenの方が長い場合. i.e. 分解された合成文字の途中でtokenが途切れている場合
-        if (
-            normalized_text.startswith(normalized_tokens[token_offset])
-            and normalized_text != normalized_tokens[token_offset]
-        ):
-            offsets.append((text_offset, text_offset + token_len))
-            normalized_text = normalized_text[len(normalized_tokens[token_offset]) :]
-            token_offset += 1
-            text_offset += token_len - 1
-            token_len = 1
-            original_normalized_text = unicodedata.normalize(
-                "NFKC", line[text_offset : text_offset + token_len]
-            )
-            intoken_offset = len(original_normalized_text) - len(normalized_text)
-            continue
-
-        # マッチ
-        if normalized_text == normalized_tokens[token_offset]:
-            offsets.append((text_offset, text_offset + token_len))
-            text_offset += token_len
-            token_offset += 1
-            token_len = 1
-            intoken_offset = 0
-            # 最後の文字用
-            if text_offset + token_len - 1 < len(line):
-                normalized_text = unicodedata.normalize(
-                    "NFKC", line[text_offset + token_len - 1]
-                )
-                # normalized_text = re.sub(r'^\s', '', normalized_text)
-        else:
-            # tokenの方が長い場合
-            token_len += 1
-            # 非基幹文字のみの場合、文字順が変わる場合があるので、normalized_textを増やす場合ももう一度全てnormalizeする
-            normalized_text = unicodedata.normalize(
-                "NFKC", line[text_offset : text_offset + token_len]
-            )[intoken_offset:]
-
-    if text_offset < len(line):
-        assert (
-            unicodedata.normalize("NFKC", line[text_offset:]).strip() == ""
-        ), "空白文字以外の文字が残っています"
-        text_offset = len(line)
-
-    assert text_offset == len(line) and token_offset == len(
-        flatten_subwords
-    ), "テキストかトークンが残っています"
+    offsets = align_nfkc_tokens(line, normalized_tokens, len(flatten_subwords))
 
     return flatten_subwords, offsets
 
 
-def tokenize(inputs):
-    temp_path, chunks, patch = inputs
-    mecab = MeCab.Tagger("-d /opt/mecab/lib/mecab/dic/ipadic")
+def tokenize_sent(line, basic_tokenizer, wordpiece_tokenizer):
+    tokens = basic_tokenizer.tokenize(line)
+    assert len(tokens) > 0
 
-    basic_tokenizer = BertJapaneseTokenizer.from_pretrained(
-        "cl-tohoku/bert-base-japanese", do_subword_tokenize=False
-    )
-    basic_tokenizer.word_tokenizer.mecab = MyMeCab(mecab)
-    wordpiece_tokenizer = BertJapaneseTokenizer.from_pretrained(
-        "cl-tohoku/bert-base-japanese", do_word_tokenize=False
-    )
+    tokens = [re.sub("\s", "", t) for t in tokens]
+    subwords = [wordpiece_tokenizer.tokenize(t) for t in tokens]
+    return align_subwords(line, tokens, subwords)
+
+
+def split_words(mecab, line):
+    """
+    BertJapaneseTokenizer(MeCab)と同じ単語列を空白を除いて返します。
+    特殊トークンで区切った部分ごとにNFKCで正規化し、MeCabで分割します。
+    """
+    words = []
+    for segment in SPECIAL_TOKEN_PATTERN.split(line):
+        if segment in SPECIAL_TOKENS:
+            words.append(segment)
+            continue
+        if len(segment) == 0:
+            continue
+        node = mecab.parseToNode(unicodedata.normalize("NFKC", segment))
+        while node:
+            word = re.sub("\s", "", node.surface)
+            if len(word) != 0:
+                words.append(word)
+            node = node.next
+    return words
 
-    errors = Counter()
-    mapped_annotation = {}
-    tokenized_documents = []
-    for page_id, file_path, annotation in chunks:
-        text = DataUtils.load_file(file_path)
 
-        tokenized_sentences = []
-        for line in text.split("\n"):
-            if len(line.strip()) == 0:
-                tokenized_sentences.append([])
-                continue
+class TohokuBertTokenizer(Tokenizer):
+    name = "MeCab"
+    error_key = "mecab"
+
+    def __init__(self, mecab_dic_dir, vocab_dir=None, patch={}):
+        mecab = MeCab.Tagger(f"-d {mecab_dic_dir}")
 
+        basic_tokenizer, self.wordpiece_tokenizer = load_assets(
+            "transformers", vocab_dir, mecab_dic_dir
+        )
+        # 読み込み済みのbasic_tokenizerは他のインスタンスと共有するため、
+        # 浅いコピーの単語分割器にだけMeCabを設定する(語彙などはコピーしない)
+        self.basic_tokenizer = copy.copy(basic_tokenizer)
+        self.basic_tokenizer.word_tokenizer = copy.copy(basic_tokenizer.word_tokenizer)
+        self.basic_tokenizer.word_tokenizer.mecab = MyMeCab(mecab)
+        self.patch = patch
+
+    @classmethod
+    def preload(cls, mecab_dic_dir, vocab_dir=None, patch={}):
+        load_assets("transformers", vocab_dir, mecab_dic_dir)
+
+    def tokenize_line(self, line, errors):
+        return tokenize_sent(line, self.basic_tokenizer, self.wordpiece_tokenizer)
+
+
+class TohokuBertFastTokenizer(Tokenizer):
+    """
+    TohokuBertTokenizerのWordPieceをtokenizers(Rust実装)で行う版です。
+    MeCabの単語列を分割済みの入力として、ドキュメントの行をまとめてエンコードします。
+    subwordの元の文字列はtokenizersが返す単語内のオフセットから求めるため、
+    "[UNK]"やsubword prefixを探索で元に戻す必要がありません。
+    ("#"や特殊トークンを含む行は、TohokuBertTokenizerと同じ結果になる様に従来の方法で戻します)
+    """
+    name = "MeCab"
+    error_key = "mecab"
+
+    def __init__(self, mecab_dic_dir, vocab_dir, patch={}):
+        self.mecab = MeCab.Tagger(f"-d {mecab_dic_dir}")
+        self.wordpiece = load_assets("tokenizers", vocab_dir, mecab_dic_dir)
+        self.patch = patch
+
+    @classmethod
+    def preload(cls, mecab_dic_dir, vocab_dir, patch={}):
+        load_assets("tokenizers", vocab_dir, mecab_dic_dir)
+
+    def encode(self, lines):
+        """
+        各行の(subword, オフセット)を返します。失敗した行はNoneになります。
+        """
+        words, pieces, piece_word_ids = [], [], []
+        for line in lines:
             try:
-                tokens, offsets = tokenize_sent(
-                    line, basic_tokenizer, wordpiece_tokenizer
-                )
+                line_words = split_words(self.mecab, line)
             except:
-                tokenized_sentences.append([])
-                errors["mecab"] += 1
+                line_words = None
+            line_pieces, line_piece_word_ids = [], []
+            for word_id, word in enumerate(line_words or []):
+                # BertJapaneseTokenizerのWordPieceは単語中の特殊トークンも切り出す
+                for piece in SPECIAL_TOKEN_PATTERN.split(word):
+                    if len(piece) != 0:
+                        line_pieces.append(piece)
+                        line_piece_word_ids.append(word_id)
+            words.append(line_words)
+            pieces.append(line_pieces)
+            piece_word_ids.append(line_piece_word_ids)
+
+        encodings = self.wordpiece.encode_batch(pieces, is_pretokenized=True, add_special_tokens=False)
+
+        results = []
+        for line, line_words, line_pieces, line_piece_word_ids, encoding in zip(
+            lines, words, pieces, piece_word_ids, encodings
+        ):
+            if line_words is None:
+                results.append(None)
                 continue
 
-            starts, ends = zip(*offsets)
-            tokenized_sentences.append([*zip(tokens, starts, ends)])
-
-        if annotation is not None:
-            # アノテーションを各トークンにマップ
-            mapped_annotation[page_id], match_errors = annotation_mapper(
-                annotation, tokenized_sentences, patch=patch
-            )
-            errors["total_annotation"] += len(annotation)
-            errors["match"] += match_errors
-
-        tokenized_documents.append({"page_id": page_id, "tokens": tokenized_sentences})
-
-    DataUtils.save_oneliner_json(temp_path, tokenized_documents, parallel=1)
-
-    return errors, mapped_annotation, temp_path
-
-
-def run_tokenize(args, shinra, num_jobs=100):
-    temp_dir = os.path.join(args.output_dir, f"tohoku_bert", "_temp_files")
-    os.makedirs(temp_dir, exist_ok=True)
+            subwords = [[] for _ in line_words]
+            normalized_tokens = []
+            for subword, piece_id, (s, e) in zip(encoding.tokens, encoding.word_ids, encoding.offsets):
+                subwords[line_piece_word_ids[piece_id]].append(subword)
+                normalized_tokens.append(line_pieces[piece_id][s:e])
 
-    total_errors = Counter()
-    t = tqdm.tqdm(total=len(shinra.categories) * num_jobs * 3)
-    for category in shinra.categories:
-        # 書き出し先フォルダ
-        output_dir = os.path.join(
-            args.output_dir, f"tohoku_bert", shinra.to_c_cls(category), category
-        )
-
-        if os.path.exists(os.path.join(output_dir, "vocab.txt")):
-            t.update(num_jobs * 3)
-            continue
+            try:
+                if len(line_pieces) == len(line_words) and all("#" not in word for word in line_words):
+                    results.append((encoding.tokens, align_nfkc_tokens(line, normalized_tokens, len(normalized_tokens))))
+                else:
+                    results.append(align_subwords(line, line_words, subwords))
+            except:
+                results.append(None)
+        return results
+
+    def tokenize_line(self, line, errors):
+        result, = self.encode([line])
+        if result is None:
+            raise RuntimeError("subwordのオフセットの計算に失敗しました。")
+        return result
+
+    def tokenize_text(self, text, errors, ignore_lines=()):
+        lines = text.split("\n")
+
+        # キャッシュに無い行をまとめてエンコードする
+        line_results, target_ids = {}, []
+        for line_id, line in enumerate(lines):
+            if len(line.strip()) == 0 or line_id in ignore_lines:
+                continue
+            if self.line_cache is not None:
+                cached = self.line_cache.get(line)
+                if cached is not None:
+                    line_results[line_id] = cached
+                    continue
+            target_ids.append(line_id)
+
+        for line_id, result in zip(target_ids, self.encode([lines[line_id] for line_id in target_ids])):
+            if result is None:
+                continue
+            line_results[line_id] = (*result, {})
+            if self.line_cache is not None:
+                self.line_cache.put(lines[line_id], line_results[line_id])
 
-        t.set_description(category)
-
-        # 並列処理のためにジョブ分割
-        targets = []
-        for page_id, plain_path in shinra.plain_paths[category].items():
-            targets.append(
-                (
-                    page_id,
-                    plain_path,
-                    shinra.annotations[category].get(page_id),
-                )
-            )
-        jobs = DataTools.split_array(targets, num_jobs)
-        jobs = [
-            (os.path.join(temp_dir, f"{job_id}.json"), job, {})
-            for job_id, job in enumerate(jobs)
-        ]
+        tokenized_sentences = []
+        for line_id, line in enumerate(lines):
+            if line_id in line_results:
+                tokens, offsets, line_errors = line_results[line_id]
+                errors.update(line_errors)
+                tokenized_sentences.append([(token, s, e) for token, (s, e) in zip(tokens, offsets)])
+            elif len(line.strip()) == 0:
+                tokenized_sentences.append([])
+            elif line_id in ignore_lines: # <script>などの行
+                tokenized_sentences.append([])
+                errors["ignored_line"] += 1
+            else: # 失敗した行
+                tokenized_sentences.append([])
+                errors[self.error_key] += 1
+        return tokenized_sentences
 
-        # トークナイズ
-        total_mapped_annotation, temp_paths = {}, []
-        with Pool(args.parallel) as p:
-            for errors, mapped_annotation, temp_path in p.imap_unordered(
-                tokenize, jobs
-            ):
-                total_errors += errors
-                total_mapped_annotation.update(mapped_annotation)
-                temp_paths.append(temp_path)
-                t.update()
-        assert len(total_mapped_annotation) == len(
-            shinra.annotations[category]
-        ), f"アノテーション数エラー\ntokenizer:mecab\nmecab_dic:{mecab_dic}\ncategory:{category}"
-
-        # 　語彙数カウント
-        vocab = count_vocab(temp_paths, p_bar=t, parallel=args.parallel)
-
-        # 書き出し先dir作成
-        os.makedirs(os.path.join(output_dir, "tokens"), exist_ok=True)
-
-        # 並列処理のためのジョブ作成
-        jobs = []
-        for temp_path in temp_paths:
-            jobs.append((temp_path, vocab, output_dir))
-
-        # 書き出し
-        with Pool(args.parallel) as p:
-            for _ in p.imap_unordered(DataUtils.save_tokenized_file, jobs):
-                t.update()
-
-        DataUtils.save_oneliner_json(
-            os.path.join(output_dir, f"{category}_dist.json"),
-            DataTools.flatten(total_mapped_annotation.values()),
-            parallel=args.parallel,
-        )
-        DataUtils.save_file(os.path.join(output_dir, "vocab.txt"), "\n".join(vocab))
 
-    t.close()
+def get_tokenizer_spec(backend="transformers", vocab_dir=None):
+    kwargs = {"mecab_dic_dir": get_mecab_dic_dir(), "vocab_dir": get_vocab_dir(vocab_dir), "patch": {}}
+    if backend == "tokenizers":
+        assert kwargs["vocab_dir"] is not None, \
+            "--tohoku_bert_backend tokenizersの場合は--tohoku_bert_vocab_dirか環境変数TOHOKU_BERT_VOCAB_DIRにvocab.txtのフォルダを指定する必要があります。"
+        return ("tohoku_bert", TohokuBertFastTokenizer, kwargs)
+    return ("tohoku_bert", TohokuBertTokenizer, kwargs)
 
-    if total_errors["total_annotation"] != 0:
-        print(
-            f"MeCab自体のエラー:{total_errors['mecab']} \n\
-            トークンから復元された文章が異なる例:{total_errors['consistency']} \n\
-            トークンへのマッピングにより左右のいずれかがずれたアノテーション:{total_errors['match']/total_errors['total_annotation']}"
-        )
 
-    return os.path.join(args.output_dir, f"tohoku_bert")
+def run_tokenize(args, shinra, backend="transformers", vocab_dir=None):
+    (output_dir,) = tokenize_utils.run_tokenize(args, shinra, [get_tokenizer_spec(backend, vocab_dir)])
+    return output_dir
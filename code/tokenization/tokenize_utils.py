@@ -0,0 +1,757 @@
+import os
+import copy
+import glob
+import json
+import pickle
+import shutil
+import time
+import tqdm
+
+from multiprocessing import Pool
+
+from collections import Counter, defaultdict
+
+from data_utils import DataUtils, DataTools, TokenizedDocuments, Vocab, ShardedPage, AnnotationIndex, SHARD_ARRAYS
+from tokenization.vocab_utils import count_vocab
+from tokenization.manifest_utils import (
+    hash_pages, hash_config, load_manifest, save_manifest, diff_manifest
+)
+from tokenization.cache_utils import LineCache
+from tokenization.annotation_utils import annotation_mapper
+from tokenization.offset_utils import align_html
+
+class Tokenizer(object):
+    """
+    各トークナイザーの基底クラスです。
+    サブクラスは`tokenize_line`で1行分のトークンとオフセットを返します。
+    一度初期化すれば`tokenize_document`で単一のドキュメントを、
+    `tokenize_documents`で複数のドキュメントをまとめてトークナイズできます。
+    """
+    name = "Tokenizer" # エラー表示用の名前
+    error_key = "tokenizer" # errorsに記録する際のキー
+    normalization = None # 同じ値のトークナイザー間では正規化済みのテキストを使い回す
+    patch = {}
+    line_cache = None # LineCacheを設定すると、同じ内容の行のトークナイズ結果を使い回す
+
+    @classmethod
+    def preload(cls, **kwargs):
+        """
+        プールを作成する前に親プロセスで一度だけ呼ばれます。
+        ここで読み込んだ語彙などはforkしたワーカーに引き継がれ、ワーカーごとに読み込み直す必要がありません。
+        """
+        pass
+
+    def normalize(self, text):
+        return text
+
+    def tokenize_line(self, line, errors):
+        raise NotImplementedError()
+
+    def cached_tokenize_line(self, line, errors):
+        """
+        line_cacheがあれば、`tokenize_line`の結果(行ごとのエラー数を含む)をキャッシュから返します。
+        """
+        if self.line_cache is None:
+            return self.tokenize_line(line, errors)
+
+        cached = self.line_cache.get(line)
+        if cached is None:
+            line_errors = Counter()
+            tokens, offsets = self.tokenize_line(line, line_errors)
+            cached = (tokens, offsets, dict(line_errors))
+            self.line_cache.put(line, cached)
+
+        tokens, offsets, line_errors = cached
+        errors.update(line_errors)
+        return tokens, offsets
+
+    def tokenize_text(self, text, errors, ignore_lines=()):
+        tokenized_sentences = []
+        for line_id, line in enumerate(text.split("\n")):
+            if len(line.strip()) == 0:
+                tokenized_sentences.append([])
+                continue
+
+            if line_id in ignore_lines: # <script>などの行
+                tokenized_sentences.append([])
+                errors["ignored_line"] += 1
+                continue
+
+            try:
+                tokens, offsets = self.cached_tokenize_line(line, errors)
+            except:
+                tokenized_sentences.append([])
+                errors[self.error_key] += 1
+                continue
+
+            tokenized_sentences.append([(token, s, e) for token, (s, e) in zip(tokens, offsets)])
+        return tokenized_sentences
+
+    def tokenize_document(self, text, errors=None):
+        """
+        1ドキュメントを正規化してトークナイズし、行ごとのトークンのリストと(開始, 終了)オフセットのリストを返します。
+        オフセットは`run_tokenize`の出力と同じく、正規化したテキストの各行での文字オフセットです。
+        """
+        (tokens, offsets), = self.tokenize_documents([text], errors)
+        return tokens, offsets
+
+    def tokenize_documents(self, texts, errors=None):
+        """
+        複数のドキュメントを1つのテキストとしてまとめてトークナイズし、ドキュメントごとに分けて返します。
+        (jumanppのプロセスの様に、まとめて処理できるトークナイザーではドキュメントをまたいで処理します)
+        """
+        if errors is None:
+            errors = Counter()
+
+        normalized_texts = [self.normalize(text) for text in texts]
+        tokenized_sentences = self.tokenize_text("\n".join(normalized_texts), errors)
+
+        results, line_id = [], 0
+        for text in normalized_texts:
+            num_lines = text.count("\n") + 1
+            sentences = tokenized_sentences[line_id:line_id + num_lines]
+            results.append((
+                [[token for token, _, _ in tokens] for tokens in sentences],
+                [[(s, e) for _, s, e in tokens] for tokens in sentences]
+            ))
+            line_id += num_lines
+        return results
+
+# ジョブあたりの最大・最小のテキストサイズ(byte)
+MAX_JOB_SIZE = 1 << 24
+MIN_JOB_SIZE = 1 << 20
+# 動的な割り当てのためにワーカーあたりに用意するジョブ数
+JOBS_PER_WORKER = 4
+
+def get_num_jobs(total_size, parallel):
+    """
+    カテゴリーの合計テキストサイズと並列数からジョブ数を決定します。
+    ジョブが大きすぎない範囲で、各ワーカーに複数のジョブが行き渡る様にします。
+    """
+    num_jobs = min(parallel * JOBS_PER_WORKER, -(-total_size // MIN_JOB_SIZE))
+    return max(1, num_jobs, -(-total_size // MAX_JOB_SIZE))
+
+# 各ワーカープロセスで一度だけ初期化されるトークナイザー
+_tokenizers = {}
+_init_time = 0.0
+
+def get_cache_namespace(output_name, tokenizer_cls, tokenizer_kwargs):
+    # トークナイザーと辞書などの初期化引数が同じ場合のみキャッシュを共有する
+    return f"{output_name}:{tokenizer_cls.__module__}.{tokenizer_cls.__qualname__}:{sorted(tokenizer_kwargs.items())!r}"
+
+def init_worker(tokenizer_specs, cache_size=0, cache_dir=None):
+    global _tokenizers, _init_time
+    start = time.perf_counter()
+    _tokenizers = {}
+    for output_name, tokenizer_cls, tokenizer_kwargs in tokenizer_specs:
+        tokenizer = tokenizer_cls(**tokenizer_kwargs)
+        if cache_size > 0 or cache_dir is not None:
+            tokenizer.line_cache = LineCache(
+                get_cache_namespace(output_name, tokenizer_cls, tokenizer_kwargs),
+                max_size=cache_size,
+                cache_dir=cache_dir
+            )
+        _tokenizers[output_name] = tokenizer
+    _init_time = time.perf_counter() - start
+
+def get_checkpoint_path(temp_path):
+    return os.path.splitext(temp_path)[0] + ".result.pkl"
+
+def save_checkpoint(temp_path, output):
+    # 中間ファイルを書き終えてから結果を書き出し、結果があるジョブを完了とみなす
+    with DataUtils.atomic_open(get_checkpoint_path(temp_path), "wb") as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_checkpoint(temp_path):
+    """
+    完了済みのジョブの結果を返します。未完了の場合はNoneを返します。
+    """
+    checkpoint_path = get_checkpoint_path(temp_path)
+    if not os.path.exists(checkpoint_path) or not os.path.exists(temp_path):
+        return None
+    with open(checkpoint_path, "rb") as f:
+        return pickle.load(f)
+
+def find_ignore_lines(targets):
+    """
+    (ページid, HTMLのパス)のリストを受け取り、各ページの<script>の行番号を返します。
+    """
+    return {page_id:DataUtils.find_script_lines(html_path) for page_id, html_path in targets}
+
+def scan_script_lines(p, html_paths, page_ids, parallel):
+    # 各ページのHTMLから<script>の行を並列に検出する
+    html_targets = [(page_id, html_paths[page_id]) for page_id in page_ids if page_id in html_paths]
+    num_jobs = max(1, min(len(html_targets), parallel * JOBS_PER_WORKER))
+    script_lines = {}
+    for page_script_lines in p.imap_unordered(find_ignore_lines, DataTools.split_array(html_targets, num_jobs)):
+        script_lines.update(page_script_lines)
+    return script_lines
+
+def find_script_annotations(targets):
+    """
+    (ページid, アノテーションの位置, <script>の行)のリストを受け取り、
+    <script>の行にアノテーションがあるページidを返します。
+    """
+    return [
+        page_id for page_id, annotation_location, script_lines in targets
+        if get_annotated_lines(AnnotationIndex.load(annotation_location)) & set(script_lines)
+    ]
+
+def build_html_alignment(chunks):
+    """
+    (ページid, HTMLのパス, プレーンテキストのパス, 書き出し先のリスト)のリストを受け取り、
+    各ページのプレーンテキストからHTMLへのオフセットの対応表を書き出します。
+    """
+    for page_id, html_path, plain_path, file_paths in chunks:
+        alignment = align_html(DataUtils.load_file(html_path), DataUtils.load_file(plain_path))
+        for file_path in file_paths:
+            DataUtils.save_html_alignment(file_path, alignment)
+    return len(chunks)
+
+def set_aside_output(output_dir, stale_dir):
+    """
+    設定が変わった出力を作り直す前に、中間ファイルのフォルダへ移します。
+    前回の出力は作り直しが完了するまで残し、完了後に削除します。
+    """
+    print(
+        f"{output_dir}:トークナイザーの設定が変わったため作り直します。\n"
+        f"前回の出力({', '.join(sorted(os.listdir(output_dir)))})は{stale_dir}に移し、作り直した後に削除します。"
+    )
+    if os.path.exists(stale_dir):
+        shutil.rmtree(stale_dir)
+    os.makedirs(os.path.dirname(stale_dir), exist_ok=True)
+    os.rename(output_dir, stale_dir)
+
+# 変更・削除されたページの以前のトークンの割合がこれを超えたシャードは詰め直す
+COMPACT_DEAD_RATIO = 0.5
+# 詰め直す際に1つのシャードにまとめる最大のトークン数
+COMPACT_SHARD_TOKENS = 1 << 24
+
+def get_shard_ids(shard_dir):
+    return sorted(
+        int(os.path.basename(file_path).split(".")[0])
+        for file_path in glob.glob(os.path.join(shard_dir, "*.ids.bin"))
+    )
+
+def compact_shards(p, shard_dir, page_index):
+    """
+    差分の書き出しでは新しいシャードを追加するのみのため、変更・削除されたページの以前のトークンが残ります。
+    その割合がCOMPACT_DEAD_RATIOを超えたシャードと、参照されないシャードを、有効なページのみで書き直します。
+    新しいシャードとpage_index.jsonを書き出してから古いシャードを削除するため、途中で止まっても読み込めます。
+    page_indexを更新し、削除したシャード数を返します。
+    """
+    shard_ids = get_shard_ids(shard_dir)
+
+    # シャードごとの有効なトークン数
+    lines, live_tokens, pages = {}, Counter(), defaultdict(list)
+    for page_id, (shard_id, line_offset, num_lines) in page_index.items():
+        if shard_id not in lines:
+            lines[shard_id] = DataUtils.mmap_int32(os.path.join(shard_dir, f"{shard_id}.lines.bin"))
+        live_tokens[shard_id] += lines[shard_id][line_offset + num_lines] - lines[shard_id][line_offset]
+        pages[shard_id].append((line_offset, page_id))
+
+    targets = []
+    for shard_id in shard_ids:
+        num_tokens = os.path.getsize(os.path.join(shard_dir, f"{shard_id}.ids.bin")) // 4
+        if shard_id not in pages or num_tokens - live_tokens[shard_id] > num_tokens * COMPACT_DEAD_RATIO:
+            targets.append(shard_id)
+    if len(targets) == 0:
+        return 0
+
+    # 有効なページを、COMPACT_SHARD_TOKENSごとに新しい番号のシャードにまとめる
+    jobs, job_pages, job_tokens = [], [], 0
+    next_shard_id = shard_ids[-1] + 1
+    for shard_id in targets:
+        job_pages += [(page_id, page_index[page_id]) for _, page_id in sorted(pages[shard_id])]
+        job_tokens += live_tokens[shard_id]
+        if job_tokens >= COMPACT_SHARD_TOKENS:
+            jobs.append((shard_dir, next_shard_id, job_pages))
+            job_pages, job_tokens, next_shard_id = [], 0, next_shard_id + 1
+    if len(job_pages) != 0:
+        jobs.append((shard_dir, next_shard_id, job_pages))
+
+    for shard_page_index in p.imap_unordered(DataUtils.compact_tokenized_shard, jobs):
+        page_index.update(shard_page_index)
+    DataUtils.save_file(os.path.join(shard_dir, "page_index.json"), json.dumps(page_index))
+
+    for shard_id in targets:
+        for name in SHARD_ARRAYS:
+            os.remove(os.path.join(shard_dir, f"{shard_id}.{name}.bin"))
+    return len(targets)
+
+def get_annotated_lines(annotation):
+    lines = set()
+    for ann in annotation:
+        if ann.get("text_offset") is None:
+            continue
+        lines.update(range(ann["text_offset"]["start"]["line_id"], ann["text_offset"]["end"]["line_id"] + 1))
+    return lines
+
+def tokenize(inputs):
+    """
+    各ページを一度だけ読み込み、指定された全てのトークナイザーで処理します。
+    正規化は同じ方式のトークナイザー間で使い回します。
+    """
+    global _init_time
+    temp_paths, chunks = inputs
+
+    # 初期化時間は各ワーカーの最初のジョブでのみ報告
+    timings = Counter(init=_init_time, jobs=1, pages=len(chunks))
+    _init_time = 0.0
+    start = time.perf_counter()
+
+    results = {}
+    for output_name in temp_paths:
+        results[output_name] = (Counter(), {}, TokenizedDocuments())
+
+    for page_id, file_path, annotation_location, ignore_lines in chunks:
+        text = DataUtils.load_file(file_path)
+        # アノテーションはワーカー側でページごとに読み込む
+        annotation = None if annotation_location is None else AnnotationIndex.load(annotation_location)
+        # アノテーションがある行は除外しない
+        ignore_lines = set(ignore_lines)
+        if len(ignore_lines) != 0 and annotation is not None:
+            ignore_lines -= get_annotated_lines(annotation)
+
+        normalized_texts = {}
+        for output_name, (errors, mapped_annotation, tokenized_documents) in results.items():
+            tokenizer = _tokenizers[output_name]
+            if tokenizer.normalization not in normalized_texts:
+                normalized_texts[tokenizer.normalization] = tokenizer.normalize(text)
+
+            tokenized_sentences = tokenizer.tokenize_text(normalized_texts[tokenizer.normalization], errors, ignore_lines)
+
+            if annotation is not None:
+                # アノテーションを各トークンにマップ
+                # (トークナイザーごとにtoken_offsetを書き込むため複製する)
+                mapped_annotation[page_id], match_errors = annotation_mapper(
+                    copy.deepcopy(annotation) if len(results) > 1 else annotation,
+                    tokenized_sentences,
+                    patch=tokenizer.patch
+                )
+                errors["total_annotation"] += len(annotation)
+                errors["match"] += match_errors
+
+            tokenized_documents.append(page_id, tokenized_sentences)
+
+    outputs = {}
+    for output_name, (errors, mapped_annotation, tokenized_documents) in results.items():
+        line_cache = _tokenizers[output_name].line_cache
+        if line_cache is not None:
+            line_cache.flush()
+            errors.update(line_cache.pop_stats())
+
+        tokenized_documents.save(temp_paths[output_name])
+        outputs[output_name] = (errors, mapped_annotation, temp_paths[output_name], tokenized_documents.count())
+        save_checkpoint(temp_paths[output_name], outputs[output_name])
+
+    timings["tokenize"] = time.perf_counter() - start
+
+    return outputs, timings
+
+def remap_annotation(inputs):
+    """
+    書き出し済みのトークンを読み込み、アノテーションのみをマップし直します。
+    """
+    output_name, output_dir, output_format, chunks = inputs
+    tokenizer = _tokenizers[output_name]
+
+    errors, mapped_annotation = Counter(), {}
+    for page_id, location, annotation_location in chunks:
+        annotation = AnnotationIndex.load(annotation_location)
+        if output_format == "shard":
+            tokenized_sentences = [
+                [*zip(*line)] for line in ShardedPage.open(os.path.join(output_dir, "shards"), *location)
+            ]
+        else:
+            tokenized_sentences = DataUtils.load_tokenized_file(os.path.join(output_dir, "tokens", f"{page_id}.txt"))
+
+        mapped_annotation[page_id], match_errors = annotation_mapper(annotation, tokenized_sentences, patch=tokenizer.patch)
+        errors["total_annotation"] += len(annotation)
+        errors["match"] += match_errors
+
+    return output_name, errors, mapped_annotation
+
+def run_tokenize(args, shinra, tokenizer_specs):
+    """
+    全カテゴリーをトークナイズします。
+    tokenizer_specsは(出力名, トークナイザーのクラス, 初期化引数)のリストです。
+    複数指定した場合は各ページを一度だけ読み込み、同じワーカー内で全てのトークナイザーに通します。
+    プールは全カテゴリーで共有し、トークナイザーはワーカーごとに一度だけ初期化します。
+    出力先にマニフェスト(各ページのテキストとアノテーションのハッシュ)がある場合は、
+    変わったページのみトークナイズし、アノテーションのみ変わったページはマップし直します。
+    """
+    tokenizer_clses, configs = {}, {}
+    for output_name, tokenizer_cls, tokenizer_kwargs in tokenizer_specs:
+        os.makedirs(os.path.join(args.output_dir, output_name, "_temp_files"), exist_ok=True)
+        tokenizer_clses[output_name] = tokenizer_cls
+        # トークンが変わる設定が変わった場合は差分ではなく全て作り直す
+        # (html_offsets/はトークンによらないため、--html_alignmentは含めず別に作成・削除する)
+        configs[output_name] = hash_config(
+            get_cache_namespace(output_name, tokenizer_cls, tokenizer_kwargs),
+            args.output_format,
+            *(["ignore_script"] if args.ignore_script else [])
+        )
+
+    # 語彙などはワーカーを起動する前に一度だけ読み込む
+    start = time.perf_counter()
+    for output_name, tokenizer_cls, tokenizer_kwargs in tokenizer_specs:
+        tokenizer_cls.preload(**tokenizer_kwargs)
+    preload_time = time.perf_counter() - start
+
+    total_errors = defaultdict(Counter)
+    total_timings = Counter()
+    category_times = {}
+    t = tqdm.tqdm(total=sum(len(shinra.plain_paths[category]) for category in shinra.categories)*(len(tokenizer_specs)+1))
+    initargs = (tokenizer_specs, args.line_cache_size, args.line_cache_dir)
+    with Pool(args.parallel, initializer=init_worker, initargs=initargs) as p:
+        for category in shinra.categories:
+            num_pages = len(shinra.plain_paths[category])
+
+            # 書き出し先フォルダ
+            # 前回の出力とマニフェストがある場合は差分のみ処理する
+            output_dirs, manifests, stale_dirs = {}, {}, {}
+            for output_name in tokenizer_clses:
+                output_dir = os.path.join(
+                    args.output_dir,
+                    output_name,
+                    shinra.to_c_cls(category),
+                    category
+                )
+                stale_dirs[output_name] = os.path.join(args.output_dir, output_name, "_temp_files", "_stale", category)
+                if os.path.exists(os.path.join(output_dir, "vocab.txt")):
+                    manifest = load_manifest(output_dir)
+                    if manifest is None: # マニフェストの無い出力は処理済みとみなす
+                        t.update(num_pages)
+                        continue
+                    if manifest["config"] == configs[output_name]:
+                        manifests[output_name] = manifest
+                    else: # 設定が変わった場合は作り直す
+                        set_aside_output(output_dir, stale_dirs[output_name])
+                output_dirs[output_name] = output_dir
+
+            if len(output_dirs) == 0:
+                t.update(num_pages)
+                continue
+
+            # 各ページのテキストとアノテーションのハッシュ
+            annotation_index = shinra.annotations[category]
+            page_hashes = {}
+            hash_targets = [
+                (page_id, plain_path, annotation_index.locate(page_id))
+                for page_id, plain_path in shinra.plain_paths[category].items()
+            ]
+            num_jobs = max(1, min(len(hash_targets), args.parallel * JOBS_PER_WORKER))
+            for hashes in p.imap_unordered(hash_pages, DataTools.split_array(hash_targets, num_jobs)):
+                page_hashes.update(hashes)
+
+            # 前回からの差分
+            # 再トークナイズするページは全トークナイザーで共通にする
+            target_ids, remap_ids, removed_ids = set(), {}, {}
+            for output_name in output_dirs:
+                if output_name in manifests:
+                    changed, remap_ids[output_name], removed_ids[output_name] = \
+                        diff_manifest(manifests[output_name], page_hashes)
+                else:
+                    changed, remap_ids[output_name], removed_ids[output_name] = set(page_hashes), set(), set()
+                target_ids |= changed
+            for output_name in output_dirs:
+                remap_ids[output_name] -= target_ids
+
+            # --ignore_scriptで除外した行は書き出し済みのトークンが無いため、
+            # アノテーションのみ変わったページでも、除外した行にアノテーションがある場合はトークナイズし直す
+            # 除外した行は前回のマニフェストから引き継ぐ(記録が無い場合はHTMLから検出する)
+            previous_script_lines = {}
+            if args.ignore_script and len(manifests) != 0:
+                for manifest in manifests.values():
+                    previous_script_lines.update(manifest.get("ignore_lines", {}))
+                if not all("ignore_lines" in manifest for manifest in manifests.values()):
+                    previous_script_lines.update(scan_script_lines(
+                        p, shinra.html_paths[category], set(page_hashes) - target_ids, args.parallel
+                    ))
+                script_targets = [
+                    (page_id, annotation_index.locate(page_id), previous_script_lines[page_id])
+                    for page_id in set().union(*remap_ids.values())
+                    if page_id in previous_script_lines and page_id in annotation_index
+                ]
+                num_jobs = max(1, min(len(script_targets), args.parallel * JOBS_PER_WORKER))
+                for page_ids in p.imap_unordered(find_script_annotations, DataTools.split_array(script_targets, num_jobs)):
+                    target_ids.update(page_ids)
+                for output_name in output_dirs:
+                    remap_ids[output_name] -= target_ids
+
+            # プレーンテキストからHTMLへのオフセットの対応表
+            # トークナイズし直すページと、対応表がまだ無いページについて作成する
+            alignment_ids = {}
+            for output_name, output_dir in output_dirs.items():
+                alignment_dir = os.path.join(output_dir, "html_offsets")
+                if args.html_alignment:
+                    existing_ids = {
+                        os.path.splitext(file_name)[0] for file_name in os.listdir(alignment_dir)
+                    } if os.path.isdir(alignment_dir) else set()
+                    alignment_ids[output_name] = {
+                        page_id for page_id in page_hashes
+                        if page_id in shinra.html_paths[category] and (page_id in target_ids or page_id not in existing_ids)
+                    }
+
+            if len(target_ids) == 0 \
+                    and not any(remap_ids.values()) \
+                    and not any(removed_ids.values()) \
+                    and not any(alignment_ids.values()):
+                t.update(num_pages * (len(tokenizer_specs) + 1))
+                continue
+
+            t.set_description(category)
+            category_start = time.perf_counter()
+
+            # <script>の行を検出
+            ignore_lines = {}
+            if args.ignore_script:
+                ignore_lines = scan_script_lines(p, shinra.html_paths[category], target_ids, args.parallel)
+                # マニフェストに記録する各ページの<script>の行(トークナイズし直さないページは前回のもの)
+                manifest_script_lines = {
+                    page_id:lines for page_id, lines in {**previous_script_lines, **ignore_lines}.items()
+                    if page_id in page_hashes and (page_id in ignore_lines or page_id not in target_ids)
+                    and len(lines) != 0
+                }
+
+            # 並列処理のためにジョブ分割
+            targets, sizes = [], []
+            for page_id, plain_path in shinra.plain_paths[category].items():
+                if page_id not in target_ids:
+                    continue
+                targets.append((
+                    page_id,
+                    plain_path,
+                    annotation_index.locate(page_id),
+                    ignore_lines.get(page_id, []),
+                ))
+                sizes.append(shinra.plain_sizes[category][page_id])
+            # テキストサイズで均等に分割し、大きいジョブから順に割り当てる
+            jobs = []
+            if len(targets) != 0:
+                num_jobs = get_num_jobs(sum(sizes), args.parallel)
+                jobs = DataTools.split_array_by_size(targets, sizes, num_jobs)
+
+            # 中間ファイルはトークナイザー・カテゴリー・ジョブの内容ごとに一意な名前にし、
+            # 前回の実行で完了したジョブはやり直さない
+            checkpoint_dirs = {
+                output_name:os.path.join(args.output_dir, output_name, "_temp_files", category)
+                for output_name in output_dirs
+            }
+            for checkpoint_dir in checkpoint_dirs.values():
+                os.makedirs(checkpoint_dir, exist_ok=True)
+
+            finished_outputs = []
+            remaining_jobs = []
+            for job in jobs:
+                job_hashes = [(page_id, *page_hashes[page_id]) for page_id, *_ in job]
+                job_temp_paths = {}
+                for output_name, checkpoint_dir in checkpoint_dirs.items():
+                    temp_path = os.path.join(checkpoint_dir, f"{hash_config(configs[output_name], job_hashes)}.pkl")
+                    output = load_checkpoint(temp_path)
+                    if output is None:
+                        job_temp_paths[output_name] = temp_path
+                    else:
+                        finished_outputs.append((output_name, output))
+                if len(job_temp_paths) != 0:
+                    remaining_jobs.append((job_temp_paths, job))
+            jobs = remaining_jobs
+
+            # トークナイズ
+            total_mapped_annotation = defaultdict(dict)
+            temp_paths, counters = defaultdict(list), defaultdict(list)
+
+            def add_output(output_name, output):
+                errors, mapped_annotation, temp_path, counter = output
+                total_errors[output_name] += errors
+                total_mapped_annotation[output_name].update(mapped_annotation)
+                temp_paths[output_name].append(temp_path)
+                counters[output_name].append(counter)
+
+            for output_name, output in finished_outputs:
+                add_output(output_name, output)
+            for outputs, timings in p.imap_unordered(tokenize, jobs):
+                for output_name, output in outputs.items():
+                    add_output(output_name, output)
+                total_timings += timings
+                t.update(timings["pages"])
+            t.update(num_pages - sum(len(job) for _, job in jobs))
+
+            # テキストが変わらずアノテーションのみ変わったページは、書き出し済みのトークンにマップし直す
+            page_indices = {}
+            jobs = []
+            for output_name, output_dir in output_dirs.items():
+                if output_name in manifests and args.output_format == "shard":
+                    page_indices[output_name] = json.loads(
+                        DataUtils.load_file(os.path.join(output_dir, "shards", "page_index.json"))
+                    )
+                remaps = [(
+                    page_id,
+                    page_indices.get(output_name, {}).get(page_id),
+                    annotation_index.locate(page_id)
+                ) for page_id in remap_ids[output_name] if page_id in annotation_index]
+                num_jobs = max(1, min(len(remaps), args.parallel * JOBS_PER_WORKER))
+                for chunk in DataTools.split_array(remaps, num_jobs):
+                    if len(chunk) != 0:
+                        jobs.append((output_name, output_dir, args.output_format, chunk))
+            for output_name, errors, mapped_annotation in p.imap_unordered(remap_annotation, jobs):
+                total_errors[output_name] += errors
+                total_mapped_annotation[output_name].update(mapped_annotation)
+
+            # プレーンテキストからHTMLへのオフセットの対応表(トークナイザーによらないため1ページにつき一度だけ作成)
+            if args.html_alignment:
+                for output_dir in output_dirs.values():
+                    os.makedirs(os.path.join(output_dir, "html_offsets"), exist_ok=True)
+                alignment_targets = [(
+                    page_id,
+                    shinra.html_paths[category][page_id],
+                    shinra.plain_paths[category][page_id],
+                    [
+                        os.path.join(output_dir, "html_offsets", f"{page_id}.bin")
+                        for output_name, output_dir in output_dirs.items() if page_id in alignment_ids[output_name]
+                    ]
+                ) for page_id in sorted(set().union(*alignment_ids.values()))]
+                num_jobs = max(1, min(len(alignment_targets), args.parallel * JOBS_PER_WORKER))
+                for _ in p.imap_unordered(build_html_alignment, DataTools.split_array(alignment_targets, num_jobs)):
+                    pass
+
+            for output_name, output_dir in output_dirs.items():
+                # 前回の出力のうち、変わっていないページのアノテーション
+                dist_path = os.path.join(output_dir, f"{category}_dist.json")
+                mapped_annotation = defaultdict(list)
+                if output_name in manifests:
+                    stale_ids = target_ids | remap_ids[output_name] | removed_ids[output_name]
+                    for ann in DataUtils.load_oneliner_json(dist_path, parallel=1):
+                        if str(ann["page_id"]) not in stale_ids:
+                            mapped_annotation[str(ann["page_id"])].append(ann)
+                mapped_annotation.update(total_mapped_annotation[output_name])
+
+                assert len(mapped_annotation) == len(annotation_index), \
+                    f"アノテーション数エラー\ntokenizer:{output_name}\ncategory:{category}"
+
+                #　語彙数カウント
+                # 前回の語彙がある場合はidを変えずに新しい語彙を追加する
+                vocab_path = os.path.join(output_dir, "vocab.txt")
+                vocab = count_vocab(
+                    counters[output_name],
+                    vocab=Vocab.load(vocab_path) if output_name in manifests else None
+                )
+
+                # 削除されたページのオフセットの対応表
+                # --html_alignmentが無い場合は、トークナイズし直したページ(テキストが変わった)の対応表も古くなるため削除する
+                stale_alignment_ids = removed_ids[output_name] | (set() if args.html_alignment else target_ids)
+                for page_id in stale_alignment_ids:
+                    file_path = os.path.join(output_dir, "html_offsets", f"{page_id}.bin")
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+
+                num_written = 0
+                if args.output_format == "shard":
+                    # 書き出し先dir作成
+                    shard_dir = os.path.join(output_dir, "shards")
+                    os.makedirs(shard_dir, exist_ok=True)
+
+                    # 前回のシャードは残し、続きの番号で書き出す
+                    page_index = page_indices.get(output_name, {})
+                    for page_id in target_ids | removed_ids[output_name]:
+                        page_index.pop(page_id, None)
+                    first_shard_id = 0
+                    if output_name in manifests:
+                        first_shard_id = 1 + max(get_shard_ids(shard_dir), default=-1)
+
+                    # 並列処理のためのジョブ作成(1ジョブ1シャード)
+                    jobs = []
+                    for shard_id, temp_path in enumerate(temp_paths[output_name], first_shard_id):
+                        jobs.append((
+                            temp_path, vocab, output_dir, shard_id
+                        ))
+
+                    # 書き出し
+                    for num_shard_pages, shard_page_index in p.imap_unordered(DataUtils.save_tokenized_shard, jobs):
+                        page_index.update(shard_page_index)
+                        t.update(num_shard_pages)
+                        num_written += num_shard_pages
+                    DataUtils.save_file(
+                        os.path.join(shard_dir, "page_index.json"),
+                        json.dumps(page_index)
+                    )
+                    # 以前のトークンが多く残ったシャードを詰め直す
+                    if output_name in manifests:
+                        compact_shards(p, shard_dir, page_index)
+                else:
+                    # 書き出し先dir作成
+                    os.makedirs(os.path.join(output_dir, "tokens"), exist_ok=True)
+
+                    # 削除されたページ
+                    for page_id in removed_ids[output_name]:
+                        file_path = os.path.join(output_dir, "tokens", f"{page_id}.txt")
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+
+                    # 並列処理のためのジョブ作成
+                    jobs = []
+                    for temp_path in temp_paths[output_name]:
+                        jobs.append((
+                            temp_path, vocab, output_dir
+                        ))
+
+                    # 書き出し
+                    for num_file_pages in p.imap_unordered(DataUtils.save_tokenized_file, jobs):
+                        t.update(num_file_pages)
+                        num_written += num_file_pages
+                t.update(num_pages - num_written)
+
+                DataUtils.save_oneliner_json(
+                    dist_path,
+                    DataTools.flatten(mapped_annotation.values()),
+                    parallel=1
+                )
+                # vocab.txtがある出力を処理済みとみなすため、書き出し順に注意する
+                # 差分の場合: 語彙->マニフェストの順(途中で落ちても前回のマニフェストとの差分からやり直せる)
+                # 新規の場合: マニフェスト->語彙の順(途中で落ちてもvocab.txtが無いため全てやり直す)
+                script_lines = manifest_script_lines if args.ignore_script else None
+                if output_name in manifests:
+                    vocab.save(vocab_path)
+                    save_manifest(output_dir, configs[output_name], page_hashes, script_lines)
+                else:
+                    save_manifest(output_dir, configs[output_name], page_hashes, script_lines)
+                    vocab.save(vocab_path)
+
+                # 書き出しが完了したため中間ファイルと作り直す前の出力は不要
+                shutil.rmtree(checkpoint_dirs[output_name])
+                if os.path.exists(stale_dirs[output_name]):
+                    shutil.rmtree(stale_dirs[output_name])
+
+            category_times[category] = time.perf_counter() - category_start
+
+    t.close()
+
+    for output_name, tokenizer_cls in tokenizer_clses.items():
+        errors = total_errors[output_name]
+        if errors["total_annotation"] != 0:
+            print(f"[{output_name}]\n"+
+                f"{tokenizer_cls.name}自体のエラー:{errors[tokenizer_cls.error_key]} \n"+
+                f"トークンから復元された文章が異なる例:{errors['consistency']} \n"+
+                f"トークンへのマッピングにより左右のいずれかがずれたアノテーション:{errors['match']/errors['total_annotation']}")
+
+        if errors["ignored_line"] != 0:
+            print(f"[{output_name}]\n"+
+                f"<script>としてトークナイズしなかった行:{errors['ignored_line']}")
+
+        num_lookups = errors["cache_hit"] + errors["cache_miss"]
+        if num_lookups != 0:
+            print(f"[{output_name}]\n"+
+                f"行キャッシュのヒット率:{errors['cache_hit']/num_lookups:.4f} \n"+
+                f"行キャッシュのミス率:{errors['cache_miss']/num_lookups:.4f} \n"+
+                f"ディスク上のキャッシュからのヒット:{errors['cache_disk_hit']}")
+
+    if total_timings["jobs"] != 0:
+        print(f"親プロセスでの読み込み時間:{preload_time:.2f}秒 \n"+
+            f"トークナイザーの初期化時間:{total_timings['init']:.2f}秒 \n"+
+            f"ジョブあたりの初期化時間:{total_timings['init']/total_timings['jobs']:.4f}秒 \n"+
+            f"ジョブあたりのトークナイズ時間:{total_timings['tokenize']/total_timings['jobs']:.4f}秒")
+        for category, category_time in category_times.items():
+            print(f"{category}:{category_time:.2f}秒")
+
+    return [os.path.join(args.output_dir, output_name) for output_name in tokenizer_clses]
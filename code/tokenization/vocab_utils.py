@@ -1,30 +1,174 @@
-from collections import Counter
+import os
+import glob
+import json
+import heapq
+import pickle
+import tempfile
+import shutil
+import zlib
 
+from array import array
+from collections import Counter, defaultdict
 from multiprocessing import Pool
-import multiprocessing as multi
 
-from data_utils import DataUtils
+from data_utils import DataUtils, DataTools, Vocab
 
-def count_vocab_func(file_path):
-    # 並列処理用の関数
-    tokenized_documents = DataUtils.load_oneliner_json(file_path, parallel=1)
+GLOBAL_VOCAB_FILE = "global_vocab.txt"
+# カテゴリーの語彙idから全体の語彙idへの変換表(int32)
+GLOBAL_IDS_FILE = "global_ids.bin"
 
-    total_tokens = []
-    for d in tokenized_documents:
-        for tokens in d["tokens"]:
-            if len(tokens) == 0:
-                continue
-            tokens, *_ = map(list, zip(*tokens))
-            total_tokens += tokens
-    return Counter(total_tokens)
+def merge_counters(counters):
+    total = Counter()
+    for counter in counters:
+        total.update(counter)
+    return total
 
-def count_vocab(file_paths, p_bar=None, parallel=multi.cpu_count()):
+def vocab_order(item):
+    # 出現回数の多い順、同じ場合はトークンの順にして語彙idを再現可能にする
+    token, count = item
+    return -count, token
+
+def sort_vocab(counter):
+    return [token for token, _ in sorted(counter.items(), key=vocab_order)]
+
+def count_vocab(counters, p_bar=None, vocab=None):
     #　語彙数カウント
-    total_vocab = Counter()
-    with Pool(parallel) as p:
-        for vocab in p.imap_unordered(count_vocab_func, file_paths):
-            total_vocab += vocab
-            if p_bar is not None:
-                p_bar.update()
-    total_vocab = [token for token, cnt in total_vocab.most_common()]
-    return total_vocab
+    # vocabを指定した場合は既存のidを保ったまま、新しい語彙を末尾に追加する
+    # (countersはトークナイズのジョブごとのCounterで、ジョブ数は少ないため親でそのまま合計する)
+    counters = list(counters)
+    total_vocab = merge_counters(counters)
+    if p_bar is not None:
+        p_bar.update(len(counters))
+    if vocab is None:
+        vocab = Vocab()
+    for token in sort_vocab(total_vocab):
+        vocab.add(token)
+    return vocab
+
+def get_shard_ranges(shard_dir):
+    """
+    page_index.jsonから、シャードごとの現在のページのトークンの範囲[(開始, 終了), ...]を返します。
+    差分実行で置き換え・削除されたページの残りは数えない様に、ページの範囲のみを対象にします。
+    """
+    page_index = json.loads(DataUtils.load_file(os.path.join(shard_dir, "page_index.json")))
+    pages = defaultdict(list)
+    for shard_id, line_offset, num_lines in page_index.values():
+        pages[shard_id].append((line_offset, num_lines))
+
+    shard_ranges = []
+    for shard_id in sorted(pages):
+        lines = DataUtils.mmap_int32(os.path.join(shard_dir, f"{shard_id}.lines.bin"))
+        ranges = sorted(
+            (lines[line_offset], lines[line_offset + num_lines]) for line_offset, num_lines in pages[shard_id]
+        )
+        shard_ranges.append((os.path.join(shard_dir, f"{shard_id}.ids.bin"), ranges))
+    return shard_ranges
+
+def get_partition(token, num_partitions):
+    # プロセスによらない様に、組み込みのhashではなくcrc32で分ける
+    return zlib.crc32(token.encode("utf-8")) % num_partitions
+
+def get_partition_path(temp_dir, job_id, partition_id):
+    return os.path.join(temp_dir, f"{job_id}.{partition_id}.pkl")
+
+def count_category_tokens(inputs):
+    """
+    カテゴリーの書き出し済みのトークンの一部を読み込み、まとめて語彙ごとの出現回数を数えます。
+    対象はtokens/*.txtのパスか、(shards/*.ids.bin, ページのトークンの範囲のリスト)です。
+    出現回数は語彙のハッシュでnum_partitions個に分け、それぞれtemp_dirに書き出します。
+    """
+    vocab_path, targets, temp_dir, job_id, num_partitions = inputs
+    id_counts = Counter()
+    for target in targets:
+        if isinstance(target, tuple):
+            file_path, ranges = target
+            ids = DataUtils.mmap_int32(file_path)
+            for start, end in ranges:
+                id_counts.update(ids[start:end])
+        else:
+            file_path = target
+            id_counts.update(
+                int(token.split(",", 1)[0])
+                for line in DataUtils.load_file(file_path).split("\n")
+                for token in line.split(" ") if len(token) != 0
+            )
+    vocab = Vocab.load(vocab_path)
+    partitions = [{} for _ in range(num_partitions)]
+    for idx, count in id_counts.items():
+        token = vocab[idx]
+        partitions[get_partition(token, num_partitions)][token] = count
+
+    for partition_id, partition in enumerate(partitions):
+        with open(get_partition_path(temp_dir, job_id, partition_id), "wb") as f:
+            pickle.dump(partition, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return job_id
+
+def reduce_partition(inputs):
+    """
+    全ジョブの同じ範囲の出現回数を合計し、語彙の順に並べた(語彙, 出現回数)のリストを返します。
+    範囲ごとに語彙は重ならないため、各範囲は1つのワーカーで合計が完了します。
+    """
+    temp_dir, partition_id, num_jobs = inputs
+    total = Counter()
+    for job_id in range(num_jobs):
+        with open(get_partition_path(temp_dir, job_id, partition_id), "rb") as f:
+            total.update(pickle.load(f))
+    return sorted(total.items(), key=vocab_order)
+
+def build_global_vocab(args, file_dir):
+    """
+    トークナイザーの出力フォルダの全カテゴリーで共通の語彙を`global_vocab.txt`に書き出し、
+    各カテゴリーのフォルダに語彙idの変換表(`global_ids.bin`)を書き出します。
+    語彙は書き出し済みのトークンから数え直すため、既存の出力にも使えます。
+    各カテゴリーのファイルはワーカー数のジョブに分けて数え、語彙のハッシュで分けた範囲ごとに
+    各ワーカーが全ジョブの出現回数を合計します。親は並べ済みの各範囲を順にマージするのみです。
+    """
+    vocab_paths = sorted(glob.glob(os.path.join(file_dir, "*/*/vocab.txt")))
+    if args.categories is not None:
+        vocab_paths = [
+            vocab_path for vocab_path in vocab_paths
+            if os.path.basename(os.path.dirname(vocab_path)) in args.categories
+        ]
+
+    # 語彙を分ける範囲の数(ワーカーごとに1つ)
+    num_partitions = args.parallel
+    temp_root = os.path.join(file_dir, "_temp_files")
+    os.makedirs(temp_root, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix="global_vocab_", dir=temp_root)
+
+    jobs = []
+    for vocab_path in vocab_paths:
+        category_dir = os.path.dirname(vocab_path)
+        shard_dir = os.path.join(category_dir, "shards")
+        if os.path.exists(os.path.join(shard_dir, "page_index.json")):
+            targets = get_shard_ranges(shard_dir)
+        else:
+            targets = sorted(glob.glob(os.path.join(category_dir, "tokens", "*.txt")))
+        num_jobs = max(1, min(len(targets), args.parallel))
+        for chunk in DataTools.split_array(targets, num_jobs):
+            if len(chunk) != 0:
+                jobs.append((vocab_path, chunk, temp_dir, len(jobs), num_partitions))
+
+    try:
+        with Pool(args.parallel) as p:
+            for _ in p.imap_unordered(count_category_tokens, jobs):
+                pass
+            partitions = p.map(
+                reduce_partition,
+                [(temp_dir, partition_id, len(jobs)) for partition_id in range(num_partitions)],
+                chunksize=1
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+    global_vocab = Vocab(token for token, _ in heapq.merge(*partitions, key=vocab_order))
+    global_vocab.save(os.path.join(file_dir, GLOBAL_VOCAB_FILE))
+    for vocab_path in vocab_paths:
+        # 出現しない語彙(削除されたページのみの語彙)は-1
+        id_table = array("i", [
+            global_vocab.index(token) if token in global_vocab else -1
+            for token in Vocab.load(vocab_path)
+        ])
+        with DataUtils.atomic_open(os.path.join(os.path.dirname(vocab_path), GLOBAL_IDS_FILE), "wb") as f:
+            id_table.tofile(f)
+    return global_vocab
@@ -0,0 +1,229 @@
+import os
+import json
+import shutil
+
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None # --window_lengthを指定しない場合は不要
+
+from data_utils import DataUtils, AnnotationIndex
+from tokenization.decode_utils import get_page_location
+from tokenization.export_utils import load_page_tokens, get_page_ids, load_tokenized_dataset
+
+WINDOW_DIR = "windows"
+# 1つのファイルにまとめるページ数
+PAGES_PER_SHARD = 1000
+# ウィンドウの各ファイル
+WINDOW_ARRAYS = ("ids", "labels", "spans", "lines", "pages")
+# 語彙idの埋め草(語彙idは0始まり)
+PAD_ID = -1
+# IOBラベル
+LABELS = ["O", "B", "I"]
+O, B, I = range(len(LABELS))
+
+def check_numpy():
+    if np is None:
+        raise ModuleNotFoundError("ウィンドウの作成にはnumpyが必要です。\n$ pip install numpy")
+
+def get_window_spans(line_offsets, max_length, stride):
+    """
+    ページの行の境界(トークン位置)から、各ウィンドウの(開始, 終了)トークン位置を返します。
+    ウィンドウは行の先頭から始め、max_length以内に収まるだけの行を詰めます。
+    次のウィンドウは、stride以内で最も後ろの行の先頭(無い場合は次の行の先頭)から始めます。
+    max_lengthより長い行だけは、行の途中でstrideずつずらして分割します。
+    """
+    boundaries = np.unique(line_offsets)
+    total = int(boundaries[-1])
+    spans = []
+    start = 0
+    while start < total:
+        # max_length以内に収まる最後の行の境界
+        end = int(boundaries[np.searchsorted(boundaries, start + max_length, "right") - 1])
+        if end <= start: # 長すぎる行
+            end = min(start + max_length, total)
+        if len(spans) == 0 or spans[-1][1] != end: # 前のウィンドウに含まれる場合は除く
+            spans.append((start, end))
+        if end >= total:
+            break
+
+        # 読み飛ばすトークンが無い様にendを超えない範囲で次の開始位置を決める
+        limit = min(start + stride, end)
+        next_start = int(boundaries[np.searchsorted(boundaries, limit, "right") - 1])
+        if next_start <= start:
+            # stride以内に行の先頭が無い場合は次の行から(行の途中で終わった場合は行の途中から)
+            next_start = int(boundaries[np.searchsorted(boundaries, start, "right")])
+            if next_start > end:
+                next_start = limit
+        start = next_start
+    return np.array(spans, dtype=np.int32).reshape(-1, 2)
+
+def get_page_labels(line_offsets, annotation, attributes, num_tokens):
+    """
+    ページの各トークンの属性ごとのIOBラベル(属性数×トークン数)を返します。
+    """
+    attribute_ids = {attribute:i for i, attribute in enumerate(attributes)}
+    rows = []
+    for ann in annotation:
+        token_offset = ann.get("token_offset")
+        if token_offset is None or ann.get("attribute") not in attribute_ids:
+            continue
+        start, end = token_offset["start"], token_offset["end"]
+        s = line_offsets[start["line_id"]] + start["offset"]
+        e = line_offsets[end["line_id"]] + end["offset"]
+        if 0 <= s < e <= num_tokens:
+            rows.append((attribute_ids[ann["attribute"]], s, e))
+
+    labels = np.full((len(attributes), num_tokens), O, dtype=np.uint8)
+    if len(rows) == 0:
+        return labels
+
+    # 範囲の開始で+1、終了で-1した累積和が正の位置が範囲内
+    rows = np.array(rows, dtype=np.int64)
+    diff = np.zeros((len(attributes), num_tokens + 1), dtype=np.int32)
+    np.add.at(diff, (rows[:, 0], rows[:, 1]), 1)
+    np.add.at(diff, (rows[:, 0], rows[:, 2]), -1)
+    labels[np.cumsum(diff, axis=1)[:, :num_tokens] > 0] = I
+    labels[rows[:, 0], rows[:, 1]] = B
+    return labels
+
+def pack_page(token_ids, line_offsets, annotation, attributes, max_length, stride):
+    """
+    1ページを(ウィンドウの範囲, 語彙id, IOBラベル)の配列にします。
+    ウィンドウの範囲外は語彙idをPAD_ID、ラベルをOで埋めます。
+    """
+    spans = get_window_spans(line_offsets, max_length, stride)
+    page_labels = get_page_labels(line_offsets, annotation, attributes, len(token_ids))
+
+    positions = spans[:, :1] + np.arange(max_length, dtype=np.int32)
+    mask = positions < spans[:, 1:]
+    positions = np.where(mask, positions, 0)
+
+    ids = np.where(mask, token_ids[positions], PAD_ID).astype(np.int32)
+    labels = np.where(mask[:, None, :], page_labels[:, positions].transpose(1, 0, 2), O).astype(np.uint8)
+    # 範囲の途中から始まるウィンドウでは先頭をBにする
+    first = labels[:, :, 0]
+    first[first == I] = B
+    return spans, ids, labels
+
+def load_page_arrays(location):
+    """
+    ページのトークンを連続した語彙idの配列と、各行の境界(トークン位置)の配列として返します。
+    """
+    lines = [np.asarray(ids, dtype=np.int32) for ids, _, _ in load_page_tokens(location)]
+    line_offsets = np.zeros(len(lines) + 1, dtype=np.int32)
+    np.cumsum([len(ids) for ids in lines], out=line_offsets[1:])
+    token_ids = np.concatenate(lines) if len(lines) != 0 else np.zeros(0, dtype=np.int32)
+    return token_ids, line_offsets
+
+def save_array(file_path, data):
+    with DataUtils.atomic_open(file_path, "wb") as f:
+        np.save(f, data)
+
+def pack_windows(inputs):
+    """
+    1ジョブ分のページのウィンドウをまとめて書き出します。
+    ファイルは語彙id(`ids`)、IOBラベル(`labels`)、各ウィンドウの(ページ番号, 開始, 終了)(`spans`)、
+    各ページの行の境界を連結したもの(`lines`)と、そのページごとの位置(`pages`)の.npyです。
+    """
+    output_dir, shard_id, attributes, max_length, stride, chunks = inputs
+
+    arrays = {name:[] for name in WINDOW_ARRAYS}
+    page_ids, num_lines, num_windows = [], 0, 0
+    for page_id, location, annotation_location in chunks:
+        annotation = [] if annotation_location is None else AnnotationIndex.load(annotation_location)
+        token_ids, line_offsets = load_page_arrays(location)
+        spans, ids, labels = pack_page(token_ids, line_offsets, annotation, attributes, max_length, stride)
+
+        arrays["spans"].append(np.concatenate([np.full((len(spans), 1), len(page_ids), dtype=np.int32), spans], axis=1))
+        arrays["ids"].append(ids)
+        arrays["labels"].append(labels)
+        arrays["lines"].append(line_offsets)
+        arrays["pages"].append(num_lines)
+        page_ids.append(page_id)
+        num_lines += len(line_offsets)
+        num_windows += len(spans)
+    arrays["pages"].append(num_lines)
+
+    shapes = {
+        "ids":(0, max_length),
+        "labels":(0, len(attributes), max_length),
+        "spans":(0, 3),
+        "lines":(0,),
+    }
+    for name, data in arrays.items():
+        if name == "pages":
+            data = np.array(data, dtype=np.int32)
+        elif len(data) == 0:
+            data = np.zeros(shapes[name], dtype=np.uint8 if name == "labels" else np.int32)
+        else:
+            data = np.concatenate(data)
+        save_array(os.path.join(output_dir, f"{shard_id}.{name}.npy"), data)
+
+    return output_dir, shard_id, page_ids, num_windows
+
+def pack_dataset(args, file_dir, max_length, stride=None):
+    """
+    トークナイザーの出力フォルダの各カテゴリーを、max_lengthトークンのウィンドウにして
+    カテゴリーのフォルダの`windows/`に書き出します。
+    全カテゴリーのページをPAGES_PER_SHARDごとのジョブに分け、まとめて並列に処理します。
+    """
+    check_numpy()
+    if stride is None:
+        stride = max_length
+    assert 0 < stride <= max_length, "strideは1以上max_length以下である必要があります。"
+
+    tokenized_dataset = load_tokenized_dataset(args, file_dir)
+
+    jobs, indexes = [], {}
+    for category in tokenized_dataset.categories:
+        output_dir = os.path.join(tokenized_dataset.category_dirs[category], WINDOW_DIR)
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir)
+
+        annotations = tokenized_dataset.annotations[category]
+        attributes = sorted({
+            ann["attribute"] for annotation in annotations.values() for ann in annotation
+            if ann.get("token_offset") is not None
+        })
+        targets = [
+            (page_id, get_page_location(tokenized_dataset, category, page_id), annotations.locate(page_id))
+            for page_id in get_page_ids(tokenized_dataset, category)
+        ]
+        chunks = [targets[idx:idx + PAGES_PER_SHARD] for idx in range(0, len(targets), PAGES_PER_SHARD)]
+        indexes[output_dir] = {
+            "max_length":max_length,
+            "stride":stride,
+            "pad_id":PAD_ID,
+            "labels":LABELS,
+            "attributes":attributes,
+            "shards":[None] * len(chunks),
+        }
+        jobs += [
+            (output_dir, shard_id, attributes, max_length, stride, chunk)
+            for shard_id, chunk in enumerate(chunks)
+        ]
+
+    with Pool(args.parallel) as p:
+        for output_dir, shard_id, page_ids, num_windows in p.imap_unordered(pack_windows, jobs):
+            indexes[output_dir]["shards"][shard_id] = {"pages":page_ids, "num_windows":num_windows}
+
+    for output_dir, index in indexes.items():
+        DataUtils.save_file(os.path.join(output_dir, "index.json"), json.dumps(index, ensure_ascii=False))
+        num_windows = sum(shard["num_windows"] for shard in index["shards"])
+        print(f"{output_dir}:{num_windows}ウィンドウ")
+
+def load_windows(window_dir):
+    """
+    `windows/`のインデックスと、各ファイルをメモリマップした配列の辞書のリストを返します。
+    """
+    check_numpy()
+    index = json.loads(DataUtils.load_file(os.path.join(window_dir, "index.json")))
+    shards = [
+        {name:np.load(os.path.join(window_dir, f"{shard_id}.{name}.npy"), mmap_mode="r") for name in WINDOW_ARRAYS}
+        for shard_id in range(len(index["shards"]))
+    ]
+    return index, shards